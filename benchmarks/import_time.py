@@ -0,0 +1,75 @@
+"""
+Cold start benchmark: time to import sommelier and build one simple query in a fresh interpreter, the cost paid by
+every short lived process, i.e. a serverless function. Pypika, the cost and star-tree modules are only imported when
+they are used.
+
+The budget applies to sommelier's own modules: the standard library modules it uses are imported before the clock
+starts, since most processes load them anyway, and the sources are byte compiled first like in an installed package.
+
+Usage: PYTHONPATH=src python benchmarks/import_time.py [--budget-ms 10] [--runs 5]
+"""
+import argparse
+import compileall
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import sommelier
+
+DEFAULT_BUDGET_MS = 10.0
+DEFAULT_RUNS = 5
+
+COLD_START = '''
+import json, sys, time
+import collections, copy, datetime, enum, re, threading, types, typing, warnings
+start = time.perf_counter()
+import sommelier
+from sommelier.query_builder.metrics_table import MetricsTable
+query = MetricsTable(
+    table_name='flights',
+    dimension_columns={'airport': str},
+    metrics_columns={'price': int},
+    datetime_columns={},
+).select_columns(['airport', 'SUM(price)']).filter_column_by_value('airport', ['SFO', 'JFK'], 'in').group_by('airport')
+built = time.perf_counter()
+pypika_loaded = 'pypika' in sys.modules
+sql = query.get_sql_query()
+compiled = time.perf_counter()
+print(json.dumps({'build_ms': (built - start) * 1000, 'compile_ms': (compiled - built) * 1000,
+                  'pypika_loaded_before_compile': pypika_loaded}))
+'''
+
+
+def measure() -> dict:
+    """
+    :return: dict of the import and build time, the compile time and whether pypika was imported before compiling
+    """
+    output = subprocess.run([sys.executable, '-c', COLD_START], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Maximum median import and build time')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    arguments = parser.parse_args()
+
+    compileall.compile_dir(os.path.dirname(sommelier.__file__), quiet=1)
+    results = [measure() for _ in range(arguments.runs)]
+    build_ms = statistics.median(result['build_ms'] for result in results)
+    compile_ms = statistics.median(result['compile_ms'] for result in results)
+    print(f'import + build: {build_ms:.1f}ms (budget {arguments.budget_ms:.0f}ms), first compile: {compile_ms:.1f}ms')
+
+    if any(result['pypika_loaded_before_compile'] for result in results):
+        print('pypika was imported before the query was compiled')
+        sys.exit(1)
+    if build_ms > arguments.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from sommelier.execution_stats import ExecutionStats, ExecutionStatsRecorder
+from sommelier.query_builder.instrumentation import PHASE_DECODE, PHASE_NETWORK
+from sommelier.query_builder.table import PINOT_DEFAULT_GROUP_BY_LIMIT
+from sommelier.types import QueryExecutor
+
+# What to do when a group by result may have been truncated
+TRUNCATION_RAISE = 'raise'
+TRUNCATION_RETRY = 'retry'
+
+
+class BrokerError(Exception):
+    """
+    Raised when the Pinot broker returns exceptions in the query response
+    """
+
+    def __init__(self, sql: str, exceptions: List[Dict[str, Any]]):
+        self.sql = sql
+        self.exceptions = exceptions
+        messages = '; '.join(str(exception.get('message', exception)) for exception in exceptions)
+        super(BrokerError, self).__init__(f'Pinot broker returned errors for "{sql}": {messages}')
+
+
+class GroupByTruncatedError(Exception):
+    """
+    Raised when a group by result is (or may be) missing groups because it hit the limit
+    """
+
+    def __init__(self, sql: str, limit: int, reason: str):
+        self.sql = sql
+        self.limit = limit
+        super(GroupByTruncatedError, self).__init__(f'Group by result truncated ({reason}) for "{sql}"')
+
+
+class BrokerResponse:
+    """
+    Thin wrapper around the JSON response of the Pinot broker "/query/sql" endpoint
+
+    See reference at https://docs.pinot.apache.org/users/api/querying-pinot-using-standard-sql/response-format
+    """
+
+    def __init__(self, sql: str, response: Dict[str, Any]):
+        self.sql = sql
+        self.raw = response
+
+        result_table = response.get('resultTable') or {}
+        data_schema = result_table.get('dataSchema') or {}
+        self.column_names: List[str] = data_schema.get('columnNames') or []
+        self.column_types: List[str] = data_schema.get('columnDataTypes') or []
+        self.rows: List[List[Any]] = result_table.get('rows') or []
+        self.stats = ExecutionStats(response)
+        # Set by execute_query when the execution is recorded, see ExecutionStats.get_flags
+        self.flags: List[str] = []
+
+    @property
+    def num_groups_limit_reached(self) -> bool:
+        return self.stats.num_groups_limit_reached
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column_index(self, column: str) -> int:
+        """
+        Find the position of the column in each row
+
+        :param str column: Column name as returned by the broker
+        :return: Index of the column in the rows
+        """
+        try:
+            return self.column_names.index(column)
+        except ValueError:
+            raise KeyError(f'Column "{column}" is not part of the result. Columns: {self.column_names}')
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """
+        Convert the rows into a list of dicts whose keys are the column names
+
+        :return: List of dicts
+        """
+        return [dict(zip(self.column_names, row)) for row in self.rows]
+
+
+def execute_sql(sql: str, executor: QueryExecutor, tracer=None) -> BrokerResponse:
+    """
+    Send the SQL through the executor and wrap the response
+
+    :param str sql: SQL query string
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the JSON response, either
+                                   decoded or as the raw str/bytes body
+    :param sommelier.query_builder.instrumentation.QueryTracer tracer: Times the network and decode phases
+    :return: BrokerResponse instance
+    """
+    if tracer is None:
+        return _decode_response(sql, executor(sql))
+
+    with tracer.phase(PHASE_NETWORK):
+        response = executor(sql)
+    with tracer.phase(PHASE_DECODE):
+        return _decode_response(sql, response)
+
+
+def _decode_response(sql: str, response) -> BrokerResponse:
+    if isinstance(response, (str, bytes)):
+        response = json.loads(response)
+
+    exceptions = response.get('exceptions')
+    if exceptions:
+        raise BrokerError(sql, exceptions)
+
+    return BrokerResponse(sql, response)
+
+
+def execute_query(query,
+                  executor: QueryExecutor,
+                  on_truncation: str = TRUNCATION_RAISE,
+                  recorder: Optional[ExecutionStatsRecorder] = None) -> BrokerResponse:
+    """
+    Compile the query builder into SQL and execute it.
+
+    Queries with a cost budget are checked, and possibly downgraded, before being sent.
+
+    Group by results are never allowed to be silently truncated. When the servers hit their groups limit
+    ("numGroupsLimitReached") a GroupByTruncatedError is raised. When a group by query without an explicit limit
+    returns exactly as many rows as its implicit limit (Pinot's default or the one sized from the cardinalities),
+    more groups may exist: with on_truncation="retry" the query is re-issued with a 10 times larger limit up to the
+    query's "max_group_by_limit", otherwise GroupByTruncatedError is raised. Explicit limits, set with "limit" or
+    "top_n", are intentional and never raise. A GroupByTruncationWarning is emitted when the implicit limit may
+    truncate the groups, see "Table.warn_group_by_limit".
+
+    :param sommelier.query_builder.table.Table query: Query builder instance
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the decoded JSON response
+    :param str on_truncation: "raise" or "retry"
+    :param ExecutionStatsRecorder recorder: Records the execution statistics under the query's fingerprint
+    :return: BrokerResponse instance
+    """
+    if getattr(query, 'cost_budget', None) is not None:
+        query = query.apply_cost_budget()
+
+    query.warn_group_by_limit()
+    response = _execute_group_by_aware(query, executor, on_truncation)
+    if recorder is not None:
+        response.flags = recorder.record(query, response.stats)
+    return response
+
+
+def get_implicit_group_by_limit(query) -> Optional[int]:
+    """
+    Limit a group by query is truncated to without an explicit limit: Pinot's default or the one sized from the
+    cardinalities. Getting that many rows back means more groups may exist
+
+    :param query: Query builder instance
+    :return: Limit or None when the query isn't a group by or has an explicit limit
+    """
+    if not query.group_by_terms or query.row_limit:
+        return None
+    return query.get_effective_limit() or PINOT_DEFAULT_GROUP_BY_LIMIT
+
+
+def _execute_group_by_aware(query, executor: QueryExecutor, on_truncation: str) -> BrokerResponse:
+    tracer = query.get_tracer()
+    sql = query.get_sql_query()
+    response = execute_sql(sql, executor, tracer)
+
+    if not query.group_by_terms:
+        return response
+
+    if response.num_groups_limit_reached:
+        raise GroupByTruncatedError(sql, len(response), 'numGroupsLimitReached')
+
+    # Getting exactly "limit" rows back is expected for explicit limits, i.e. top-N queries
+    limit = get_implicit_group_by_limit(query)
+    if limit is None:
+        return response
+
+    while len(response) >= limit:
+        if on_truncation != TRUNCATION_RETRY or limit >= query.max_group_by_limit:
+            raise GroupByTruncatedError(sql, limit, f'returned {len(response)} rows for a limit of {limit}')
+
+        limit = min(limit * 10, query.max_group_by_limit)
+        sql = query.copy().limit(limit).get_sql_query()
+        response = execute_sql(sql, executor, tracer)
+
+        if response.num_groups_limit_reached:
+            raise GroupByTruncatedError(sql, len(response), 'numGroupsLimitReached')
+
+    return response
@@ -0,0 +1,193 @@
+import math
+from collections import deque
+from threading import Lock
+from typing import Any, Deque, Dict, List, Optional
+
+# A filter reading more than this fraction of the table's rows is most likely evaluated without an index
+MISSING_INDEX_SCAN_RATIO = 0.1
+# With a time filter, at least this fraction of the queried segments are expected to be pruned
+MIN_TIME_PRUNED_RATIO = 0.01
+
+FLAG_MISSING_INDEX = 'missing_index'
+FLAG_TIME_PRUNING_FAILED = 'time_pruning_failed'
+FLAG_GROUPS_LIMIT_REACHED = 'groups_limit_reached'
+
+DEFAULT_WINDOW = 1000
+
+
+def percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+    """
+    Nearest rank percentile
+
+    :param list sorted_values: Values sorted in ascending order
+    :param float percent: Between 0 and 100
+    :return: The percentile or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class ExecutionStats:
+    """
+    Execution statistics the Pinot broker returns with every query response.
+    See reference at https://docs.pinot.apache.org/users/api/querying-pinot-using-standard-sql/response-format
+    """
+
+    def __init__(self, response: Dict[str, Any]):
+        self.time_used_ms: int = response.get('timeUsedMs', 0)
+        self.num_docs_scanned: int = response.get('numDocsScanned', 0)
+        self.total_docs: int = response.get('totalDocs', 0)
+        self.num_entries_scanned_in_filter: int = response.get('numEntriesScannedInFilter', 0)
+        self.num_entries_scanned_post_filter: int = response.get('numEntriesScannedPostFilter', 0)
+        self.num_segments_queried: int = response.get('numSegmentsQueried', 0)
+        self.num_segments_processed: int = response.get('numSegmentsProcessed', 0)
+        self.num_segments_matched: int = response.get('numSegmentsMatched', 0)
+        self.num_servers_queried: int = response.get('numServersQueried', 0)
+        self.num_servers_responded: int = response.get('numServersResponded', 0)
+        self.num_groups_limit_reached: bool = bool(response.get('numGroupsLimitReached', False))
+
+        if 'numSegmentsPruned' in response:
+            self.num_segments_pruned: int = response['numSegmentsPruned']
+        else:
+            self.num_segments_pruned = response.get('numSegmentsPrunedByBroker', 0) + \
+                response.get('numSegmentsPrunedByServer', 0)
+
+    def __repr__(self):
+        return (f'ExecutionStats(time_used_ms={self.time_used_ms}, num_docs_scanned={self.num_docs_scanned}, '
+                f'num_entries_scanned_in_filter={self.num_entries_scanned_in_filter}, total_docs={self.total_docs}, '
+                f'num_segments_queried={self.num_segments_queried}, num_segments_pruned={self.num_segments_pruned})')
+
+    @property
+    def filter_scan_ratio(self) -> float:
+        """
+        Values read by the filter per row of the table. Close to 0 when the predicates use indexes
+        """
+        if not self.total_docs:
+            return 0.0
+        return self.num_entries_scanned_in_filter / self.total_docs
+
+    @property
+    def pruned_ratio(self) -> float:
+        if not self.num_segments_queried:
+            return 0.0
+        return self.num_segments_pruned / self.num_segments_queried
+
+    def get_flags(self, has_time_filter: bool = False) -> List[str]:
+        """
+        :param bool has_time_filter: Whether the query filters on a time column
+        :return: List of the FLAG_* constants that apply
+        """
+        return get_flags(self.filter_scan_ratio, self.pruned_ratio, self.num_segments_queried, has_time_filter,
+                         self.num_groups_limit_reached)
+
+
+def get_flags(filter_scan_ratio: float,
+              pruned_ratio: float,
+              num_segments_queried: int,
+              has_time_filter: bool,
+              num_groups_limit_reached: bool = False) -> List[str]:
+    flags = []
+    if filter_scan_ratio > MISSING_INDEX_SCAN_RATIO:
+        flags.append(FLAG_MISSING_INDEX)
+    if has_time_filter and num_segments_queried > 1 and pruned_ratio < MIN_TIME_PRUNED_RATIO:
+        flags.append(FLAG_TIME_PRUNING_FAILED)
+    if num_groups_limit_reached:
+        flags.append(FLAG_GROUPS_LIMIT_REACHED)
+    return flags
+
+
+class FingerprintSummary:
+    """
+    Aggregate of the latest executions of the queries sharing a fingerprint
+    """
+
+    def __init__(self,
+                 fingerprint: str,
+                 count: int,
+                 p50_ms: float,
+                 p99_ms: float,
+                 filter_scan_ratio: float,
+                 pruned_ratio: float,
+                 flags: List[str]):
+        self.fingerprint = fingerprint
+        self.count = count
+        self.p50_ms = p50_ms
+        self.p99_ms = p99_ms
+        self.filter_scan_ratio = filter_scan_ratio
+        self.pruned_ratio = pruned_ratio
+        self.flags = flags
+
+    def __repr__(self):
+        return (f'FingerprintSummary({self.fingerprint!r}, count={self.count}, p50_ms={self.p50_ms}, '
+                f'p99_ms={self.p99_ms}, filter_scan_ratio={self.filter_scan_ratio:.4f}, flags={self.flags})')
+
+
+class ExecutionStatsRecorder:
+    """
+    Rolling window of the execution statistics per query fingerprint, see "Table.get_fingerprint". Thread safe.
+
+    int window - Number of executions kept per fingerprint
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.window = window
+        self._executions: Dict[str, Deque[ExecutionStats]] = {}
+        self._has_time_filter: Dict[str, bool] = {}
+        self._lock = Lock()
+
+    def record(self, query, stats: ExecutionStats) -> List[str]:
+        """
+        :param query: Query builder instance that was executed
+        :param ExecutionStats stats: Statistics of the execution
+        :return: Flags of this execution
+        """
+        fingerprint = query.get_fingerprint()
+        has_time_filter = any(column in getattr(query, 'datetime_columns', {}) for column, _, _ in query.iter_filters())
+
+        with self._lock:
+            if fingerprint not in self._executions:
+                self._executions[fingerprint] = deque(maxlen=self.window)
+            self._executions[fingerprint].append(stats)
+            self._has_time_filter[fingerprint] = has_time_filter
+
+        return stats.get_flags(has_time_filter)
+
+    def fingerprints(self) -> List[str]:
+        with self._lock:
+            return list(self._executions)
+
+    def summary(self, fingerprint: str) -> Optional[FingerprintSummary]:
+        """
+        :param str fingerprint: Query fingerprint
+        :return: FingerprintSummary or None if no execution was recorded for the fingerprint
+        """
+        with self._lock:
+            executions = list(self._executions.get(fingerprint, ()))
+            has_time_filter = self._has_time_filter.get(fingerprint, False)
+
+        if not executions:
+            return None
+
+        latencies = sorted(stats.time_used_ms for stats in executions)
+        filter_scan_ratio = percentile(sorted(stats.filter_scan_ratio for stats in executions), 50)
+        pruned_ratio = percentile(sorted(stats.pruned_ratio for stats in executions), 50)
+        num_segments_queried = max(stats.num_segments_queried for stats in executions)
+        flags = get_flags(filter_scan_ratio, pruned_ratio, num_segments_queried, has_time_filter,
+                          any(stats.num_groups_limit_reached for stats in executions))
+
+        return FingerprintSummary(fingerprint=fingerprint,
+                                  count=len(executions),
+                                  p50_ms=percentile(latencies, 50),
+                                  p99_ms=percentile(latencies, 99),
+                                  filter_scan_ratio=filter_scan_ratio,
+                                  pruned_ratio=pruned_ratio,
+                                  flags=flags)
+
+    def flagged(self) -> List[FingerprintSummary]:
+        """
+        :return: Summaries of the fingerprints with at least one flag
+        """
+        summaries = [self.summary(fingerprint) for fingerprint in self.fingerprints()]
+        return [summary for summary in summaries if summary and summary.flags]
@@ -0,0 +1,437 @@
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from sommelier.broker import BrokerResponse, execute_sql
+from sommelier.query_builder.cost import INDEX_INVERTED, INDEX_JSON, INDEX_RANGE, INDEX_SORTED, INDEX_TEXT
+from sommelier.types import QueryExecutor
+
+EXPLAIN_PREFIX = 'EXPLAIN PLAN FOR '
+EXPLAIN_COLUMN_NAMES = ['Operator', 'Operator_Id', 'Parent_Id']
+EXPLAIN_COLUMN_TYPES = ['STRING', 'INT', 'INT']
+
+# Row marking the start of a plan shared by some of the segments, it is not part of the operator tree
+PLAN_START = 'PLAN_START'
+
+# Pinot error code of the responses of RecordedPlans without a plan
+ERROR_CODE_NO_PLAN = 200
+
+INDEX_STAR_TREE = 'star_tree'
+INDEX_H3 = 'h3'
+
+# Filter operators of the plans and the index they use, None for the ones that scan the column values
+FILTER_OPERATOR_INDEXES = {
+    'FILTER_SORTED_INDEX': INDEX_SORTED,
+    'FILTER_INVERTED_INDEX': INDEX_INVERTED,
+    'FILTER_RANGE_INDEX': INDEX_RANGE,
+    'FILTER_JSON_INDEX': INDEX_JSON,
+    'FILTER_TEXT_INDEX': INDEX_TEXT,
+    'FILTER_H3_INDEX': INDEX_H3,
+    'FILTER_STARTREE_INDEX': INDEX_STAR_TREE,
+    'FILTER_FULL_SCAN': None,
+    'FILTER_EXPRESSION': None,
+}
+
+# Filter operators combining other filters
+FILTER_COMBINATORS = frozenset(('FILTER_AND', 'FILTER_OR', 'FILTER_NOT'))
+
+# Filter operators that don't read any column: segments entirely matched or not matched
+FILTER_WITHOUT_PREDICATE = frozenset(('FILTER_MATCH_ENTIRE_SEGMENT', 'FILTER_EMPTY'))
+
+FUNCTION_PREDICATE_COLUMN = re.compile(r'\s*\w+\s*\(\s*"?([\w.$]+)')
+PREDICATE_COLUMN = re.compile(r'\s*"?([\w.$]+)')
+
+
+class FullScanError(Exception):
+    """
+    Raised when the plan of a query scans the values of filtered columns instead of using an index
+    """
+
+    def __init__(self, sql: str, full_scans: List['PredicateUsage']):
+        self.sql = sql
+        self.full_scans = full_scans
+        predicates = '; '.join(usage.predicate or usage.operator for usage in full_scans)
+        super(FullScanError, self).__init__(f'Full scan of {predicates} for "{sql}"')
+
+
+def get_explain_sql(sql: str) -> str:
+    return f'{EXPLAIN_PREFIX}{sql}'
+
+
+def strip_explain_prefix(sql: str) -> Optional[str]:
+    """
+    :param str sql: SQL query string
+    :return: The explained query, or None if the SQL is not an EXPLAIN PLAN query
+    """
+    stripped = sql.lstrip()
+    if stripped[:len(EXPLAIN_PREFIX)].upper() == EXPLAIN_PREFIX.upper():
+        return stripped[len(EXPLAIN_PREFIX):].strip()
+    return None
+
+
+def _split_attributes(text: str) -> Iterator[str]:
+    # Commas inside quotes or parentheses belong to the attribute value. i.e. predicate:airport IN ('SFO','JFK')
+    depth = 0
+    quoted = False
+    start = 0
+    for position, character in enumerate(text):
+        if character == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        elif character == ',' and depth == 0:
+            yield text[start:position]
+            start = position + 1
+    if text[start:]:
+        yield text[start:]
+
+
+def parse_operator(operator: str):
+    """
+    Split an operator of a plan into its name and attributes.
+    i.e. "FILTER_INVERTED_INDEX(indexLookUp:inverted_index,operator:EQ,predicate:airport = 'SFO')"
+
+    :param str operator: Operator column of a plan row
+    :return: Tuple of the name and a dict of the attributes
+    """
+    opening = operator.find('(')
+    if opening == -1 or not operator.endswith(')'):
+        return operator.strip(), {}
+
+    attributes = {}
+    for attribute in _split_attributes(operator[opening + 1:-1]):
+        key, separator, value = attribute.partition(':')
+        if separator:
+            attributes[key.strip()] = value.strip()
+    return operator[:opening].strip(), attributes
+
+
+class PlanNode:
+    """
+    Operator of a query plan
+
+    str operator - The operator as returned by the broker
+    str name - Operator name. i.e. FILTER_INVERTED_INDEX
+    dict attributes - Operator attributes. i.e. {'operator': 'EQ', 'predicate': "airport = 'SFO'"}
+    list children - Child operators
+    """
+
+    def __init__(self, operator: str, operator_id: int, parent_id: int):
+        self.operator = operator
+        self.operator_id = operator_id
+        self.parent_id = parent_id
+        self.name, self.attributes = parse_operator(operator)
+        self.children: List['PlanNode'] = []
+
+    def __repr__(self):
+        return f'PlanNode({self.operator!r})'
+
+    def walk(self) -> Iterator['PlanNode']:
+        """
+        :return: Generator of this node and its descendants, depth first
+        """
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class PredicateUsage:
+    """
+    How one predicate of the filter is evaluated in the plan
+
+    str predicate - The predicate. i.e. airport = 'SFO'
+    str column - Filtered column, None if it could not be found in the predicate
+    str operator - Plan operator name. i.e. FILTER_RANGE_INDEX
+    str index - Index used, see FILTER_OPERATOR_INDEXES. None for a full scan
+    """
+
+    def __init__(self, node: PlanNode):
+        self.predicate: Optional[str] = node.attributes.get('predicate')
+        self.column = get_predicate_column(self.predicate) if self.predicate else None
+        self.operator = node.name
+        self.index = FILTER_OPERATOR_INDEXES.get(node.name)
+
+    def __repr__(self):
+        return f'PredicateUsage({self.predicate!r}, index={self.index!r})'
+
+    @property
+    def full_scan(self) -> bool:
+        return self.index is None
+
+
+def get_predicate_column(predicate: str) -> Optional[str]:
+    """
+    :param str predicate: Predicate of a plan. i.e. "price > '10'" or "regexp_like(model,'^A')"
+    :return: Column name
+    """
+    matches = FUNCTION_PREDICATE_COLUMN.match(predicate) or PREDICATE_COLUMN.match(predicate)
+    return matches.group(1) if matches else None
+
+
+class ExplainPlan:
+    """
+    Operator tree of an EXPLAIN PLAN response. Segments can have different plans, each one starts with a PLAN_START
+    row so the tree can have several filter sub-trees
+
+    str sql - The explained query
+    list roots - Operators without a parent
+    list nodes - All the operators in the order of the response
+    """
+
+    def __init__(self, sql: str, rows: Iterable[List[Any]]):
+        self.sql = sql
+        self.nodes: List[PlanNode] = []
+        self.plan_starts: List[PlanNode] = []
+        self.roots: List[PlanNode] = []
+
+        nodes_by_id: Dict[int, PlanNode] = {}
+        for operator, operator_id, parent_id in rows:
+            node = PlanNode(operator, int(operator_id), int(parent_id))
+            if node.name == PLAN_START:
+                self.plan_starts.append(node)
+                continue
+            self.nodes.append(node)
+            nodes_by_id[node.operator_id] = node
+
+        for node in self.nodes:
+            parent = nodes_by_id.get(node.parent_id)
+            if parent is None or parent is node:
+                self.roots.append(node)
+            else:
+                parent.children.append(node)
+
+    @classmethod
+    def from_response(cls, response: BrokerResponse) -> 'ExplainPlan':
+        sql = strip_explain_prefix(response.sql)
+        return cls(sql if sql is not None else response.sql, response.rows)
+
+    def __repr__(self):
+        return f'ExplainPlan({self.sql!r})'
+
+    def format(self) -> str:
+        """
+        :return: The operators indented under their parent
+        """
+        lines = []
+
+        def add(node: PlanNode, depth: int):
+            lines.append(f'{"  " * depth}{node.operator}')
+            for child in node.children:
+                add(child, depth + 1)
+
+        for root in self.roots:
+            add(root, 0)
+        return '\n'.join(lines)
+
+    def find(self, name: str) -> List[PlanNode]:
+        """
+        :param str name: Operator name or prefix. i.e. FILTER_ or FILTER_FULL_SCAN
+        :return: Operators whose name starts with it
+        """
+        return [node for node in self.nodes if node.name.startswith(name)]
+
+    def get_predicate_usages(self) -> List[PredicateUsage]:
+        """
+        :return: How every predicate of every plan is evaluated
+        """
+        return [PredicateUsage(node) for node in self.nodes
+                if node.name.startswith('FILTER_') and node.name not in FILTER_COMBINATORS
+                and node.name not in FILTER_WITHOUT_PREDICATE]
+
+    def get_index_usage(self) -> 'IndexUsageReport':
+        return IndexUsageReport(self)
+
+
+class IndexUsageReport:
+    """
+    Summary of the indexes used by the filters of a plan
+
+    ExplainPlan plan - The plan
+    list predicates - PredicateUsage of every predicate
+    list full_scans - Predicates evaluated by scanning the column values
+    bool uses_star_tree - Whether segments are answered from a star-tree
+    """
+
+    def __init__(self, plan: ExplainPlan):
+        self.plan = plan
+        self.predicates = plan.get_predicate_usages()
+        self.full_scans = [usage for usage in self.predicates if usage.full_scan]
+        self.uses_star_tree = any(usage.index == INDEX_STAR_TREE for usage in self.predicates)
+
+    def __repr__(self):
+        return f'IndexUsageReport(indexes={self.by_column()!r}, full_scans={len(self.full_scans)})'
+
+    @property
+    def has_full_scan(self) -> bool:
+        return bool(self.full_scans)
+
+    def by_column(self) -> Dict[str, List[Optional[str]]]:
+        """
+        :return: dict of the filtered columns to the distinct indexes their predicates use, None for a full scan
+        """
+        indexes: Dict[str, List[Optional[str]]] = OrderedDict()
+        for usage in self.predicates:
+            if usage.column is None:
+                continue
+            column_indexes = indexes.setdefault(usage.column, [])
+            if usage.index not in column_indexes:
+                column_indexes.append(usage.index)
+        return indexes
+
+    def for_filters(self, query) -> List[Dict[str, Any]]:
+        """
+        Match the filters of the query to the predicates of the plan
+
+        :param query: The explained query builder instance
+        :return: List of dicts with the "column", "operator", "value" and "indexes" of every filter. The indexes are
+                 empty when the predicate is not in the plan, i.e. it is answered by the star-tree or the segments
+                 were pruned
+        """
+        indexes = self.by_column()
+        return [{'column': column, 'operator': operator, 'value': value, 'indexes': indexes.get(column, [])}
+                for column, operator, value in query.iter_filters()]
+
+    def check(self, allow_full_scan: Iterable[str] = ()):
+        """
+        CI gate on the plan
+
+        :param allow_full_scan: Columns whose predicates are allowed to scan, i.e. low selectivity filters
+        :raises FullScanError: When any other predicate scans the column values
+        """
+        allowed = frozenset(allow_full_scan)
+        full_scans = [usage for usage in self.full_scans if usage.column not in allowed]
+        if full_scans:
+            raise FullScanError(self.plan.sql, full_scans)
+
+
+def explain_sql(sql: str, executor: QueryExecutor, tracer=None) -> ExplainPlan:
+    """
+    :param str sql: SQL query string
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the JSON response
+    :param tracer: Optional QueryTracer
+    :return: ExplainPlan instance
+    """
+    return ExplainPlan.from_response(execute_sql(get_explain_sql(sql), executor, tracer))
+
+
+def explain_query(query, executor: QueryExecutor) -> ExplainPlan:
+    """
+    Compile the query builder and execute it wrapped in "EXPLAIN PLAN FOR"
+
+    Example:
+
+    report = explain_query(query, executor).get_index_usage()
+    report.by_column()  # {'airport': ['inverted'], 'price': ['range']}
+    report.check(allow_full_scan=['model'])
+
+    :param query: Query builder instance
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the JSON response
+    :return: ExplainPlan instance
+    """
+    return explain_sql(query.get_sql_query(), executor, query.get_tracer())
+
+
+def check_index_usage(query, executor: QueryExecutor, allow_full_scan: Iterable[str] = ()) -> IndexUsageReport:
+    """
+    Fail when the plan of the query scans a filtered column, for CI gates against a broker or recorded plans
+
+    :param query: Query builder instance
+    :param QueryExecutor executor: Broker or a "RecordedPlans" executor
+    :param allow_full_scan: Columns whose predicates are allowed to scan
+    :return: IndexUsageReport instance
+    :raises FullScanError: When a predicate of another column scans the column values
+    """
+    report = explain_query(query, executor).get_index_usage()
+    report.check(allow_full_scan)
+    return report
+
+
+def _normalize_sql(sql: str) -> str:
+    return ' '.join(sql.split())
+
+
+class RecordedPlans:
+    """
+    Plans recorded from a broker, replayed as EXPLAIN PLAN responses so index usage can be checked without a cluster.
+    It is a QueryExecutor; other queries are sent to the fallback executor, i.e. a LocalEngine.
+
+    Record once against a broker then replay:
+
+    plans = RecordedPlans.record(broker_executor, [query.get_sql_query() for query in queries])
+    plans.save('plans.json')
+    check_index_usage(query, RecordedPlans.load('plans.json'))
+
+    dict plans - Explained SQL to the plan rows
+    QueryExecutor fallback - Executes the queries that are not EXPLAIN PLAN
+    """
+
+    def __init__(self, plans: Optional[Dict[str, List[List[Any]]]] = None, fallback: Optional[QueryExecutor] = None):
+        self.plans: Dict[str, List[List[Any]]] = {}
+        self.fallback = fallback
+        for sql, rows in (plans or {}).items():
+            self.add(sql, rows)
+
+    def __len__(self):
+        return len(self.plans)
+
+    def __contains__(self, sql: str) -> bool:
+        return _normalize_sql(sql) in self.plans
+
+    def add(self, sql: str, rows: List[List[Any]]):
+        """
+        :param str sql: The explained SQL, without the EXPLAIN PLAN FOR prefix
+        :param list rows: Operator, operator id and parent id of every operator
+        """
+        self.plans[_normalize_sql(sql)] = [list(row) for row in rows]
+        return self
+
+    def get_response(self, sql: str) -> Dict[str, Any]:
+        """
+        :param str sql: The explained SQL
+        :return: Broker response of the EXPLAIN PLAN query, with an error when no plan was recorded
+        """
+        rows = self.plans.get(_normalize_sql(sql))
+        if rows is None:
+            return {'exceptions': [{'errorCode': ERROR_CODE_NO_PLAN, 'message': f'No recorded plan for "{sql}"'}]}
+        return {
+            'resultTable': {
+                'dataSchema': {'columnNames': EXPLAIN_COLUMN_NAMES, 'columnDataTypes': EXPLAIN_COLUMN_TYPES},
+                'rows': rows,
+            },
+            'exceptions': [],
+        }
+
+    def __call__(self, sql: str):
+        explained = strip_explain_prefix(sql)
+        if explained is not None:
+            return self.get_response(explained)
+        if self.fallback is None:
+            return {'exceptions': [{'errorCode': ERROR_CODE_NO_PLAN,
+                                    'message': f'Only EXPLAIN PLAN queries are recorded: "{sql}"'}]}
+        return self.fallback(sql)
+
+    @classmethod
+    def record(cls, executor: QueryExecutor, sqls: Iterable[str]) -> 'RecordedPlans':
+        """
+        :param QueryExecutor executor: Broker executor
+        :param sqls: SQL queries to explain
+        :return: RecordedPlans instance with the plan of every query
+        """
+        plans = cls()
+        for sql in sqls:
+            plans.add(sql, execute_sql(get_explain_sql(sql), executor).rows)
+        return plans
+
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.plans, file, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path: str, fallback: Optional[QueryExecutor] = None) -> 'RecordedPlans':
+        with open(path) as file:
+            return cls(json.load(file), fallback)
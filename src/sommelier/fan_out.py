@@ -0,0 +1,311 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import pypika
+
+from sommelier.broker import BrokerResponse, GroupByTruncatedError, execute_sql, get_implicit_group_by_limit
+from sommelier.query_builder.cost import is_aggregation
+from sommelier.query_builder.instrumentation import PHASE_RENDER
+from sommelier.query_builder.query_cache import ColumnDependentCache, get_query_columns
+from sommelier.query_builder.spec import get_cache_key
+from sommelier.query_builder.table import FIELD_AGGREGATION_PATTERN
+from sommelier.types import QueryExecutor
+
+OFFLINE_SUFFIX = '_OFFLINE'
+REALTIME_SUFFIX = '_REALTIME'
+
+# Rendered in place of the table name so the SQL is only compiled once
+TABLE_PLACEHOLDER = '__sommelier_fan_out_table__'
+
+# How the values of an aggregation computed on disjoint tables are combined
+MERGE_FUNCTIONS: Dict[str, Callable[[Any, Any], Any]] = {
+    'count': lambda left, right: left + right,
+    'sum': lambda left, right: left + right,
+    'min': min,
+    'max': max,
+}
+
+# Statistics of the per table responses that add up
+SUMMED_STATISTICS = (
+    'numDocsScanned',
+    'totalDocs',
+    'numEntriesScannedInFilter',
+    'numEntriesScannedPostFilter',
+    'numSegmentsQueried',
+    'numSegmentsProcessed',
+    'numSegmentsMatched',
+    'numSegmentsPrunedByBroker',
+    'numSegmentsPrunedByServer',
+    'numServersQueried',
+    'numServersResponded',
+)
+
+
+class UnmergeableAggregationError(ValueError):
+    """
+    Raised when an aggregation can't be combined across tables, i.e. AVG or DISTINCTCOUNT
+    """
+    pass
+
+
+def get_hybrid_table_names(table_name: str) -> List[str]:
+    """
+    The offline and realtime tables of a hybrid table overlap, query them with "fan_out_hybrid" rather than "fan_out"
+    so the rows around the time boundary aren't counted twice
+
+    :param str table_name: Logical table name
+    :return: Names of the offline and realtime tables
+    """
+    return [f'{table_name}{OFFLINE_SUFFIX}', f'{table_name}{REALTIME_SUFFIX}']
+
+
+def get_aggregation_function(term: str) -> Optional[str]:
+    """
+    :param str term: Selected term or result column name. i.e. SUM(price) or sum(price)
+    :return: Lower case function name or None if the term is not an aggregation. Other functions, i.e. the
+             DATETIMECONVERT time buckets, are group keys
+    """
+    if not is_aggregation(term):
+        return None
+    matches = FIELD_AGGREGATION_PATTERN.match(term)
+    return matches.group(1).strip().lower()
+
+
+def check_mergeable(query):
+    """
+    :param query: Query builder instance
+    :raises UnmergeableAggregationError: When a selected aggregation can't be combined across tables
+    """
+    for term in query.selected_terms:
+        function = get_aggregation_function(term)
+        if function is not None and function not in MERGE_FUNCTIONS:
+            raise UnmergeableAggregationError(
+                f'"{term}" can\'t be combined across tables, only {sorted(MERGE_FUNCTIONS)} can. i.e. select SUM and '
+                f'COUNT instead of AVG')
+
+
+class SqlTemplate:
+    """
+    SQL of a query compiled once, rendered for any table name by joining the parts around the table name
+    """
+
+    def __init__(self, query):
+        pypika_query = query.get_query().replace_table(query.get_pypika_table(), pypika.Table(TABLE_PLACEHOLDER))
+
+        tracer = query.get_tracer()
+        if tracer is None:
+            sql = pypika_query.get_sql(quote_char=None)
+        else:
+            with tracer.phase(PHASE_RENDER):
+                sql = pypika_query.get_sql(quote_char=None)
+
+        self.parts = sql.split(TABLE_PLACEHOLDER)
+
+    def render(self, table_name: str) -> str:
+        return table_name.join(self.parts)
+
+
+def get_sql_template(query, cache: Optional[ColumnDependentCache] = None) -> SqlTemplate:
+    """
+    :param query: Query builder instance
+    :param ColumnDependentCache cache: Optional template cache, see "sommelier.schema_watcher.SchemaWatcher"
+    :return: SqlTemplate of the query
+    """
+    if cache is None:
+        return SqlTemplate(query)
+    return cache.get_or_create(('template', get_cache_key(query)), lambda: get_query_columns(query),
+                               lambda: SqlTemplate(query))
+
+
+def compile_for_tables(query,
+                       table_names: Iterable[str],
+                       cache: Optional[ColumnDependentCache] = None) -> Dict[str, str]:
+    """
+    :param query: Query builder instance
+    :param table_names: Physical table names with the same schema
+    :param ColumnDependentCache cache: Optional template cache
+    :return: dict of the table names to their SQL
+    """
+    template = get_sql_template(query, cache)
+    return {table_name: template.render(table_name) for table_name in table_names}
+
+
+class MergedBrokerResponse(BrokerResponse):
+    """
+    Rows of several tables combined into one response
+
+    dict responses - Response of every table
+    """
+
+    def __init__(self, sql: str, response: Dict[str, Any], responses: Dict[str, BrokerResponse]):
+        super(MergedBrokerResponse, self).__init__(sql, response)
+        self.responses = responses
+
+
+def _merge_statistics(responses: List[BrokerResponse]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {name: sum(response.raw.get(name, 0) for response in responses)
+                              for name in SUMMED_STATISTICS}
+    merged['timeUsedMs'] = max((response.stats.time_used_ms for response in responses), default=0)
+    merged['numGroupsLimitReached'] = any(response.num_groups_limit_reached for response in responses)
+    return merged
+
+
+def merge_rows(column_names: List[str], row_sets: Iterable[List[List[Any]]]) -> List[List[Any]]:
+    """
+    Combine the rows of the same query on disjoint tables. Rows with the same non aggregated columns are merged with
+    the function of each aggregated column, see MERGE_FUNCTIONS. Without aggregations the rows are concatenated
+
+    :param list column_names: Result column names
+    :param row_sets: Rows of every table
+    :return: List of rows
+    """
+    merge_functions = {}
+    for index, column_name in enumerate(column_names):
+        function = get_aggregation_function(column_name)
+        if function is None:
+            continue
+        if function not in MERGE_FUNCTIONS:
+            raise UnmergeableAggregationError(f'"{column_name}" can\'t be combined across tables')
+        merge_functions[index] = MERGE_FUNCTIONS[function]
+
+    if not merge_functions:
+        return [row for rows in row_sets for row in rows]
+
+    key_indexes = [index for index in range(len(column_names)) if index not in merge_functions]
+    merged: Dict[tuple, List[Any]] = {}
+    for rows in row_sets:
+        for row in rows:
+            key = tuple(row[index] for index in key_indexes)
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = list(row)
+                continue
+            for index, merge in merge_functions.items():
+                existing[index] = merge(existing[index], row[index])
+    return list(merged.values())
+
+
+def _get_sort_key(value):
+    # Nulls sort as the largest values like in Pinot: last in ascending order, first in descending order
+    return (True, 0) if value is None else (False, value)
+
+
+def _sort_and_limit(query, column_names: List[str], rows: List[List[Any]]) -> List[List[Any]]:
+    lowered = [column_name.lower() for column_name in column_names]
+    order_indexes = [lowered.index(term.lower()) for term in query.order_by_terms if term.lower() in lowered]
+    if order_indexes:
+        descending = query._order is not None and query._order == pypika.Order.desc
+        rows = sorted(rows, key=lambda row: [_get_sort_key(row[index]) for index in order_indexes],
+                      reverse=descending)
+
+    limit = query.row_limit
+    if limit is not None:
+        rows = rows[:limit]
+    return rows
+
+
+def _check_truncation(query, responses: Iterable[BrokerResponse]):
+    limit = get_implicit_group_by_limit(query)
+    for response in responses:
+        if response.num_groups_limit_reached:
+            raise GroupByTruncatedError(response.sql, len(response), 'numGroupsLimitReached')
+        if limit is not None and len(response) >= limit:
+            raise GroupByTruncatedError(response.sql, limit, f'returned {len(response)} rows for a limit of {limit}')
+
+
+def _execute_and_merge(query,
+                       sql_by_table: Dict[str, str],
+                       executor: QueryExecutor,
+                       max_workers: Optional[int],
+                       merged_sql: str) -> MergedBrokerResponse:
+    if not sql_by_table:
+        raise ValueError('At least one table name is required')
+
+    query.warn_group_by_limit()
+    tracer = query.get_tracer()
+    with ThreadPoolExecutor(max_workers=max_workers or len(sql_by_table)) as pool:
+        futures = {table_name: pool.submit(execute_sql, sql, executor, tracer)
+                   for table_name, sql in sql_by_table.items()}
+        responses = {table_name: future.result() for table_name, future in futures.items()}
+
+    # Each table's result is truncated on its own, the merged rows can't tell
+    _check_truncation(query, responses.values())
+
+    first = next(iter(responses.values()))
+    rows = merge_rows(first.column_names, [response.rows for response in responses.values()])
+    if len(responses) > 1:
+        rows = _sort_and_limit(query, first.column_names, rows)
+
+    merged = dict(_merge_statistics(list(responses.values())), resultTable={
+        'dataSchema': {'columnNames': first.column_names, 'columnDataTypes': first.column_types},
+        'rows': rows,
+    })
+    return MergedBrokerResponse(merged_sql, merged, responses)
+
+
+def fan_out(query,
+            table_names: Iterable[str],
+            executor: QueryExecutor,
+            max_workers: Optional[int] = None,
+            cache: Optional[ColumnDependentCache] = None) -> MergedBrokerResponse:
+    """
+    Run one logical query against several physical tables with the same schema and disjoint rows, i.e. per region
+    tables, and merge the results. See "fan_out_hybrid" for the offline and realtime tables of a hybrid table.
+
+    The SQL is compiled once and only the table name is swapped. The tables are queried concurrently so the latency is
+    the one of the slowest table. Group by results are merged per group: COUNT and SUM are added up, MIN and MAX keep
+    the smallest and largest values. The merged rows are then ordered and limited like the query. A top-N merged from
+    per table top-Ns can miss groups that are not in the top-N of any single table.
+
+    :param query: Query builder instance
+    :param table_names: Physical table names
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the JSON response
+    :param int max_workers: Maximum number of tables queried at once, defaults to all of them
+    :param ColumnDependentCache cache: Optional template cache
+    :return: MergedBrokerResponse instance
+    :raises UnmergeableAggregationError: When a selected aggregation can't be combined across tables
+    :raises GroupByTruncatedError: When the groups limit is reached on any of the tables, or a group by without an
+                                   explicit limit returns as many rows as its implicit limit on any of the tables
+    """
+    check_mergeable(query)
+    template = get_sql_template(query, cache)
+    sql_by_table = {table_name: template.render(table_name) for table_name in table_names}
+    return _execute_and_merge(query, sql_by_table, executor, max_workers, template.render(query.table_name))
+
+
+def fan_out_hybrid(query,
+                   executor: QueryExecutor,
+                   time_boundary,
+                   time_column: Optional[str] = None,
+                   max_workers: Optional[int] = None) -> MergedBrokerResponse:
+    """
+    Query the offline and realtime tables of a hybrid table and merge the results. The tables overlap around the
+    time boundary so, like the Pinot broker does, the offline table is filtered on the time column up to the boundary
+    and the realtime table after it. The boundary is returned by the broker's "/debug/timeBoundary/{table}" endpoint.
+
+    :param query: Query builder instance on the logical table
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the JSON response
+    :param time_boundary: Value of the time column splitting the offline and realtime rows
+    :param str time_column: Defaults to the first datetime column of the query
+    :param int max_workers: Maximum number of tables queried at once
+    :return: MergedBrokerResponse instance
+    :raises UnmergeableAggregationError: When a selected aggregation can't be combined across tables
+    :raises GroupByTruncatedError: See "fan_out"
+    """
+    check_mergeable(query)
+    if time_column is None:
+        datetime_columns = getattr(query, 'datetime_columns', {})
+        if not datetime_columns:
+            raise ValueError(f'Table "{query.table_name}" has no datetime column, a time_column is required')
+        time_column = next(iter(datetime_columns))
+    if time_column not in query.columns:
+        raise ValueError(f'Column "{time_column}" does not exist in table "{query.table_name}"')
+
+    offline_table, realtime_table = get_hybrid_table_names(query.table_name)
+    offline_query = query.copy().filter_column_by_value(time_column, time_boundary, '<=')
+    realtime_query = query.copy().filter_column_by_value(time_column, time_boundary, '>')
+    sql_by_table = {
+        offline_table: SqlTemplate(offline_query).render(offline_table),
+        realtime_table: SqlTemplate(realtime_query).render(realtime_table),
+    }
+    return _execute_and_merge(query, sql_by_table, executor, max_workers, query.get_sql_query())
@@ -0,0 +1,767 @@
+import json
+import operator
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import compress, repeat
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sommelier.execution_stats import percentile
+from sommelier.query_builder.date_types import DateField, get_granularity_milliseconds, simple_date_format_to_strptime
+from sommelier.query_builder.table import PINOT_DEFAULT_GROUP_BY_LIMIT
+from sommelier.sql_parser import (Expression, Predicate, SelectItem, SelectStatement, SqlSyntaxError, parse_predicate,
+                                  parse_sql)
+
+# Pinot error codes used in the "exceptions" of the responses
+ERROR_CODE_SQL_PARSING = 150
+ERROR_CODE_TABLE_DOES_NOT_EXIST = 190
+ERROR_CODE_QUERY_EXECUTION = 200
+
+# Number of parsed statements kept per engine
+STATEMENT_CACHE_SIZE = 1024
+
+COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    '=': operator.eq,
+    '<>': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+# Comparison matching the non null values the comparison doesn't match
+NEGATED_COMPARISONS = {'=': '<>', '<>': '=', '>': '<=', '>=': '<', '<': '>=', '<=': '>'}
+
+# Keys and array indexes of a JSON path. i.e. .airport, ['airport'] or [0]
+JSON_PATH_SEGMENT = re.compile(r"\.([^.\[\]]+)|\['([^']*)'\]|\[(\d+)\]")
+
+# Marks a JSON path missing from a document
+_MISSING = object()
+
+PERCENTILE_FUNCTION = re.compile(r'(PERCENTILE|PERCENTILEEST|PERCENTILETDIGEST)(\d+)\Z')
+
+
+def _get_sort_key(value):
+    # Nulls sort as the largest values like in Pinot: last in ascending order, first in descending order
+    return (True, 0) if value is None else (False, value)
+
+
+def _is_not_null(values: Iterable[Any]) -> Iterable[bool]:
+    return map(operator.is_not, values, repeat(None))
+
+
+def _map_distinct(function: Callable[[Any], Any], values: List[Any]) -> List[Any]:
+    """
+    Apply the function once per distinct value, since many rows share a value, and look the results up for every row
+    """
+    try:
+        results = {value: function(value) for value in set(values)}
+    except TypeError:
+        # Unhashable values i.e. parsed JSON documents
+        return list(map(function, values))
+    return list(map(results.__getitem__, values))
+
+
+def _percentile(values: List[Any], percent: float):
+    return percentile(sorted(values), percent) if values else None
+
+
+def _sum(values: List[Any]) -> float:
+    return float(sum(values))
+
+
+def _min(values: List[Any]):
+    return float(min(values)) if values else None
+
+
+def _max(values: List[Any]):
+    return float(max(values)) if values else None
+
+
+def _avg(values: List[Any]):
+    return float(sum(values)) / len(values) if values else None
+
+
+def _distinct_count(values: List[Any]) -> int:
+    return len(set(values))
+
+
+# Aggregation functions and the Pinot data type of their result
+AGGREGATIONS: Dict[str, tuple] = {
+    'COUNT': (len, 'LONG'),
+    'SUM': (_sum, 'DOUBLE'),
+    'MIN': (_min, 'DOUBLE'),
+    'MAX': (_max, 'DOUBLE'),
+    'AVG': (_avg, 'DOUBLE'),
+    'DISTINCTCOUNT': (_distinct_count, 'INT'),
+    'DISTINCTCOUNTHLL': (_distinct_count, 'LONG'),
+}
+
+
+def _json_to_string(value) -> str:
+    # Scalars as indexed by the JSON index of Pinot, objects and arrays as JSON
+    if type(value) is bool:
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return str(value)
+
+
+def _json_to_boolean(value) -> bool:
+    return value if type(value) is bool else str(value).lower() == 'true'
+
+
+# Result types of JSON_EXTRACT_SCALAR and the conversion of the extracted values
+JSON_SCALAR_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    'STRING': _json_to_string,
+    'BIG_DECIMAL': _json_to_string,
+    'INT': int,
+    'LONG': int,
+    'FLOAT': float,
+    'DOUBLE': float,
+    'BOOLEAN': _json_to_boolean,
+}
+
+PYTHON_TYPE_TO_PINOT_TYPE = {
+    bool: 'BOOLEAN',
+    int: 'LONG',
+    float: 'DOUBLE',
+    str: 'STRING',
+    bytes: 'BYTES',
+}
+
+
+class LocalEngineError(ValueError):
+    """
+    Raised when a query can't be executed by the local engine
+
+    int error_code - Pinot error code reported in the response
+    """
+
+    def __init__(self, message: str, error_code: int = ERROR_CODE_QUERY_EXECUTION):
+        self.error_code = error_code
+        super(LocalEngineError, self).__init__(message)
+
+
+def get_aggregation(name: str):
+    """
+    :param str name: Upper case function name. i.e. SUM or PERCENTILE90
+    :return: Tuple of the aggregation function and the Pinot type of its result or None if it is not an aggregation
+    """
+    if name in AGGREGATIONS:
+        return AGGREGATIONS[name]
+
+    matches = PERCENTILE_FUNCTION.match(name)
+    if matches:
+        percent = int(matches.group(2))
+        return (lambda values: _percentile(values, percent)), 'DOUBLE'
+    return None
+
+
+def is_aggregation(expression: Expression) -> bool:
+    return expression.kind == 'function' and get_aggregation(expression.name) is not None
+
+
+def get_result_column_name(item: SelectItem) -> str:
+    """
+    Name Pinot gives to a result column: the alias, the lower case aggregation i.e. "sum(price)" or the expression
+    """
+    if item.alias:
+        return item.alias
+    expression = item.expression
+    if is_aggregation(expression):
+        arguments = ','.join(argument.text for argument in expression.arguments)
+        return f'{expression.name.lower()}({arguments})'
+    return expression.text
+
+
+def get_datetime_converter(input_format: str, output_format: str, granularity: str) -> Callable[[Any], Any]:
+    """
+    Pinot's DATETIMECONVERT: bucket the value to the granularity and format it in the output format. The formatted
+    value of every bucket is cached since many rows fall in the same bucket
+
+    :param str input_format: i.e. "1:MILLISECONDS:EPOCH"
+    :param str output_format: i.e. "1:DAYS:SIMPLE_DATE_FORMAT:yyyy-MM-dd"
+    :param str granularity: i.e. "1:HOURS"
+    :return: Function converting a value in the input format
+    """
+    input_parts = input_format.split(':')
+    if 'EPOCH' in input_parts:
+        input_milliseconds = get_granularity_milliseconds(input_format)
+
+        def to_milliseconds(value):
+            return int(value) * input_milliseconds
+    else:
+        to_milliseconds = DateField('', str, input_format, granularity).to_milliseconds
+
+    granularity_milliseconds = get_granularity_milliseconds(granularity)
+    output_parts = output_format.split(':')
+    if 'SIMPLE_DATE_FORMAT' in output_parts:
+        pattern = simple_date_format_to_strptime(output_parts[-1])
+
+        def format_bucket(bucket):
+            return datetime.fromtimestamp(bucket / 1000, tz=timezone.utc).strftime(pattern)
+    else:
+        output_milliseconds = get_granularity_milliseconds(output_format)
+
+        def format_bucket(bucket):
+            return bucket // output_milliseconds
+
+    formatted = {}
+
+    def convert(value):
+        if value is None:
+            return None
+        milliseconds = to_milliseconds(value)
+        if milliseconds is None:
+            raise LocalEngineError(f'Can\'t convert "{value}" from "{input_format}"')
+        bucket = milliseconds - milliseconds % granularity_milliseconds
+        result = formatted.get(bucket)
+        if result is None:
+            result = formatted[bucket] = format_bucket(bucket)
+        return result
+
+    return convert
+
+
+def get_json_path(path: str) -> Tuple[Any, ...]:
+    """
+    :param str path: JSON path of a single value. i.e. $.airport.code, $['airport'] or $.legs[0]
+    :return: Object keys and array indexes leading to the value
+    """
+    if type(path) is not str or not path.startswith('$'):
+        raise LocalEngineError(f'Illegal JSON path {path!r}')
+    keys = []
+    position = 1
+    while position < len(path):
+        matches = JSON_PATH_SEGMENT.match(path, position)
+        if not matches:
+            raise LocalEngineError(f'Unsupported JSON path "{path}", only keys and array indexes are supported')
+        key, quoted_key, index = matches.groups()
+        keys.append(int(index) if index is not None else key if key is not None else quoted_key)
+        position = matches.end()
+    return tuple(keys)
+
+
+def _parse_json(document):
+    if not isinstance(document, (str, bytes)):
+        return document
+    try:
+        return json.loads(document)
+    except ValueError:
+        raise LocalEngineError(f'Invalid JSON "{document}"')
+
+
+def _get_json_value(document, keys: Tuple[Any, ...]):
+    value = document
+    for key in keys:
+        if isinstance(value, dict) and type(key) is str:
+            value = value.get(key, _MISSING)
+        elif isinstance(value, list) and type(key) is int and key < len(value):
+            value = value[key]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            break
+    return value
+
+
+def get_json_scalar_extractor(path: str, result_type: str, default: Any = _MISSING) -> Callable[[Any], Any]:
+    """
+    Pinot's JSON_EXTRACT_SCALAR: the value at the path of a JSON document, converted to the result type. Like in
+    Pinot, a missing value is an error unless there is a default value
+
+    :param str path: JSON path. i.e. $.airport
+    :param str result_type: i.e. STRING or LONG
+    :param default: Optional value of the documents missing the path
+    :return: Function extracting the value from a document
+    """
+    keys = get_json_path(path)
+    convert = JSON_SCALAR_CONVERTERS.get(str(result_type).upper())
+    if convert is None:
+        raise LocalEngineError(f'Unsupported JSON_EXTRACT_SCALAR result type "{result_type}"')
+
+    def extract(document):
+        if document is None:
+            return None if default is _MISSING else default
+        value = _get_json_value(_parse_json(document), keys)
+        if value is _MISSING or value is None:
+            if default is _MISSING:
+                raise LocalEngineError(f'Illegal JSON path "{path}" for the document "{document}"')
+            value = default
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            raise LocalEngineError(f'Can\'t convert "{value}" at "{path}" to {result_type}')
+
+    return extract
+
+
+def _compile_json_predicate(predicate: Predicate, expression: str) -> Callable[[Any], bool]:
+    if predicate.kind in ('and', 'or'):
+        children = [_compile_json_predicate(child, expression) for child in predicate.children]
+        combine = all if predicate.kind == 'and' else any
+        return lambda document: combine(matches(document) for matches in children)
+
+    if predicate.kind == 'not':
+        child = _compile_json_predicate(predicate.children[0], expression)
+        return lambda document: not child(document)
+
+    operand = predicate.expression
+    if operand.kind != 'column' or not operand.name.startswith('$') or not (
+            predicate.kind == 'in' or (predicate.kind == 'compare' and predicate.operator in ('=', '<>'))):
+        raise LocalEngineError(f'Unsupported JSON_MATCH expression "{expression}", only =, !=, IN and NOT IN of '
+                               f'JSON paths are supported')
+    keys = get_json_path(operand.name)
+    if predicate.kind == 'compare':
+        expected = {_json_to_string(predicate.value)}
+        negated = predicate.operator == '<>'
+    else:
+        expected = {_json_to_string(value) for value in predicate.value}
+        negated = predicate.negated
+
+    def matches(document) -> bool:
+        value = _get_json_value(document, keys)
+        return value is not _MISSING and (_json_to_string(value) in expected) != negated
+
+    return matches
+
+
+def get_json_matcher(expression: str) -> Callable[[Any], bool]:
+    """
+    Pinot's JSON_MATCH on the filter expressions emitted by the query builders: =, !=, IN and NOT IN of JSON paths,
+    combined with AND, OR and NOT. Values compare as indexed by the JSON index, as strings, and a path only matches
+    the documents where it exists
+
+    :param str expression: JSON_MATCH filter expression. i.e. "$.airport" IN ('SFO','JFK')
+    :return: Function matching a document
+    """
+    try:
+        predicate = parse_predicate(expression)
+    except SqlSyntaxError as error:
+        raise LocalEngineError(f'Unsupported JSON_MATCH expression: {error}')
+    matches = _compile_json_predicate(predicate, expression)
+    return lambda document: matches(_parse_json(document))
+
+
+class LocalTable:
+    """
+    Columnar data of a table. Columns can be any sequence: lists, arrays or the memoryviews and DictionaryColumn of a
+    "sommelier.spill.SpilledResult".
+
+    str table_name - The table name used in the FROM of the queries
+    dict columns - Column names to their values
+    """
+
+    def __init__(self, table_name: str, columns: Dict[str, Sequence[Any]]):
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f'The columns of table "{table_name}" have different lengths')
+
+        self.table_name = table_name
+        self.columns = columns
+        self.row_count = lengths.pop() if lengths else 0
+        self._indexes: Dict[str, Dict[Any, List[int]]] = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_rows(cls, table_name: str, column_names: Sequence[str], rows: Iterable[Sequence[Any]]) -> 'LocalTable':
+        values = list(zip(*rows))
+        if not values:
+            values = [() for _ in column_names]
+        return cls(table_name, {name: list(column) for name, column in zip(column_names, values)})
+
+    @classmethod
+    def from_spill(cls, table_name: str, spilled) -> 'LocalTable':
+        """
+        :param spilled: sommelier.spill.SpilledResult, its columns are used without copying
+        """
+        return cls(table_name, {name: spilled.column(name) for name in spilled.column_names})
+
+    def get_column(self, name: str) -> Sequence[Any]:
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise LocalEngineError(f'Unknown column "{name}" in table "{self.table_name}"')
+
+    def get_index(self, name: str) -> Dict[Any, List[int]]:
+        """
+        Inverted index of the column, built on first use
+
+        :param str name: Column name
+        :return: dict of the values to their sorted row ids
+        """
+        index = self._indexes.get(name)
+        if index is None:
+            with self._lock:
+                index = {}
+                for row_id, value in enumerate(self.get_column(name)):
+                    index.setdefault(value, []).append(row_id)
+                self._indexes[name] = index
+        return index
+
+
+class _Execution:
+    """
+    State of one query execution
+    """
+
+    def __init__(self, table: LocalTable, statement: SelectStatement):
+        self.table = table
+        self.statement = statement
+        self.entries_scanned_in_filter = 0
+        self.entries_scanned_post_filter = 0
+
+    def evaluate(self, expression: Expression, rows: Sequence[int]) -> List[Any]:
+        """
+        Values of a scalar expression for the rows, computed a column at a time
+        """
+        if expression.kind == 'column':
+            return list(map(self.table.get_column(expression.name).__getitem__, rows))
+        if expression.kind == 'literal':
+            return [expression.value] * len(rows)
+        if expression.kind == 'function':
+            column, *options = expression.arguments or (None,)
+            if column is None or any(option.kind != 'literal' for option in options):
+                raise LocalEngineError(f'Unsupported "{expression.text}"')
+            if expression.name == 'DATETIMECONVERT' and len(options) == 3:
+                convert = get_datetime_converter(*(option.value for option in options))
+                return _map_distinct(convert, self.evaluate(column, rows))
+            if expression.name == 'JSON_EXTRACT_SCALAR' and len(options) in (2, 3):
+                extract = get_json_scalar_extractor(*(option.value for option in options))
+                return _map_distinct(extract, self.evaluate(column, rows))
+        raise LocalEngineError(f'Unsupported expression "{expression.text}"')
+
+    def filter(self, predicate: Predicate, rows: Optional[List[int]], negate: bool = False) -> List[int]:
+        """
+        Evaluate the predicate, a column at a time. NOT is pushed down to the comparisons so that, like in SQL, a
+        comparison with a null is unknown: the row matches neither the comparison nor its negation
+
+        :param Predicate predicate: Node of the WHERE clause
+        :param rows: Sorted row ids to evaluate it on, None for all the rows
+        :param bool negate: Whether to evaluate the negation of the predicate
+        :return: Sorted row ids matching the predicate
+        """
+        if predicate.kind == 'not':
+            return self.filter(predicate.children[0], rows, not negate)
+
+        if predicate.kind in ('and', 'or'):
+            # The negation of an AND is the OR of the negated children and the other way around
+            if (predicate.kind == 'and') != negate:
+                for child in predicate.children:
+                    rows = self.filter(child, rows, negate)
+                return rows
+            matched = set()
+            for child in predicate.children:
+                matched.update(self.filter(child, rows, negate))
+            return sorted(matched)
+
+        expression = predicate.expression
+        if rows is None and not negate and expression.kind == 'column':
+            # Equality and IN on all the rows use the inverted index of the column, nulls equal nothing
+            if predicate.kind == 'compare' and predicate.operator == '=':
+                if predicate.value is None:
+                    return []
+                return list(self.table.get_index(expression.name).get(predicate.value, ()))
+            if predicate.kind == 'in' and not predicate.negated:
+                index = self.table.get_index(expression.name)
+                return sorted(row for value in set(predicate.value) - {None} for row in index.get(value, ()))
+
+        if predicate.kind == 'function':
+            # Boolean functions i.e. regexp_like(column, 'pattern') are evaluated on their first argument
+            if not expression.arguments:
+                raise LocalEngineError(f'Unsupported filter "{predicate.text}"')
+            expression = expression.arguments[0]
+
+        candidates = range(self.table.row_count) if rows is None else rows
+        values = self.evaluate(expression, candidates)
+        self.entries_scanned_in_filter += len(values)
+        if None in values:
+            present = list(_is_not_null(values))
+            candidates = list(compress(candidates, present))
+            values = list(compress(values, present))
+        return list(compress(candidates, self.get_mask(predicate, values, negate)))
+
+    def get_mask(self, predicate: Predicate, values: List[Any], negate: bool) -> Iterable[bool]:
+        """
+        Whether each of the non null values matches the predicate, or its negation. Comparisons are mapped over the
+        values with the operator functions rather than evaluated a row at a time
+
+        :param Predicate predicate: Comparison, IN, BETWEEN or boolean function node
+        :param list values: Values of its left hand side
+        :param bool negate: Whether to evaluate the negation of the predicate
+        :return: Iterable of bool
+        """
+        try:
+            if predicate.kind == 'compare':
+                if predicate.value is None:
+                    # Comparisons with NULL are never true
+                    return repeat(False, len(values))
+                comparison = COMPARISONS[NEGATED_COMPARISONS[predicate.operator] if negate else predicate.operator]
+                return list(map(comparison, values, repeat(predicate.value)))
+
+            if predicate.kind == 'in':
+                matches = list(map(frozenset(predicate.value).__contains__, values))
+                if negate == predicate.negated:
+                    return matches
+                # NOT IN a list with NULL is never true
+                return repeat(False, len(values)) if None in predicate.value else map(operator.not_, matches)
+
+            if predicate.kind == 'between':
+                low, high = predicate.value
+                if low is None or high is None:
+                    return repeat(False, len(values))
+                if negate == predicate.negated:
+                    return list(map(operator.and_, map(operator.ge, values, repeat(low)),
+                                    map(operator.le, values, repeat(high))))
+                return list(map(operator.or_, map(operator.lt, values, repeat(low)),
+                                map(operator.gt, values, repeat(high))))
+        except TypeError as error:
+            raise LocalEngineError(f'Can\'t evaluate "{predicate.text}": {error}')
+
+        if predicate.kind == 'function':
+            matches = _map_distinct(self.get_function_matcher(predicate), values)
+            return map(operator.not_, matches) if negate else matches
+
+        raise LocalEngineError(f'Unsupported filter "{predicate.text}"')
+
+    @staticmethod
+    def get_function_matcher(predicate: Predicate) -> Callable[[Any], bool]:
+        """
+        :param Predicate predicate: Boolean function node
+        :return: Function matching a non null value of the first argument
+        """
+        arguments = predicate.expression.arguments
+        if len(arguments) != 2 or arguments[1].kind != 'literal':
+            raise LocalEngineError(f'Unsupported "{predicate.text}"')
+
+        if predicate.operator == 'REGEXP_LIKE':
+            try:
+                pattern = re.compile(arguments[1].value)
+            except re.error as error:
+                raise LocalEngineError(f'Unsupported pattern in "{predicate.text}": {error}')
+            return lambda value: pattern.search(str(value)) is not None
+
+        if predicate.operator == 'JSON_MATCH':
+            return get_json_matcher(arguments[1].value)
+
+        if predicate.operator == 'TEXT_MATCH':
+            raise LocalEngineError(f'TEXT_MATCH is unsupported, Lucene queries need a Pinot text index: '
+                                   f'"{predicate.text}"')
+
+        raise LocalEngineError(f'Unsupported filter "{predicate.text}"')
+
+    def aggregate(self, expression: Expression, rows: Sequence[int]):
+        """
+        Aggregate the rows. Like in SQL, COUNT(*) counts the rows while the other aggregations skip the nulls
+        """
+        function, _ = get_aggregation(expression.name)
+        if len(expression.arguments) != 1:
+            raise LocalEngineError(f'Unsupported "{expression.text}"')
+        argument = expression.arguments[0]
+        if argument.kind == 'star':
+            return function(rows)
+        values = self.evaluate(argument, rows)
+        self.entries_scanned_post_filter += len(values)
+        if None in values:
+            values = list(compress(values, _is_not_null(values)))
+        try:
+            return function(values)
+        except TypeError as error:
+            raise LocalEngineError(f'Can\'t evaluate "{expression.text}": {error}')
+
+
+def _find_term(expression: Expression, items: List[SelectItem]) -> Optional[int]:
+    text = expression.text.lower()
+    for index, item in enumerate(items):
+        if item.expression.text.lower() == text or (item.alias and item.alias.lower() == text):
+            return index
+    return None
+
+
+def _get_result_type(expression: Expression, values: List[Any]) -> str:
+    if is_aggregation(expression):
+        return get_aggregation(expression.name)[1]
+    for value in values:
+        if value is not None:
+            return PYTHON_TYPE_TO_PINOT_TYPE.get(type(value), 'STRING')
+    return 'STRING'
+
+
+class LocalEngine:
+    """
+    In-process execution of the SQL subset emitted by the query builders against local columnar data. It is a
+    QueryExecutor returning Pinot broker responses, so it can stand in for a broker in tests or serve small tables:
+
+    engine = LocalEngine([LocalTable.from_rows('flights', ['airport', 'price'], rows)])
+    execute_query(query, engine)
+
+    Filters are evaluated a column at a time, narrowing the matching row ids at every AND, with inverted indexes built
+    on first use for equality and IN filters. Nulls follow SQL: comparisons with them are never true and aggregations
+    other than COUNT(*) skip them. JSON_MATCH and JSON_EXTRACT_SCALAR are supported on JSON paths of single values,
+    TEXT_MATCH is not. Like Pinot, queries without a LIMIT return 10 rows.
+    """
+
+    def __init__(self, tables: Iterable[LocalTable] = ()):
+        self.tables: Dict[str, LocalTable] = {}
+        self._statements: 'OrderedDict[str, SelectStatement]' = OrderedDict()
+        self._lock = Lock()
+        for table in tables:
+            self.add_table(table)
+
+    def add_table(self, table: LocalTable):
+        self.tables[table.table_name] = table
+        return self
+
+    def __call__(self, sql: str) -> Dict[str, Any]:
+        return self.execute(sql)
+
+    def parse(self, sql: str) -> SelectStatement:
+        with self._lock:
+            statement = self._statements.get(sql)
+            if statement is not None:
+                self._statements.move_to_end(sql)
+                return statement
+
+        statement = parse_sql(sql)
+        with self._lock:
+            self._statements[sql] = statement
+            if len(self._statements) > STATEMENT_CACHE_SIZE:
+                self._statements.popitem(last=False)
+        return statement
+
+    def execute(self, sql: str) -> Dict[str, Any]:
+        """
+        :param str sql: SQL query string
+        :return: Pinot broker response as a dict, errors are reported in its "exceptions"
+        """
+        start = time.perf_counter()
+        try:
+            statement = self.parse(sql)
+            table = self.tables.get(statement.table_name)
+            if table is None:
+                raise LocalEngineError(f'Table "{statement.table_name}" does not exist',
+                                       ERROR_CODE_TABLE_DOES_NOT_EXIST)
+            response = self._execute(table, statement)
+        except SqlSyntaxError as error:
+            return {'exceptions': [{'errorCode': ERROR_CODE_SQL_PARSING, 'message': str(error)}]}
+        except LocalEngineError as error:
+            return {'exceptions': [{'errorCode': error.error_code, 'message': str(error)}]}
+
+        response['timeUsedMs'] = int((time.perf_counter() - start) * 1000)
+        return response
+
+    def _execute(self, table: LocalTable, statement: SelectStatement) -> Dict[str, Any]:
+        execution = _Execution(table, statement)
+        if statement.where is not None:
+            rows = execution.filter(statement.where, None)
+        else:
+            rows = range(table.row_count)
+
+        items = self._expand_star(table, statement.select)
+        if statement.group_by or any(is_aggregation(item.expression) for item in items):
+            column_names, result_rows = self._execute_aggregation(execution, items, rows)
+        else:
+            column_names, result_rows = self._execute_selection(execution, items, rows)
+
+        columns = list(zip(*result_rows)) if result_rows else [()] * len(items)
+        column_types = [_get_result_type(item.expression, values) for item, values in zip(items, columns)]
+
+        return {
+            'resultTable': {
+                'dataSchema': {'columnNames': column_names, 'columnDataTypes': column_types},
+                'rows': result_rows,
+            },
+            'exceptions': [],
+            'numDocsScanned': len(rows),
+            'totalDocs': table.row_count,
+            'numEntriesScannedInFilter': execution.entries_scanned_in_filter,
+            'numEntriesScannedPostFilter': execution.entries_scanned_post_filter,
+            'numSegmentsQueried': 1,
+            'numSegmentsProcessed': 1,
+            'numSegmentsMatched': 1 if rows else 0,
+            'numServersQueried': 1,
+            'numServersResponded': 1,
+            'numGroupsLimitReached': False,
+        }
+
+    @staticmethod
+    def _expand_star(table: LocalTable, items: List[SelectItem]) -> List[SelectItem]:
+        expanded = []
+        for item in items:
+            if item.expression.kind == 'star':
+                expanded.extend(SelectItem(Expression('column', name, name=name)) for name in table.columns)
+            else:
+                expanded.append(item)
+        return expanded
+
+    @staticmethod
+    def _order_and_limit(statement: SelectStatement, result_rows: List[list], order_keys: List[List[Any]]):
+        if order_keys:
+            positions = list(range(len(result_rows)))
+            # Stable sorts from the last ORDER BY term to the first
+            for keys, descending in reversed(order_keys):
+                if None in keys:
+                    keys = list(map(_get_sort_key, keys))
+                positions.sort(key=keys.__getitem__, reverse=descending)
+            result_rows = [result_rows[position] for position in positions]
+
+        offset = statement.offset or 0
+        limit = statement.limit if statement.limit is not None else PINOT_DEFAULT_GROUP_BY_LIMIT
+        return result_rows[offset:offset + limit]
+
+    def _execute_selection(self, execution: _Execution, items: List[SelectItem], rows: Sequence[int]):
+        statement = execution.statement
+        columns = [execution.evaluate(item.expression, rows) for item in items]
+        execution.entries_scanned_post_filter += len(rows) * len(items)
+        result_rows = [list(row) for row in zip(*columns)] if columns else []
+
+        order_keys = []
+        for expression, descending in statement.order_by:
+            index = _find_term(expression, items)
+            keys = columns[index] if index is not None else execution.evaluate(expression, rows)
+            order_keys.append((keys, descending))
+
+        return [get_result_column_name(item) for item in items], self._order_and_limit(statement, result_rows,
+                                                                                       order_keys)
+
+    def _execute_aggregation(self, execution: _Execution, items: List[SelectItem], rows: Sequence[int]):
+        statement = execution.statement
+        group_by = statement.group_by
+
+        groups: Dict[tuple, List[int]] = {}
+        if group_by:
+            key_columns = [execution.evaluate(expression, rows) for expression in group_by]
+            for row, key in zip(rows, zip(*key_columns)):
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = [row]
+                else:
+                    group.append(row)
+        else:
+            # Aggregations without a group by always return one row
+            groups[()] = list(rows)
+
+        group_texts = [expression.text.lower() for expression in group_by]
+
+        def get_values(expression: Expression) -> List[Any]:
+            if is_aggregation(expression):
+                return [execution.aggregate(expression, group_rows) for group_rows in groups.values()]
+            text = expression.text.lower()
+            if text not in group_texts:
+                raise LocalEngineError(f'"{expression.text}" must be in the GROUP BY or aggregated')
+            position = group_texts.index(text)
+            return [key[position] for key in groups]
+
+        columns = [get_values(item.expression) for item in items]
+        result_rows = [list(row) for row in zip(*columns)]
+
+        order_keys = []
+        for expression, descending in statement.order_by:
+            index = _find_term(expression, items)
+            order_keys.append((columns[index] if index is not None else get_values(expression), descending))
+
+        return [get_result_column_name(item) for item in items], self._order_and_limit(statement, result_rows,
+                                                                                       order_keys)
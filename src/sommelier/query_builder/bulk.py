@@ -0,0 +1,130 @@
+import os
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.spec import decode_query, encode_query
+
+DEFAULT_CHUNK_SIZE = 1000
+# Chunks submitted to the pool per worker process before waiting on the oldest one
+CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+
+VARIANT_KEYS = ('select', 'filters', 'dates', 'group_by', 'order_by', 'limit')
+
+QueryVariant = Dict[str, Any]
+
+# Base query of the worker process, set once by the pool initializer
+_worker_query = None
+
+
+def apply_variant(query, variant: QueryVariant):
+    """
+    Apply a variant to a query. A variant is a plain dict, which is cheap to send to the worker processes, with any
+    of the keys:
+
+     - "select": List of terms to select. i.e. ["SUM(price)"]
+     - "filters": Filters in the "MetricsTable.parse_bulk_filters" format
+     - "dates": Tuple of the start and end, see "MetricsTable.filter_dates_between". MetricsTable queries only
+     - "group_by": List of columns to group by
+     - "order_by": List of terms to order by
+     - "limit": Number of results to return
+
+    :param query: Query builder instance, it is modified
+    :param dict variant: See above
+    :return: The query instance
+    """
+    unknown_keys = set(variant).difference(VARIANT_KEYS)
+    if unknown_keys:
+        raise ValueError(f'Unknown query variant keys {sorted(unknown_keys)}')
+
+    query.select_columns(variant.get('select', ()))
+    for column, value, operator in MetricsTable.parse_bulk_filters(variant.get('filters', {})):
+        query.filter_column_by_value(column, value, operator)
+    if 'dates' in variant:
+        query.filter_dates_between(*variant['dates'])
+    for column in variant.get('group_by', ()):
+        query.group_by(column)
+    if 'order_by' in variant:
+        query.order_by(*variant['order_by'])
+    if 'limit' in variant:
+        query.limit(variant['limit'])
+    return query
+
+
+def compile_variants(query, variants: Iterable[QueryVariant]) -> List[str]:
+    """
+    :param query: Base query, it is not modified
+    :param variants: See "apply_variant"
+    :return: SQL of every variant applied to a copy of the base query, in order
+    """
+    return [apply_variant(query.copy(), variant).get_sql_query() for variant in variants]
+
+
+def _init_worker(serialized_definition: bytes, encoded_query: str, query_class):
+    global _worker_query
+    _worker_query = decode_query(encoded_query, pickle.loads(serialized_definition), query_class)
+
+
+def _compile_chunk(variants: List[QueryVariant]) -> List[str]:
+    return compile_variants(_worker_query, variants)
+
+
+def _chunks(variants: Iterable[QueryVariant], chunk_size: int) -> Iterator[List[QueryVariant]]:
+    iterator = iter(variants)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+
+def generate_sql_bulk(query,
+                      variants: Iterable[QueryVariant],
+                      processes: Optional[int] = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Compile the SQL of many variants of a base query across a pool of processes.
+
+    The base query is sent once to every worker process as its definition and its spec (see
+    "sommelier.query_builder.spec"), then the variants are sent in chunks. The SQL is streamed
+    back in the order of the variants and only a few chunks per process are in flight so the variants can be a lazy
+    iterable of millions of entries.
+
+    Example:
+
+    variants = ({'filters': {'airport': airport}, 'dates': dates} for airport in airports for dates in date_ranges)
+    for sql in generate_sql_bulk(query, variants):
+        ...
+
+    :param query: Base query builder instance, it is not modified
+    :param variants: Iterable of variant dicts, see "apply_variant"
+    :param int processes: Number of worker processes, defaults to the number of CPUs. 1 compiles in this process
+    :param int chunk_size: Number of variants sent to a worker at once
+    :return: Generator of SQL strings
+    """
+    if chunk_size <= 0:
+        raise ValueError('chunk_size must be a positive integer')
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        for chunk in _chunks(variants, chunk_size):
+            yield from compile_variants(query, chunk)
+        return
+
+    max_in_flight = processes * CHUNKS_IN_FLIGHT_PER_PROCESS
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(pickle.dumps(query.definition, protocol=pickle.HIGHEST_PROTOCOL),
+                                       encode_query(query),
+                                       type(query))) as pool:
+        in_flight = deque()
+        for chunk in _chunks(variants, chunk_size):
+            in_flight.append(pool.submit(_compile_chunk, chunk))
+            if len(in_flight) >= max_in_flight:
+                yield from in_flight.popleft().result()
+
+        while in_flight:
+            yield from in_flight.popleft().result()
@@ -0,0 +1,194 @@
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sommelier.query_builder.coercion import LIST_OPERATORS, SCALAR_OPERATORS, coerce_filter_value
+from sommelier.query_builder.filter_operators import (OPERATOR_JSON_EXTRACT_SCALAR, OPERATOR_JSON_MATCH,
+                                                      OPERATOR_TEXT_MATCH, check_column_kind)
+from sommelier.query_builder.query_cache import ALL_COLUMNS, ColumnDependentCache
+from sommelier.query_builder.regex_analysis import analyze_regex
+from sommelier.query_builder.table import Filter
+
+# Operators "Table.operator_to_criterion" compiles
+SUPPORTED_OPERATORS = SCALAR_OPERATORS | LIST_OPERATORS | frozenset((
+    'between',
+    'regex',
+    OPERATOR_JSON_MATCH,
+    OPERATOR_JSON_EXTRACT_SCALAR,
+    OPERATOR_TEXT_MATCH,
+))
+
+
+class FilterEntryError(NamedTuple):
+    """
+    Entry of a filters payload that was left out
+
+    str column - Column name, the key of the entry
+    int position - Index of the entry in the column's list, None when the column has a single entry
+    Exception error - Why the entry is invalid
+    """
+    column: str
+    position: Optional[int]
+    error: Exception
+
+    def __str__(self):
+        location = self.column if self.position is None else f'{self.column}[{self.position}]'
+        return f'{location}: {self.error}'
+
+
+class BulkFilterError(ValueError):
+    """
+    Raised by "BulkFilters.raise_for_errors" when entries of a filters payload are invalid
+    """
+
+    def __init__(self, errors: List[FilterEntryError]):
+        self.errors = errors
+        super(BulkFilterError, self).__init__('Invalid filters: ' + '; '.join(str(error) for error in errors))
+
+
+class BulkFilters:
+    """
+    Filters compiled from a payload. It is immutable so it can be cached and applied to many queries
+
+    dict filters - Column names to tuples of Filter, in the format of "Table.filters"
+    tuple errors - FilterEntryError of every entry left out
+    """
+
+    __slots__ = ('filters', 'errors')
+
+    def __init__(self, filters: Dict[str, Tuple[Filter, ...]], errors: Tuple[FilterEntryError, ...] = ()):
+        self.filters = filters
+        self.errors = errors
+
+    def __repr__(self):
+        return f'BulkFilters(filters={self.filters!r}, errors={list(self.errors)!r})'
+
+    def raise_for_errors(self):
+        """
+        :return: The instance when every entry is valid
+        :raises BulkFilterError: Listing every invalid entry
+        """
+        if self.errors:
+            raise BulkFilterError(list(self.errors))
+        return self
+
+
+def _compile_entry(definition, column: str, entry) -> Filter:
+    if type(entry) is dict:
+        if 'value' not in entry:
+            raise ValueError('Missing "value"')
+        operator = entry.get('op', '==')
+        value = entry['value']
+    else:
+        operator = '=='
+        value = entry
+
+    if operator not in SUPPORTED_OPERATORS:
+        raise ValueError(f'Unsupported operator {operator!r}')
+    check_column_kind(definition, column, operator)
+    if operator == 'regex':
+        analyze_regex(value)
+    else:
+        value = coerce_filter_value(definition.get_coercer(column), column, operator, value)
+    return Filter(operator, value)
+
+
+def compile_bulk_filters(definition, filters: Dict[str, Any]) -> BulkFilters:
+    """
+    Validate and convert a filters payload in one pass. Unlike "MetricsTable.parse_bulk_filters" followed by
+    "filter_column_by_value", the Filter tuples are built directly and the invalid entries, i.e. unknown columns,
+    unsupported operators or values not matching the column type, are reported instead of aborting the payload
+
+    :param TableDefinition definition: Definition of the table
+    :param dict filters: Payload in the "MetricsTable.parse_bulk_filters" format
+    :return: BulkFilters instance
+    """
+    compiled: Dict[str, Tuple[Filter, ...]] = {}
+    errors: List[FilterEntryError] = []
+    column_names = definition.column_names
+
+    for column, filter_info in filters.items():
+        if column not in column_names:
+            errors.append(FilterEntryError(column, None, ValueError(f'Unknown column "{column}"')))
+            continue
+
+        is_list = type(filter_info) is list
+        column_filters = []
+        for index, entry in enumerate(filter_info if is_list else (filter_info,)):
+            try:
+                column_filters.append(_compile_entry(definition, column, entry))
+            except (TypeError, ValueError) as error:
+                # i.e. a regex pattern that isn't a string
+                errors.append(FilterEntryError(column, index if is_list else None, error))
+        if column_filters:
+            compiled[column] = tuple(column_filters)
+
+    return BulkFilters(compiled, tuple(errors))
+
+
+def get_payload_key(filters: Dict[str, Any]) -> Optional[str]:
+    """
+    :param dict filters: Filters payload
+    :return: Canonical JSON of the payload, None when it isn't JSON serializable, i.e. has date values
+    """
+    try:
+        return json.dumps(filters, sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_cached_bulk_filters(definition, filters: Dict[str, Any], cache: ColumnDependentCache) -> BulkFilters:
+    """
+    Compile a payload once per distinct payload and definition of its columns. The entries depend on the payload's
+    columns so a schema change of any of them evicts it, see "sommelier.schema_watcher.SchemaWatcher"
+
+    :param TableDefinition definition: Definition of the table
+    :param dict filters: Filters payload
+    :param ColumnDependentCache cache: Compiled payloads cache
+    :return: BulkFilters instance
+    """
+    payload_key = get_payload_key(filters)
+    if payload_key is None:
+        return compile_bulk_filters(definition, filters)
+
+    from sommelier.query_builder.spec import get_definition_reference
+
+    # Definitions of the same table with different columns or types don't share their entries
+    definition_key = get_definition_reference(definition, filters)
+
+    def get_columns():
+        columns = set(filters)
+        # The errors of unknown columns are stale once the column is added
+        if not columns <= definition.column_names:
+            columns.add(ALL_COLUMNS)
+        return columns
+
+    return cache.get_or_create(('filters', definition_key, payload_key), get_columns,
+                               lambda: compile_bulk_filters(definition, filters))
+
+
+def apply_bulk_filters(query, filters: Dict[str, Any], cache: Optional[ColumnDependentCache] = None) -> BulkFilters:
+    """
+    Add the valid filters of a payload to the query, after its existing filters
+
+    Example:
+
+    result = apply_bulk_filters(query, request.json['filters'], cache=filters_cache)
+    if result.errors:
+        return {'errors': [str(error) for error in result.errors]}, 400
+
+    :param query: Query builder instance, it is modified
+    :param dict filters: Payload in the "MetricsTable.parse_bulk_filters" format
+    :param ColumnDependentCache cache: Optional compiled payloads cache
+    :return: BulkFilters instance, its errors list the entries left out
+    """
+    definition = query.definition
+    if cache is None:
+        compiled = compile_bulk_filters(definition, filters)
+    else:
+        compiled = get_cached_bulk_filters(definition, filters, cache)
+
+    query_filters = query.filters
+    for column, column_filters in compiled.filters.items():
+        existing = query_filters.get(column)
+        query_filters[column] = column_filters if existing is None else (*existing, *column_filters)
+    return compiled
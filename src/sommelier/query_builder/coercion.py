@@ -0,0 +1,207 @@
+import math
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Optional
+
+from sommelier.query_builder.date_types import (MILLISECONDS_IN_SECONDS, DateField, get_granularity_milliseconds,
+                                                simple_date_format_to_strptime)
+from sommelier.query_builder.filter_operators import (MULTI_VALUE_OPERATORS, OPERATOR_JSON_EXTRACT_SCALAR,
+                                                      OPERATOR_JSON_MATCH, OPERATOR_TEXT_MATCH,
+                                                      normalize_json_extract_scalar, normalize_json_match)
+
+# Converts a filter value to the type of its column, raises FilterValueError when it can't
+Coercer = Callable[[Any], Any]
+
+INTEGER_PATTERN = re.compile(r'[-+]?\d+\Z')
+BOOLEAN_STRINGS = {'true': True, 'false': False, '1': True, '0': False}
+
+# Operators whose value is a list of values of the column's type
+LIST_OPERATORS = frozenset(('in', 'isin', 'notin', 'nin')) | MULTI_VALUE_OPERATORS
+SCALAR_OPERATORS = frozenset(('==', '!=', '>', '>=', '<', '<='))
+
+
+class FilterValueError(ValueError):
+    """
+    Raised when a filter value can't be converted to the type of its column
+    """
+
+    def __init__(self, column: str, value: Any, expected: str):
+        self.column = column
+        self.value = value
+        super(FilterValueError, self).__init__(f'Invalid value {value!r} for column "{column}", expected {expected}')
+
+
+def _coerce_int(column: str, value):
+    value_type = type(value)
+    if value_type is int:
+        return value
+    if value_type is float and value.is_integer():
+        return int(value)
+    if value_type is str and INTEGER_PATTERN.match(value.strip()):
+        return int(value)
+    raise FilterValueError(column, value, 'an integer')
+
+
+def _coerce_float(column: str, value):
+    value_type = type(value)
+    if value_type is float or value_type is int:
+        return value
+    if value_type is str:
+        try:
+            converted = float(value)
+        except ValueError:
+            pass
+        else:
+            if math.isfinite(converted):
+                return converted
+    raise FilterValueError(column, value, 'a number')
+
+
+def _coerce_bool(column: str, value):
+    value_type = type(value)
+    if value_type is bool:
+        return value
+    if value_type is int and value in (0, 1):
+        return bool(value)
+    if value_type is str and value.strip().lower() in BOOLEAN_STRINGS:
+        return BOOLEAN_STRINGS[value.strip().lower()]
+    raise FilterValueError(column, value, 'a boolean')
+
+
+def _coerce_str(column: str, value):
+    value_type = type(value)
+    if value_type is str:
+        return value
+    if value_type is bool:
+        return 'true' if value else 'false'
+    if value_type is int or value_type is float:
+        return str(value)
+    raise FilterValueError(column, value, 'a string')
+
+
+def _coerce_bytes(column: str, value):
+    # Pinot compares BYTES columns to hexadecimal strings
+    if type(value) is bytes:
+        return value.hex()
+    if type(value) is str:
+        try:
+            return bytes.fromhex(value).hex()
+        except ValueError:
+            pass
+    raise FilterValueError(column, value, 'bytes or a hexadecimal string')
+
+
+# Coercion of the python types of "sommelier.schema_parser.pinot_type_to_python_type"
+TYPE_COERCERS = {
+    int: _coerce_int,
+    float: _coerce_float,
+    bool: _coerce_bool,
+    str: _coerce_str,
+    bytes: _coerce_bytes,
+}
+
+
+def compile_coercer(column: str, column_type: Callable) -> Coercer:
+    """
+    :param str column: Column name, used in the error messages
+    :param column_type: Python type of the column
+    :return: Function converting a value to the column type. Values of unknown types are returned as is
+    """
+    coerce = TYPE_COERCERS.get(column_type)
+    if coerce is None:
+        return lambda value: value
+    return lambda value: coerce(column, value)
+
+
+def _to_utc_datetime(value) -> datetime:
+    if type(value) is date:
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def compile_date_coercer(column: str, date_field: DateField) -> Coercer:
+    """
+    Values of datetime columns can also be dates and datetimes, converted to the column's format. Naive datetimes are
+    UTC. Simple date format values are checked against the pattern
+
+    :param str column: Column name, used in the error messages
+    :param DateField date_field: Definition of the column
+    :return: Function converting a value to the column's format and type
+    """
+    coerce_type = compile_coercer(column, date_field.data_type)
+    format_parts = date_field.date_format.split(':')
+
+    if 'SIMPLE_DATE_FORMAT' in format_parts:
+        simple_date_format = date_field.get_simple_date_format()
+        pattern = simple_date_format_to_strptime(simple_date_format)
+        # Patterns with separators can only be stored as strings, whatever the declared type
+        numeric = not any(character in simple_date_format for character in '-/: .T')
+
+        def coerce_simple_date(value):
+            if isinstance(value, date):
+                formatted = value.strftime(pattern)
+            else:
+                formatted = _coerce_str(column, value)
+                try:
+                    datetime.strptime(formatted, pattern)
+                except ValueError:
+                    raise FilterValueError(column, value, f'a date formatted as "{simple_date_format}"') from None
+            return coerce_type(formatted) if numeric else formatted
+
+        return coerce_simple_date
+
+    if 'EPOCH' in format_parts:
+        unit_milliseconds = get_granularity_milliseconds(date_field.date_format)
+
+        def coerce_epoch(value):
+            if isinstance(value, date):
+                milliseconds = int(_to_utc_datetime(value).timestamp() * MILLISECONDS_IN_SECONDS)
+                return coerce_type(milliseconds // unit_milliseconds)
+            return coerce_type(value)
+
+        return coerce_epoch
+
+    return coerce_type
+
+
+def coerce_filter_value(coerce: Optional[Coercer], column: str, operator: str, value):
+    """
+    Convert the value of a filter with the column's coercer: every element of the "in" and multi-value lists and both
+    "between" bounds. JSON filters are normalized, see "sommelier.query_builder.filter_operators". Values of the other
+    operators, i.e. regex patterns, are returned as is
+
+    :param coerce: Coercer of the column, see "compile_coercer"
+    :param str column: Column name
+    :param str operator: Filter operator
+    :param value: Filter value
+    :return: Converted value
+    :raises FilterValueError: When the value doesn't match the column type
+    :raises ValueError: When a JSON filter is invalid
+    """
+    if operator == OPERATOR_JSON_MATCH:
+        return normalize_json_match(column, value)
+    if operator == OPERATOR_JSON_EXTRACT_SCALAR:
+        return normalize_json_extract_scalar(column, value)
+    if operator == OPERATOR_TEXT_MATCH:
+        if type(value) is not str:
+            raise FilterValueError(column, value, 'a text search query')
+        return value
+    if coerce is None or value is None:
+        return value
+    if operator in SCALAR_OPERATORS:
+        return coerce(value)
+    if operator in LIST_OPERATORS:
+        if isinstance(value, (str, bytes)) or not hasattr(value, '__iter__'):
+            raise FilterValueError(column, value, f'a list of values for "{operator}"')
+        value = [coerce(element) for element in value]
+        if not value:
+            # "IN ()" is not valid SQL
+            raise FilterValueError(column, value, f'a non empty list of values for "{operator}"')
+        return value
+    if operator == 'between':
+        if isinstance(value, (str, bytes)) or not hasattr(value, '__len__') or len(value) != 2:
+            raise FilterValueError(column, value, 'a pair of bounds for "between"')
+        return [coerce(value[0]), coerce(value[1])]
+    return value
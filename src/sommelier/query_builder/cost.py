@@ -0,0 +1,432 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sommelier.query_builder.date_types import TIME_UNIT_MILLISECONDS, get_granularity_milliseconds
+from sommelier.query_builder.filter_operators import OPERATOR_JSON_EXTRACT_SCALAR, get_json_index_filter
+from sommelier.query_builder.regex_analysis import REGEX_EQUALS, REGEX_IN, REGEX_PREFIX, analyze_regex
+from sommelier.query_builder.table import FIELD_AGGREGATION_PATTERN, PINOT_DEFAULT_GROUP_BY_LIMIT
+
+INDEX_SORTED = 'sorted'
+INDEX_INVERTED = 'inverted'
+INDEX_RANGE = 'range'
+INDEX_BLOOM = 'bloom'
+INDEX_JSON = 'json'
+INDEX_TEXT = 'text'
+
+# Indexes that can resolve each operator without scanning the column values
+OPERATOR_INDEXES = {
+    '==': {INDEX_SORTED, INDEX_INVERTED},
+    '!=': {INDEX_SORTED, INDEX_INVERTED},
+    'in': {INDEX_SORTED, INDEX_INVERTED},
+    'isin': {INDEX_SORTED, INDEX_INVERTED},
+    'notin': {INDEX_SORTED, INDEX_INVERTED},
+    'nin': {INDEX_SORTED, INDEX_INVERTED},
+    '>': {INDEX_SORTED, INDEX_RANGE},
+    '>=': {INDEX_SORTED, INDEX_RANGE},
+    '<': {INDEX_SORTED, INDEX_RANGE},
+    '<=': {INDEX_SORTED, INDEX_RANGE},
+    'between': {INDEX_SORTED, INDEX_RANGE},
+    'mv_any': {INDEX_SORTED, INDEX_INVERTED},
+    'mv_all': {INDEX_SORTED, INDEX_INVERTED},
+    'mv_none': {INDEX_SORTED, INDEX_INVERTED},
+    'json_match': {INDEX_JSON},
+    'text_match': {INDEX_TEXT},
+}
+
+# Selectivity guesses when the cardinality of the column is unknown or the operator is a range
+DEFAULT_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3
+BETWEEN_SELECTIVITY = 1 / 4
+REGEX_SELECTIVITY = 0.1
+
+# Pinot returns this many rows for selection queries without a LIMIT
+DEFAULT_SELECTION_LIMIT = 10
+
+DATETIMECONVERT_GRANULARITY = re.compile(r"(DATETIMECONVERT\(.+,\s*')(\d+:[A-Z]+)('\))", re.IGNORECASE)
+
+AGGREGATION_FUNCTIONS = ('count', 'sum', 'min', 'max', 'avg', 'distinctcount', 'percentile', 'mode')
+
+# Exact aggregations that hold every value of a group in memory, and their constant-size approximations
+APPROXIMATE_AGGREGATES = (
+    (re.compile(r'\Adistinctcount\((.+)\)\Z', re.IGNORECASE), r'DISTINCTCOUNTHLL(\1)'),
+    (re.compile(r'\Apercentile(\d+)\((.+)\)\Z', re.IGNORECASE), r'PERCENTILETDIGEST\1(\2)'),
+)
+
+# Ordered from finest to coarsest, used to downgrade time buckets
+COARSER_GRANULARITIES = ('1:MINUTES', '5:MINUTES', '15:MINUTES', '1:HOURS', '1:DAYS')
+
+
+class ColumnStatistics:
+    """
+    Statistics of a single column used to estimate the cost of a query
+
+    str name - Column name
+    int cardinality - Number of distinct values, None if unknown
+    set indexes - Index types that exist on the column. i.e. {"inverted", "range"}
+    """
+
+    def __init__(self, name: str, cardinality: Optional[int] = None, indexes: Iterable[str] = ()):
+        self.name = name
+        self.cardinality = cardinality
+        self.indexes = frozenset(indexes)
+
+    def __repr__(self):
+        return f'ColumnStatistics({self.name!r}, cardinality={self.cardinality!r}, indexes={sorted(self.indexes)!r})'
+
+    def has_index_for(self, operator: str) -> bool:
+        return bool(self.indexes & OPERATOR_INDEXES.get(operator, set()))
+
+
+class TableStatistics:
+    """
+    Statistics of a Pinot table. Usually built with "sommelier.schema_parser.get_table_statistics"
+
+    dict columns - Column name to ColumnStatistics
+    int total_docs - Number of rows in the table
+    int rows_per_day - Number of rows ingested per day, used with the time filters of a query
+    """
+
+    def __init__(self,
+                 columns: Optional[Dict[str, ColumnStatistics]] = None,
+                 total_docs: Optional[int] = None,
+                 rows_per_day: Optional[int] = None):
+        self.columns = columns or {}
+        self.total_docs = total_docs
+        self.rows_per_day = rows_per_day
+
+    def get_column(self, name: str) -> ColumnStatistics:
+        if name not in self.columns:
+            return ColumnStatistics(name)
+        return self.columns[name]
+
+    def get_cardinalities(self) -> Dict[str, int]:
+        return {name: column.cardinality for name, column in self.columns.items() if column.cardinality is not None}
+
+
+class QueryCost:
+    """
+    Estimated cost of a query
+
+    int docs_in_scope - Rows left after time pruning
+    int docs_scanned - Rows matching the filters that are processed by the aggregations or selection
+    int entries_scanned_in_filter - Values read to evaluate the predicates that can't use an index
+    int result_size - Number of rows returned
+    list full_scan_columns - Columns whose predicates scan the column values
+    """
+
+    def __init__(self,
+                 docs_in_scope: int,
+                 docs_scanned: int,
+                 entries_scanned_in_filter: int,
+                 result_size: int,
+                 full_scan_columns: List[str]):
+        self.docs_in_scope = docs_in_scope
+        self.docs_scanned = docs_scanned
+        self.entries_scanned_in_filter = entries_scanned_in_filter
+        self.result_size = result_size
+        self.full_scan_columns = full_scan_columns
+
+    def __repr__(self):
+        return (f'QueryCost(docs_in_scope={self.docs_in_scope}, docs_scanned={self.docs_scanned}, '
+                f'entries_scanned_in_filter={self.entries_scanned_in_filter}, result_size={self.result_size}, '
+                f'full_scan_columns={self.full_scan_columns})')
+
+
+class QueryCostExceededError(Exception):
+    """
+    Raised when the estimated cost of a query is over its budget
+    """
+
+    def __init__(self, cost: QueryCost, reasons: List[str]):
+        self.cost = cost
+        self.reasons = reasons
+        super(QueryCostExceededError, self).__init__(f'Query is over its cost budget: {"; ".join(reasons)}')
+
+
+class CostBudget:
+    """
+    Limits for the estimated cost of a query.
+
+    int max_docs_scanned - Reject queries processing more rows than this
+    int max_result_size - Queries returning more rows are rejected or, when downgrading, use coarser time buckets
+    int max_exact_aggregation_docs - Exact DISTINCTCOUNT and PERCENTILE over more rows than this are rejected or, when
+                                     downgrading, replaced by DISTINCTCOUNTHLL and PERCENTILETDIGEST
+    bool downgrade - Downgrade the query instead of rejecting it when possible
+    """
+
+    def __init__(self,
+                 max_docs_scanned: Optional[int] = None,
+                 max_result_size: Optional[int] = None,
+                 max_exact_aggregation_docs: Optional[int] = None,
+                 downgrade: bool = False):
+        self.max_docs_scanned = max_docs_scanned
+        self.max_result_size = max_result_size
+        self.max_exact_aggregation_docs = max_exact_aggregation_docs
+        self.downgrade = downgrade
+
+
+def is_aggregation(column_string: str) -> bool:
+    matches = FIELD_AGGREGATION_PATTERN.match(column_string)
+    return bool(matches) and matches.group(1).lower().startswith(AGGREGATION_FUNCTIONS)
+
+
+def get_approximate_aggregate(column_string: str) -> Optional[str]:
+    """
+    :param str column_string: Selected term. i.e. DISTINCTCOUNT(airport)
+    :return: Approximate version of the aggregation or None if it is not an exact aggregation with an approximation
+    """
+    for pattern, replacement in APPROXIMATE_AGGREGATES:
+        if pattern.match(column_string):
+            return pattern.sub(replacement, column_string)
+    return None
+
+
+def get_coarser_time_bucket(column_string: str) -> Optional[str]:
+    """
+    :param str column_string: Selected or grouped term. i.e. DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', ..., '1:HOURS')
+    :return: Same term with the next coarser granularity or None if it is not a DATETIMECONVERT or already the coarsest
+    """
+    matches = DATETIMECONVERT_GRANULARITY.search(column_string)
+    if not matches:
+        return None
+
+    current = get_granularity_milliseconds(matches.group(2))
+    for granularity in COARSER_GRANULARITIES:
+        if get_granularity_milliseconds(granularity) > current:
+            return DATETIMECONVERT_GRANULARITY.sub(rf'\g<1>{granularity}\g<3>', column_string)
+    return None
+
+
+def get_downgraded_query(query):
+    """
+    Cheaper copy of the query: exact aggregations are replaced by their approximations and DATETIMECONVERT buckets
+    by the next coarser granularity
+
+    :param query: Query builder instance, it is not modified
+    :return: Downgraded copy or None if nothing can be downgraded
+    """
+    downgraded = query.copy()
+    approximated = downgraded.replace_terms(get_approximate_aggregate)
+    coarsened = downgraded.replace_terms(get_coarser_time_bucket)
+    if not approximated and not coarsened:
+        return None
+    return downgraded
+
+
+class QueryCostEstimator:
+    """
+    Estimate the cost of a query from the table statistics, the filters, the group by and the selected aggregations
+    """
+
+    def __init__(self, statistics: TableStatistics):
+        self.statistics = statistics
+
+    def get_time_range(self, query) -> Optional[Tuple[int, int]]:
+        """
+        Find the smallest time range of the filters on the datetime columns
+
+        :param query: MetricsTable instance
+        :return: Tuple of start and end in milliseconds (inclusive of the last time bucket) or None
+        """
+        datetime_columns = getattr(query, 'datetime_columns', {})
+        start = None
+        end = None
+
+        for column, operator, value in query.iter_filters():
+            if column not in datetime_columns:
+                continue
+
+            date_field = datetime_columns[column]
+            bounds = []
+            if operator in ('>', '>=', '=='):
+                bounds.append(('start', value))
+            if operator in ('<', '<=', '=='):
+                bounds.append(('end', value))
+            if operator == 'between':
+                bounds.extend((('start', value[0]), ('end', value[1])))
+
+            for side, bound in bounds:
+                milliseconds = date_field.to_milliseconds(bound)
+                if milliseconds is None:
+                    continue
+                if side == 'start':
+                    start = milliseconds if start is None else max(start, milliseconds)
+                else:
+                    milliseconds += get_granularity_milliseconds(date_field.granularity)
+                    end = milliseconds if end is None else min(end, milliseconds)
+
+        if start is None or end is None:
+            return None
+        return start, max(start, end)
+
+    def get_docs_in_scope(self, time_range: Optional[Tuple[int, int]]) -> int:
+        if time_range and self.statistics.rows_per_day is not None:
+            days = (time_range[1] - time_range[0]) / TIME_UNIT_MILLISECONDS['DAYS']
+            in_scope = int(self.statistics.rows_per_day * days)
+            if self.statistics.total_docs is not None:
+                return min(in_scope, self.statistics.total_docs)
+            return in_scope
+
+        if self.statistics.total_docs is not None:
+            return self.statistics.total_docs
+
+        raise ValueError('The table statistics need "total_docs", or "rows_per_day" and a time filter, to estimate '
+                         'the cost of a query')
+
+    @staticmethod
+    def get_regex_equivalent(pattern: str) -> Tuple[str, object]:
+        """
+        Regex filters that are compiled into equality, IN or range predicates are estimated as such
+        """
+        analysis = analyze_regex(pattern)
+        if analysis.operator in (REGEX_EQUALS, REGEX_IN):
+            return analysis.operator, analysis.value
+        if analysis.operator == REGEX_PREFIX:
+            return 'between', analysis.value
+        return 'regex', pattern
+
+    @staticmethod
+    def get_selectivity(column: ColumnStatistics, operator: str, value) -> float:
+        """
+        Fraction of the rows matching the predicate
+
+        :return: float between 0 and 1
+        """
+        cardinality = column.cardinality
+        if operator in ('>', '>=', '<', '<='):
+            return RANGE_SELECTIVITY
+        if operator == 'between':
+            return BETWEEN_SELECTIVITY
+        if operator == 'regex':
+            return REGEX_SELECTIVITY
+        if not cardinality:
+            return DEFAULT_SELECTIVITY
+        if operator == '==':
+            return 1 / cardinality
+        if operator == '!=':
+            return 1 - 1 / cardinality
+        if operator in ('in', 'isin', 'mv_any'):
+            return min(1.0, len(value) / cardinality)
+        if operator in ('notin', 'nin', 'mv_none'):
+            return max(0.0, 1 - len(value) / cardinality)
+        return DEFAULT_SELECTIVITY
+
+    def get_group_count(self, query, time_range: Optional[Tuple[int, int]]) -> Optional[int]:
+        groups = 1
+        for group_by in query.group_by_terms:
+            matches = DATETIMECONVERT_GRANULARITY.search(group_by)
+            if matches and time_range:
+                buckets = (time_range[1] - time_range[0]) // get_granularity_milliseconds(matches.group(2))
+                groups *= max(1, buckets)
+                continue
+
+            cardinality = self.statistics.get_column(group_by).cardinality
+            if cardinality is None:
+                cardinality = query.cardinalities.get(group_by)
+            if cardinality is None:
+                return None
+            groups *= cardinality
+        return groups
+
+    def estimate(self, query) -> QueryCost:
+        """
+        Indexed predicates are evaluated first, the remaining predicates scan the values of the rows that are left.
+
+        :param query: MetricsTable instance
+        :return: QueryCost instance
+        """
+        time_range = self.get_time_range(query)
+        docs_in_scope = self.get_docs_in_scope(time_range)
+        datetime_columns = getattr(query, 'datetime_columns', {})
+
+        indexed_selectivity = 1.0
+        scanned_predicates = []
+        for column, operator, value in query.iter_filters():
+            if column in datetime_columns and time_range:
+                continue
+
+            column_statistics = self.statistics.get_column(column)
+            if operator == 'regex' and query.can_rewrite_regex(column):
+                operator, value = self.get_regex_equivalent(value)
+            elif operator == OPERATOR_JSON_EXTRACT_SCALAR:
+                # Compiled into JSON_MATCH on JSON indexed columns, see "get_json_index_filter"
+                operator = get_json_index_filter(value, INDEX_JSON in column_statistics.indexes)[0]
+
+            selectivity = self.get_selectivity(column_statistics, operator, value)
+            if column_statistics.has_index_for(operator):
+                indexed_selectivity *= selectivity
+            else:
+                scanned_predicates.append((column, selectivity))
+
+        # Custom filters are opaque, assume they scan without filtering anything out
+        scanned_predicates.extend(('<custom filter>', 1.0) for _ in query.custom_filters)
+
+        remaining = docs_in_scope * indexed_selectivity
+        entries_scanned_in_filter = 0
+        full_scan_columns = []
+        for column, selectivity in scanned_predicates:
+            entries_scanned_in_filter += remaining
+            remaining *= selectivity
+            full_scan_columns.append(column)
+
+        docs_scanned = int(remaining)
+        if query.group_by_terms:
+            group_count = self.get_group_count(query, time_range)
+            result_size = docs_scanned if group_count is None else min(group_count, docs_scanned)
+            # Pinot never returns more groups than the LIMIT, its default one when none is emitted
+            result_size = min(result_size, query.get_effective_limit() or PINOT_DEFAULT_GROUP_BY_LIMIT)
+        elif any(is_aggregation(field) for field in query.selected_terms):
+            result_size = 1
+        else:
+            result_size = min(docs_scanned, query.row_limit or DEFAULT_SELECTION_LIMIT)
+
+        return QueryCost(docs_in_scope=docs_in_scope,
+                         docs_scanned=docs_scanned,
+                         entries_scanned_in_filter=int(entries_scanned_in_filter),
+                         result_size=result_size,
+                         full_scan_columns=full_scan_columns)
+
+    @staticmethod
+    def get_budget_violations(query, cost: QueryCost, budget: CostBudget) -> List[str]:
+        violations = []
+        if budget.max_docs_scanned is not None and cost.docs_scanned > budget.max_docs_scanned:
+            violations.append(f'{cost.docs_scanned} docs scanned > {budget.max_docs_scanned}')
+        if budget.max_result_size is not None and cost.result_size > budget.max_result_size:
+            violations.append(f'{cost.result_size} result rows > {budget.max_result_size}')
+        if budget.max_exact_aggregation_docs is not None and cost.docs_scanned > budget.max_exact_aggregation_docs:
+            exact = [field for field in query.selected_terms if get_approximate_aggregate(field)]
+            if exact:
+                violations.append(f'exact aggregations {sorted(exact)} over {cost.docs_scanned} docs > '
+                                  f'{budget.max_exact_aggregation_docs}')
+        return violations
+
+    def apply_budget(self, query, budget: CostBudget):
+        """
+        Check the query against the budget, downgrading it when allowed
+
+        :param query: MetricsTable instance
+        :param CostBudget budget: Limits to apply
+        :return: The query when it is within budget or a downgraded copy
+        """
+        cost = self.estimate(query)
+        violations = self.get_budget_violations(query, cost, budget)
+        if not violations:
+            return query
+
+        if not budget.downgrade:
+            raise QueryCostExceededError(cost, violations)
+
+        downgraded = query.copy()
+        if budget.max_exact_aggregation_docs is not None and cost.docs_scanned > budget.max_exact_aggregation_docs:
+            downgraded.replace_terms(get_approximate_aggregate)
+
+        while budget.max_result_size is not None and cost.result_size > budget.max_result_size:
+            if not downgraded.replace_terms(get_coarser_time_bucket):
+                break
+            cost = self.estimate(downgraded)
+
+        violations = self.get_budget_violations(downgraded, cost, budget)
+        if violations:
+            raise QueryCostExceededError(cost, violations)
+
+        return downgraded
@@ -1,10 +1,29 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Callable, Optional
 
 YYYYMMDD_FORMAT = '%Y%m%d'
 MILLISECONDS_IN_SECONDS = 1000
 
+# Size of the Pinot time units used in date formats and granularities i.e. "15:MINUTES"
+TIME_UNIT_MILLISECONDS = {
+    'MILLISECONDS': 1,
+    'SECONDS': MILLISECONDS_IN_SECONDS,
+    'MINUTES': 60 * MILLISECONDS_IN_SECONDS,
+    'HOURS': 60 * 60 * MILLISECONDS_IN_SECONDS,
+    'DAYS': 24 * 60 * 60 * MILLISECONDS_IN_SECONDS,
+}
+
+# Java SimpleDateFormat tokens to strptime directives, longest tokens first
+SIMPLE_DATE_FORMAT_TOKENS = (
+    ('yyyy', '%Y'),
+    ('MM', '%m'),
+    ('dd', '%d'),
+    ('HH', '%H'),
+    ('mm', '%M'),
+    ('ss', '%S'),
+)
+
 
 class DateTypes(Enum):
     MILLISECONDS = 'MILLISECONDS'
@@ -46,6 +65,30 @@ def convert_date_to_type(from_value: int, from_format: DateTypes, to_format: Dat
     return int(CONVERT_TO_TYPE[to_format](CONVERT_TO_BASE_DATE[from_format](from_value)))
 
 
+def get_granularity_milliseconds(granularity: str) -> int:
+    """
+    Convert a Pinot granularity into milliseconds. i.e. "15:MINUTES" to 900000
+
+    :param str granularity: Expected to be "size:TIME_UNIT"
+    :return: Milliseconds
+    """
+    size, unit = granularity.split(':')[:2]
+    return int(size) * TIME_UNIT_MILLISECONDS[unit]
+
+
+def simple_date_format_to_strptime(simple_date_format: str) -> str:
+    """
+    Convert a Java SimpleDateFormat pattern into a strptime pattern. i.e. "yyyy-MM-dd" to "%Y-%m-%d"
+
+    :param str simple_date_format: Java SimpleDateFormat pattern
+    :return: strptime pattern
+    """
+    converted = simple_date_format
+    for token, directive in SIMPLE_DATE_FORMAT_TOKENS:
+        converted = converted.replace(token, directive)
+    return converted
+
+
 class DateField:
     """
     Class that abstracts the complexity of a date field in Pinot tables
@@ -72,6 +115,26 @@ class DateField:
         format_parts = self.date_format.split(':')
         return format_parts[-1]
 
+    def to_milliseconds(self, value) -> Optional[int]:
+        """
+        Convert a value of this column into milliseconds since epoch (UTC)
+
+        :param value: Value in the column's format
+        :return: Milliseconds since epoch or None if the format is not supported
+        """
+        format_parts = self.date_format.split(':')
+        try:
+            if 'SIMPLE_DATE_FORMAT' in format_parts:
+                pattern = simple_date_format_to_strptime(self.get_simple_date_format())
+                parsed = datetime.strptime(f'{value}', pattern).replace(tzinfo=timezone.utc)
+                return int(parsed.timestamp()) * MILLISECONDS_IN_SECONDS
+            if 'EPOCH' in format_parts:
+                return int(value) * get_granularity_milliseconds(self.date_format)
+        except (KeyError, ValueError):
+            return None
+
+        return None
+
     def get_convert_clause(self, convert_to: str, alias: str = None, granularity: str = None):
         convert = f'DATETIMECONVERT({self.name}, \'{self.date_format}\', \'{convert_to}\', \'{granularity or self.granularity}\')'
 
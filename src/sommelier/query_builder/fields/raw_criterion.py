@@ -0,0 +1,59 @@
+from typing import Optional
+
+from pypika.enums import Boolean
+from pypika.terms import ComplexCriterion, Criterion
+
+
+class RawCriterion(Criterion):
+    """
+    Criterion already rendered to SQL, i.e. a custom filter of a decoded query spec
+    """
+
+    def __init__(self, sql: str, alias=None):
+        super(RawCriterion, self).__init__(alias)
+        self.sql = sql
+
+    def nodes_(self):
+        yield self
+
+    def get_sql(self, **kwargs):
+        return self.sql
+
+
+class RawComplexCriterion(ComplexCriterion):
+    """
+    Rendered AND / OR criterion. It keeps its comparator so it is wrapped in parentheses exactly when the original
+    criterion would have been
+    """
+
+    def __init__(self, comparator: Boolean, sql: str, alias=None):
+        super(RawComplexCriterion, self).__init__(comparator, None, None, alias)
+        self.sql = sql
+
+    def nodes_(self):
+        yield self
+
+    def get_sql(self, subcriterion: bool = False, **kwargs):
+        if subcriterion:
+            return f'({self.sql})'
+        return self.sql
+
+
+def render_criterion(criterion: Criterion):
+    """
+    :param criterion: pypika criterion
+    :return: Tuple of the SQL and the AND / OR comparator, None when the criterion is not a complex criterion
+    """
+    comparator: Optional[str] = None
+    if isinstance(criterion, ComplexCriterion):
+        comparator = criterion.comparator.value
+    return criterion.get_sql(quote_char=None), comparator
+
+
+def build_raw_criterion(sql: str, comparator: Optional[str] = None) -> Criterion:
+    """
+    Inverse of "render_criterion"
+    """
+    if comparator is None:
+        return RawCriterion(sql)
+    return RawComplexCriterion(Boolean(comparator), sql)
@@ -0,0 +1,169 @@
+from typing import Any, List
+
+# Filter operators on JSON columns, values are normalized by "normalize_json_match" and
+# "normalize_json_extract_scalar"
+OPERATOR_JSON_MATCH = 'json_match'
+OPERATOR_JSON_EXTRACT_SCALAR = 'json_extract_scalar'
+
+# Filter operators on multi-value columns: rows with any, all or none of their values in the list
+OPERATOR_MV_ANY = 'mv_any'
+OPERATOR_MV_ALL = 'mv_all'
+OPERATOR_MV_NONE = 'mv_none'
+MULTI_VALUE_OPERATORS = frozenset((OPERATOR_MV_ANY, OPERATOR_MV_ALL, OPERATOR_MV_NONE))
+
+# Lucene query on a text indexed column
+OPERATOR_TEXT_MATCH = 'text_match'
+
+# Comparisons supported on the value extracted by JSON_EXTRACT_SCALAR
+JSON_SCALAR_OPERATORS = frozenset(('==', '!=', '>', '>=', '<', '<=', 'in', 'isin', 'notin', 'nin', 'between'))
+
+# Comparisons JSON_MATCH can resolve with the JSON index, and their SQL
+JSON_MATCH_OPERATORS = {
+    '==': '=',
+    '!=': '!=',
+    'in': 'IN',
+    'isin': 'IN',
+    'notin': 'NOT IN',
+    'nin': 'NOT IN',
+}
+
+# Result type argument of JSON_EXTRACT_SCALAR by python type, bool before int since it is a subclass
+JSON_RESULT_TYPES = (
+    (bool, 'BOOLEAN'),
+    (int, 'LONG'),
+    (float, 'DOUBLE'),
+    (str, 'STRING'),
+)
+
+
+def _check_path(column: str, path):
+    if type(path) is not str or not path.startswith('$'):
+        raise ValueError(f'JSON filter on "{column}" expects a JSON path starting with "$", got {path!r}')
+
+
+def format_json_literal(value) -> str:
+    """
+    :param value: Value compared in a JSON_MATCH expression
+    :return: SQL literal. i.e. 'SFO' or 12
+    """
+    if type(value) is bool:
+        return "'true'" if value else "'false'"
+    if type(value) in (int, float):
+        return str(value)
+    escaped = str(value).replace("'", "''")
+    return f"'{escaped}'"
+
+
+def get_json_match_expression(path: str, operator: str, value) -> str:
+    """
+    Filter expression of JSON_MATCH. i.e. "$.airport" IN ('SFO','JFK')
+
+    :param str path: JSON path. i.e. $.airport
+    :param str operator: One of JSON_MATCH_OPERATORS
+    :param value: Compared value, a list for IN and NOT IN
+    :return: Expression to pass to JSON_MATCH
+    """
+    sql_operator = JSON_MATCH_OPERATORS[operator]
+    if sql_operator.endswith('IN'):
+        literals = ','.join(format_json_literal(element) for element in value)
+        return f'"{path}" {sql_operator} ({literals})'
+    return f'"{path}"{sql_operator}{format_json_literal(value)}'
+
+
+def get_json_result_type(value) -> str:
+    """
+    :param value: Compared value, or list of values
+    :return: Result type of JSON_EXTRACT_SCALAR matching the python type of the value
+    """
+    if isinstance(value, (list, tuple)) and value:
+        value = value[0]
+    for python_type, result_type in JSON_RESULT_TYPES:
+        if isinstance(value, python_type):
+            return result_type
+    return 'STRING'
+
+
+def normalize_json_match(column: str, value) -> str:
+    """
+    :param str column: Column name
+    :param value: A JSON_MATCH expression, or a (path, value) or (path, operator, value) sequence
+    :return: JSON_MATCH expression
+    :raises ValueError: When the value is not one of the above
+    """
+    if type(value) is str:
+        return value
+
+    path, operator, compared = _unpack_json_filter(column, value)
+    if operator not in JSON_MATCH_OPERATORS:
+        raise ValueError(f'"{operator}" is not supported by JSON_MATCH, use one of {sorted(JSON_MATCH_OPERATORS)}')
+    return get_json_match_expression(path, operator, compared)
+
+
+def normalize_json_extract_scalar(column: str, value) -> List[Any]:
+    """
+    :param str column: Column name
+    :param value: (path, value) for equality or (path, operator, value) sequence
+    :return: List of the path, result type, operator and value
+    :raises ValueError: When the value is not one of the above
+    """
+    if isinstance(value, list) and len(value) == 4:
+        # Already normalized
+        _check_path(column, value[0])
+        return value
+
+    path, operator, compared = _unpack_json_filter(column, value)
+    if operator not in JSON_SCALAR_OPERATORS:
+        raise ValueError(f'"{operator}" is not supported on JSON_EXTRACT_SCALAR, use one of '
+                         f'{sorted(JSON_SCALAR_OPERATORS)}')
+    return [path, get_json_result_type(compared), operator, compared]
+
+
+def _unpack_json_filter(column: str, value):
+    if isinstance(value, (str, bytes)) or not isinstance(value, (list, tuple)) or len(value) not in (2, 3):
+        raise ValueError(f'JSON filter on "{column}" expects (path, value) or (path, operator, value), got {value!r}')
+
+    if len(value) == 2:
+        path, compared = value
+        operator = 'in' if isinstance(compared, (list, tuple)) else '=='
+    else:
+        path, operator, compared = value
+    _check_path(column, path)
+    if operator in ('in', 'isin', 'notin', 'nin') and not compared:
+        raise ValueError(f'JSON filter on "{column}" expects a non empty list for "{operator}"')
+    return path, operator, list(compared) if isinstance(compared, tuple) else compared
+
+
+def check_column_kind(definition, column: str, operator: str):
+    """
+    JSON operators only apply to JSON columns, multi-value operators to multi-value columns and TEXT_MATCH to string
+    columns. Pinot rejects the others when the query is executed, they are rejected when the filter is added instead
+
+    :param TableDefinition definition: Definition of the table
+    :param str column: Column name
+    :param str operator: Filter operator
+    :raises ValueError: When the operator doesn't apply to the column
+    """
+    if operator in (OPERATOR_JSON_MATCH, OPERATOR_JSON_EXTRACT_SCALAR):
+        if column not in definition.json_columns:
+            raise ValueError(f'"{operator}" filters need a JSON column, "{column}" is not one')
+    elif operator in MULTI_VALUE_OPERATORS:
+        if column not in definition.multi_value_columns:
+            raise ValueError(f'"{operator}" filters need a multi-value column, "{column}" is not one')
+    elif operator == OPERATOR_TEXT_MATCH:
+        if definition.columns.get(column) is not str or column in definition.json_columns:
+            raise ValueError(f'"{operator}" filters need a string column, "{column}" is not one')
+
+
+def get_json_index_filter(value, json_indexed: bool):
+    """
+    JSON_EXTRACT_SCALAR reads the JSON of every row while JSON_MATCH uses the JSON index, equality and IN filters on
+    the scalar are converted to JSON_MATCH when the column has a JSON index
+
+    :param list value: Normalized value of a "json_extract_scalar" filter
+    :param bool json_indexed: Whether the column has a JSON index
+    :return: Tuple of the operator and value to compile
+    """
+    path, _, operator, compared = value
+    if json_indexed and operator in JSON_MATCH_OPERATORS:
+        return OPERATOR_JSON_MATCH, get_json_match_expression(path, operator, compared)
+    return OPERATOR_JSON_EXTRACT_SCALAR, value
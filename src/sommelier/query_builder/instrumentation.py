@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Optional
+
+PHASE_GENERATE_TERM = 'generate_term'
+PHASE_BUILD_CRITERION = 'build_criterion_for_filter'
+PHASE_RENDER = 'get_sql_query'
+PHASE_NETWORK = 'network'
+PHASE_DECODE = 'decode'
+PHASE_QUEUE_WAIT = 'queue_wait'
+
+COUNTER_QUERIES = 'queries'
+COUNTER_FILTERS = 'filters'
+COUNTER_IN_LIST_VALUES = 'in_list_values'
+COUNTER_MAX_IN_LIST_SIZE = 'max_in_list_size'
+COUNTER_SQL_BYTES = 'sql_bytes'
+
+IN_OPERATORS = ('in', 'isin', 'notin', 'nin')
+
+
+class PhaseTiming:
+    """
+    Accumulated time spent in a phase
+
+    int calls - Number of times the phase ran
+    float total_seconds - Total time spent in the phase
+    float max_seconds - Slowest run of the phase
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def __repr__(self):
+        return f'PhaseTiming(calls={self.calls}, total_seconds={self.total_seconds:.6f})'
+
+    def add(self, seconds: float):
+        self.calls += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class QueryTracer:
+    """
+    Opt-in instrumentation of the query building and execution phases. Queries without a tracer only pay for a single
+    attribute check per compiled query.
+
+    Example:
+
+    tracer = QueryTracer()
+    with tracer.tracing(query):
+        execute_query(query, executor)
+    tracer.phases['network'].total_seconds, tracer.counters['sql_bytes']
+
+    callable on_phase - Called with the phase name and the seconds spent every time a phase ends
+    """
+
+    def __init__(self, on_phase: Optional[Callable[[str, float], None]] = None):
+        self.on_phase = on_phase
+        self.phases: Dict[str, PhaseTiming] = {}
+        self.counters: Dict[str, int] = {}
+
+    def __repr__(self):
+        return f'QueryTracer(phases={self.phases}, counters={self.counters})'
+
+    def reset(self):
+        self.phases = {}
+        self.counters = {}
+
+    def record_phase(self, name: str, seconds: float):
+        if name not in self.phases:
+            self.phases[name] = PhaseTiming()
+        self.phases[name].add(seconds)
+
+        if self.on_phase is not None:
+            self.on_phase(name, seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.record_phase(name, perf_counter() - start)
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        """
+        Time every call of the function as the phase
+
+        :param str name: Phase name
+        :param callable function: Function to time
+        :return: Wrapped function
+        """
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record_phase(name, perf_counter() - start)
+
+        return timed
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_max(self, name: str, value: int):
+        self.counters[name] = max(self.counters.get(name, 0), value)
+
+    def count_query(self, query):
+        """
+        Count the filters and the sizes of the IN lists of a compiled query
+        """
+        self.count(COUNTER_QUERIES)
+        self.count(COUNTER_FILTERS, len(query.custom_filters))
+        for _, operator, value in query.iter_filters():
+            self.count(COUNTER_FILTERS)
+            if operator in IN_OPERATORS:
+                self.count(COUNTER_IN_LIST_VALUES, len(value))
+                self.count_max(COUNTER_MAX_IN_LIST_SIZE, len(value))
+
+    @contextmanager
+    def tracing(self, query):
+        """
+        Trace the query, and the copies made from it, for the duration of the context
+
+        :param query: Query builder instance
+        """
+        previous = query.get_tracer()
+        query.set_tracer(self)
+        try:
+            yield self
+        finally:
+            query.set_tracer(previous)
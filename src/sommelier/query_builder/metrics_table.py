@@ -1,9 +1,15 @@
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
 from sommelier.query_builder.date_types import DateField
 from sommelier.query_builder.table import Table
+from sommelier.query_builder.table_definition import MetricsTableDefinition, get_cached_definition
 from sommelier.types import ColumnTypeDict, DateTypeDict
 
+if TYPE_CHECKING:
+    # The cost and star-tree modules are imported on first use, they aren't needed to build queries
+    from sommelier.query_builder.cost import CostBudget, QueryCost, TableStatistics
+    from sommelier.query_builder.star_tree import StarTreeIndexConfig, StarTreeReport
+
 
 class MetricsTable(Table):
     """
@@ -17,27 +23,85 @@ class MetricsTable(Table):
     set other - List of string column names
     """
 
+    __slots__ = (
+        'statistics',
+        'cost_budget',
+        'star_trees',
+        'known_values',
+    )
+
     def __init__(self, table_name: str,
                  dimension_columns: ColumnTypeDict,
                  metrics_columns: ColumnTypeDict,
                  datetime_columns: DateTypeDict):
 
-        converted_date_columns: ColumnTypeDict = {}
+        definition = get_cached_definition(
+            table_name,
+            (dimension_columns, metrics_columns, datetime_columns),
+            lambda: MetricsTableDefinition(table_name, dimension_columns, metrics_columns, datetime_columns)
+        )
+        self._init_query(definition)
+
+    def _init_query(self, definition: MetricsTableDefinition):
+        super(MetricsTable, self)._init_query(definition)
+        self.statistics: Optional['TableStatistics'] = definition.statistics
+        self.cost_budget: Optional['CostBudget'] = None
+        self.star_trees: List['StarTreeIndexConfig'] = definition.star_trees
+        self.known_values: Dict[str, Iterable] = definition.known_values
 
-        for datetime_column_name, column_info in datetime_columns.items():
-            converted_date_columns[datetime_column_name] = column_info.data_type
+    @property
+    def dimensions(self) -> ColumnTypeDict:
+        return self._definition.dimensions
 
-        all_columns: ColumnTypeDict = dict(
-            **dimension_columns,
-            **metrics_columns,
-            **converted_date_columns
-        )
+    @dimensions.setter
+    def dimensions(self, dimension_columns: ColumnTypeDict):
+        self._replace_columns(dimension_columns=dimension_columns)
+
+    @property
+    def metrics(self) -> ColumnTypeDict:
+        return self._definition.metrics
+
+    @metrics.setter
+    def metrics(self, metrics_columns: ColumnTypeDict):
+        self._replace_columns(metrics_columns=metrics_columns)
+
+    @property
+    def datetime_columns(self) -> DateTypeDict:
+        return self._definition.datetime_columns
+
+    @datetime_columns.setter
+    def datetime_columns(self, datetime_columns: DateTypeDict):
+        self._replace_columns(datetime_columns=datetime_columns)
+
+    def _replace_columns(self, **columns):
+        # The definition is shared with other queries, this query gets its own definition with the new columns
+        definition = self._definition
+        _, kwargs = definition._get_init_arguments()
+        arguments = {
+            'dimension_columns': definition.dimensions,
+            'metrics_columns': definition.metrics,
+            'datetime_columns': definition.datetime_columns,
+            **columns,
+        }
+        self._definition = MetricsTableDefinition(definition.table_name, **arguments, **kwargs)
 
-        super(MetricsTable, self).__init__(table_name, all_columns)
+    @property
+    def multi_value_columns(self) -> FrozenSet[str]:
+        return self._definition.multi_value_columns
 
-        self.dimensions: ColumnTypeDict = dimension_columns
-        self.metrics: ColumnTypeDict = metrics_columns
-        self.datetime_columns: DateTypeDict = datetime_columns
+    @property
+    def json_columns(self) -> FrozenSet[str]:
+        return self._definition.json_columns
+
+    def can_rewrite_regex(self, column: str) -> bool:
+        return self.dimensions.get(column) is str and column not in self.multi_value_columns
+
+    def has_json_index(self, column: str) -> bool:
+        if self.statistics is None:
+            return False
+        from sommelier.query_builder.cost import INDEX_JSON
+
+        return INDEX_JSON in self.statistics.get_column(column).indexes
 
     def _selected_column_strings(self):
         """
@@ -45,8 +109,8 @@ class MetricsTable(Table):
 
         :return: List of string column names
         """
-        metrics_and_dimensions = set(self.dimensions.keys()) | set(self.metrics.keys())
-        intersection = self._selected.intersection(metrics_and_dimensions)
+        metrics_and_dimensions = self._definition.metrics_and_dimensions
+        intersection = metrics_and_dimensions.intersection(self._selected)
 
         if len(metrics_and_dimensions) == len(intersection):
             return ['*']
@@ -73,8 +137,8 @@ class MetricsTable(Table):
         """
         Use the first column unless an override is provided
 
-        :param str start: YYYYMMDD
-        :param str end: YYYYMMDD
+        :param start: In the column's format, or a date or datetime
+        :param end: In the column's format, or a date or datetime
         :param str date_column_override: use this column instead of the default
         :return: The current query instance
         """
@@ -97,7 +161,8 @@ class MetricsTable(Table):
     def parse_bulk_filters(filters):
         """
         Convert dict of filters into list of column name, value, and operator tuples. The operators supported are
-        located in the "get_query" function code
+        located in the "get_query" function code. See "sommelier.query_builder.bulk_filters.apply_bulk_filters" to
+        validate and add the filters to a query in one pass
 
         The filters dict is expected to be of the following format:
 
@@ -140,6 +205,73 @@ class MetricsTable(Table):
                 parsed.append((column, value, op))
         return parsed
 
+    def set_statistics(self, statistics: 'TableStatistics'):
+        """
+        Attach the table statistics used to estimate the cost of the query. The known cardinalities are also used to
+        size group by limits
+
+        :param TableStatistics statistics: See "sommelier.schema_parser.get_table_statistics"
+        :return: The current query instance
+        """
+        self.statistics = statistics
+        self.cardinalities = dict(statistics.get_cardinalities(), **self.cardinalities)
+        return self
+
+    def set_cost_budget(self, budget: 'CostBudget'):
+        """
+        Limits checked by "apply_cost_budget" before the query is executed
+
+        :param CostBudget budget: Cost limits
+        :return: The current query instance
+        """
+        self.cost_budget = budget
+        return self
+
+    def estimate_cost(self) -> 'QueryCost':
+        if self.statistics is None:
+            raise ValueError(f'No statistics for table "{self.table_name}", call set_statistics first')
+        from sommelier.query_builder.cost import QueryCostEstimator
+
+        return QueryCostEstimator(self.statistics).estimate(self)
+
+    def apply_cost_budget(self) -> 'MetricsTable':
+        """
+        Reject the query if its estimated cost is over the budget or return a downgraded copy when the budget allows it
+
+        :return: This instance when there is no budget or it is within budget, otherwise a downgraded copy
+        """
+        if self.cost_budget is None:
+            return self
+        if self.statistics is None:
+            raise ValueError(f'No statistics for table "{self.table_name}", call set_statistics first')
+        from sommelier.query_builder.cost import QueryCostEstimator
+
+        return QueryCostEstimator(self.statistics).apply_budget(self, self.cost_budget)
+
+    def set_star_trees(self, star_trees: List['StarTreeIndexConfig'],
+                       known_values: Optional[Dict[str, Iterable]] = None):
+        """
+        Attach the star-tree indexes of the table
+
+        :param list star_trees: See "sommelier.schema_parser.get_star_tree_index_configs"
+        :param dict known_values: All the values of some dimensions, used to rewrite regex filters into IN filters
+        :return: The current query instance
+        """
+        self.star_trees = star_trees
+        self.known_values = known_values or {}
+        return self
+
+    def shape_for_star_tree(self) -> Tuple['MetricsTable', 'StarTreeReport']:
+        """
+        Check the query against the table's star-trees and rewrite it when it is safe so it can use one of them.
+        A StarTreeFallbackWarning is emitted when the query falls back to a scan
+
+        :return: Tuple of the query to execute (this instance or a rewritten copy) and a StarTreeReport
+        """
+        from sommelier.query_builder.star_tree import shape_for_star_tree
+
+        return shape_for_star_tree(self, self.star_trees, self.known_values)
+
     def get_milliseconds_datetime_column(self) -> Optional[DateField]:
         return MetricsTable.get_milliseconds_from_datetime_columns(self.datetime_columns)
 
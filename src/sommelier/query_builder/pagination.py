@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional
+
+from pypika import Order
+
+from sommelier.broker import BrokerResponse, execute_query
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.types import QueryExecutor
+
+DEFAULT_PAGE_SIZE = 10000
+
+
+class KeysetPaginator:
+    """
+    Iterate over a selection query page by page using keyset pagination.
+
+    Rather than an ever growing OFFSET, every page is ordered by the time column and a tie breaker column and the
+    next page starts right after the last (time, tie breaker) pair of the previous page:
+
+        WHERE ... AND (time > :last_time OR (time = :last_time AND tie_breaker > :last_tie_breaker))
+        ORDER BY time, tie_breaker LIMIT :page_size
+
+    so each page costs the same no matter how deep into the result it is. Only the current page (and the next one
+    when prefetching) is held in memory. A limit already set on the query caps the total number of rows across the
+    pages. The time and tie breaker columns must not be null, a page ending on a null key raises a ValueError.
+
+    MetricsTable query - Selection query to paginate. It is copied and never modified
+    QueryExecutor executor - Callable that sends the SQL to the broker and returns the decoded JSON response
+    int page_size - Maximum number of rows per page
+    str tie_breaker_column - Column that makes (time, tie breaker) unique, i.e. an id column
+    str time_column - Defaults to the first column of the query's "datetime_columns"
+    bool prefetch - Fetch the next page in a background thread while the current page is being consumed
+    """
+
+    def __init__(self,
+                 query: MetricsTable,
+                 executor: QueryExecutor,
+                 tie_breaker_column: str,
+                 page_size: int = DEFAULT_PAGE_SIZE,
+                 time_column: Optional[str] = None,
+                 prefetch: bool = False):
+        if page_size <= 0:
+            raise ValueError('page_size must be a positive integer')
+
+        if query.row_limit is not None and query.row_limit <= 0:
+            # A page without rows has no LIMIT and would return the whole table
+            raise ValueError('The limit of the query must be a positive integer')
+
+        if query.group_by_terms:
+            raise ValueError('Keyset pagination only supports selection queries, the query has a GROUP BY')
+
+        if query.order_by_terms:
+            raise ValueError('Keyset pagination controls the ORDER BY, the query must not be ordered')
+
+        if time_column is None:
+            time_column = list(query.datetime_columns.keys())[0]
+
+        for column in (time_column, tie_breaker_column):
+            if column not in query.columns:
+                raise ValueError(f'Column "{column}" does not exist in table "{query.table_name}"')
+
+        self.executor = executor
+        self.page_size = page_size
+        self.time_column = time_column
+        self.tie_breaker_column = tie_breaker_column
+        self.prefetch = prefetch
+        # Total number of rows to return, the caller's limit
+        self.max_rows: Optional[int] = query.row_limit
+
+        self._base_query = query.copy() \
+            .select(time_column) \
+            .select(tie_breaker_column) \
+            .order_by(time_column, tie_breaker_column, order=Order.asc)
+
+    def get_page_size(self, rows_returned: int = 0) -> int:
+        """
+        :param int rows_returned: Number of rows of the previous pages
+        :return: Limit of the next page, 0 once the caller's limit is reached
+        """
+        if self.max_rows is None:
+            return self.page_size
+        return max(min(self.page_size, self.max_rows - rows_returned), 0)
+
+    def get_page_query(self,
+                       last_time: Any = None,
+                       last_tie_breaker: Any = None,
+                       rows_returned: int = 0) -> MetricsTable:
+        """
+        Build the query for the page following the (last_time, last_tie_breaker) key. The first page has no key
+
+        :param last_time: Value of the time column of the last row of the previous page
+        :param last_tie_breaker: Value of the tie breaker column of the last row of the previous page
+        :param int rows_returned: Number of rows of the previous pages
+        :return: MetricsTable instance for the page
+        :raises ValueError: When the caller's limit is already reached
+        """
+        page_size = self.get_page_size(rows_returned)
+        if page_size <= 0:
+            raise ValueError(f'The limit of {self.max_rows} rows is reached, there is no next page')
+        page_query = self._base_query.copy().limit(page_size)
+        if last_time is None and last_tie_breaker is None:
+            return page_query
+
+        table = self._base_query.get_pypika_table()
+        time_field = getattr(table, self.time_column)
+        tie_breaker_field = getattr(table, self.tie_breaker_column)
+        after_key = (time_field > last_time) | ((time_field == last_time) & (tie_breaker_field > last_tie_breaker))
+
+        return page_query.add_custom_filter(after_key)
+
+    def _fetch(self, page_query: MetricsTable) -> BrokerResponse:
+        return execute_query(page_query, self.executor)
+
+    def _next_key(self, page: BrokerResponse, rows_returned: int):
+        if len(page) < self.get_page_size(rows_returned - len(page)) or not self.get_page_size(rows_returned):
+            return None
+
+        last_row = page.rows[-1]
+        key = last_row[page.column_index(self.time_column)], last_row[page.column_index(self.tie_breaker_column)]
+        if None in key:
+            # Nulls never compare greater than the key so the next page would start over
+            raise ValueError(f'The page ends on a null "{self.time_column}" or "{self.tie_breaker_column}" value, '
+                             f'keyset pagination requires non null key columns')
+        return key
+
+    def __iter__(self) -> Iterator[BrokerResponse]:
+        rows_returned = 0
+        if not self.prefetch:
+            key = (None, None)
+            while key is not None:
+                page = self._fetch(self.get_page_query(*key, rows_returned=rows_returned))
+                rows_returned += len(page)
+                key = self._next_key(page, rows_returned)
+                if len(page):
+                    yield page
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(self._fetch, self.get_page_query())
+            while pending is not None:
+                page = pending.result()
+                rows_returned += len(page)
+                key = self._next_key(page, rows_returned)
+                pending = None
+                if key is not None:
+                    pending = pool.submit(self._fetch, self.get_page_query(*key, rows_returned=rows_returned))
+                if len(page):
+                    yield page
+
+
+def paginate(query: MetricsTable,
+             executor: QueryExecutor,
+             tie_breaker_column: str,
+             page_size: int = DEFAULT_PAGE_SIZE,
+             time_column: Optional[str] = None,
+             prefetch: bool = False) -> Iterator[BrokerResponse]:
+    """
+    Lazily yield the pages of a selection query using keyset pagination. See KeysetPaginator
+
+    Example:
+
+    for page in paginate(query, executor, tie_breaker_column='flight_id', page_size=50000):
+        write_rows(page.rows)
+
+    :return: Generator of BrokerResponse pages
+    """
+    return iter(KeysetPaginator(query, executor, tie_breaker_column,
+                                page_size=page_size, time_column=time_column, prefetch=prefetch))
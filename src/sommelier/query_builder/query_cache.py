@@ -0,0 +1,176 @@
+import re
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Set
+
+# Dependency of the entries built from "SELECT *", invalidated when any column is added or removed
+ALL_COLUMNS = '*'
+
+DEFAULT_QUERY_CACHE_SIZE = 4096
+
+IDENTIFIER = re.compile(r'[A-Za-z_$][\w$.]*')
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def get_query_columns(query) -> FrozenSet[str]:
+    """
+    Columns a query depends on: the columns of its selected, group by and order by terms and of its filters.
+    "*" stands for all the columns
+
+    :param query: Query builder instance
+    :return: frozenset of column names
+    """
+    names = query.definition.column_names
+    columns: Set[str] = {column for column, column_filters in query.filters.items() if column_filters}
+    for term in (*query.selected_terms, *query.group_by_terms, *query.order_by_terms):
+        if term == ALL_COLUMNS:
+            columns.add(ALL_COLUMNS)
+            continue
+        columns.update(identifier for identifier in IDENTIFIER.findall(term) if identifier in names)
+
+    for criterion in query.custom_filters:
+        fields = {field.name for field in criterion.fields_()}
+        if not fields:
+            # Criteria already rendered to SQL don't expose their fields, their identifiers outside of strings are used
+            sql = getattr(criterion, 'sql', None)
+            if sql is None:
+                fields = {ALL_COLUMNS}
+            else:
+                fields = {identifier for identifier in IDENTIFIER.findall(STRING_LITERAL.sub('', sql))
+                          if identifier in names}
+        columns.update(fields)
+    return frozenset(columns)
+
+
+class ColumnDependentCache:
+    """
+    Bounded LRU cache whose entries record the columns they were built from, so a schema change only evicts the
+    entries referencing the changed or removed columns. Thread safe.
+
+    Example:
+
+    cache = ColumnDependentCache()
+    watcher = SchemaWatcher(definition, load_schema, caches=[cache])
+    sql = get_cached_sql(query, cache)
+
+    int max_size - Maximum number of entries
+    """
+
+    def __init__(self, max_size: int = DEFAULT_QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[Any, tuple]' = OrderedDict()
+        self._keys_by_column: Dict[str, Set[Any]] = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, columns: Iterable[str]):
+        """
+        :param key: Hashable key
+        :param value: Cached value
+        :param columns: Columns the value depends on, see "get_query_columns"
+        """
+        columns = frozenset(columns)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (columns, value)
+            for column in columns:
+                self._keys_by_column.setdefault(column, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_create(self, key, columns: Callable[[], Iterable[str]], factory: Callable[[], Any]):
+        """
+        :param key: Hashable key
+        :param callable columns: Returns the columns the value depends on, only called on a miss
+        :param callable factory: Builds the value on a miss
+        :return: The cached or built value
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.put(key, value, columns())
+        return value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for column in entry[0]:
+            keys = self._keys_by_column.get(column)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_column[column]
+
+    def invalidate_columns(self, columns: Iterable[str], columns_added: bool = False) -> int:
+        """
+        Evict the entries depending on any of the columns
+
+        :param columns: Changed or removed columns
+        :param bool columns_added: Also evict the entries depending on all the columns, i.e. built from "SELECT *"
+        :return: Number of evicted entries
+        """
+        columns = set(columns)
+        if columns or columns_added:
+            columns.add(ALL_COLUMNS)
+        with self._lock:
+            keys = set()
+            for column in columns:
+                keys.update(self._keys_by_column.get(column, ()))
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_column.clear()
+
+
+_MISSING = object()
+
+
+def get_cached_sql(query, cache: ColumnDependentCache) -> str:
+    """
+    Compile the query once per distinct query, see "sommelier.query_builder.spec.get_cache_key"
+
+    :param query: Query builder instance
+    :param ColumnDependentCache cache: Compiled SQL cache
+    :return: SQL query string
+    """
+    from sommelier.query_builder.spec import get_cache_key
+
+    return cache.get_or_create(('sql', get_cache_key(query)), lambda: get_query_columns(query), query.get_sql_query)
+
+
+def get_cached_response(query,
+                        executor,
+                        cache: ColumnDependentCache,
+                        sql_cache: Optional[ColumnDependentCache] = None):
+    """
+    Execute the query once per distinct SQL and keep its response until a column it depends on changes
+
+    :param query: Query builder instance
+    :param QueryExecutor executor: Callable that sends the SQL to the broker and returns the JSON response
+    :param ColumnDependentCache cache: Response cache
+    :param ColumnDependentCache sql_cache: Optional compiled SQL cache
+    :return: BrokerResponse instance
+    """
+    from sommelier.broker import execute_query
+
+    sql = get_cached_sql(query, sql_cache) if sql_cache is not None else query.get_sql_query()
+    return cache.get_or_create(('response', sql), lambda: get_query_columns(query),
+                               lambda: execute_query(query, executor))
@@ -0,0 +1,209 @@
+import re
+from typing import List, Optional, Union
+
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+# Operators of the predicates a regex can be rewritten into
+REGEX_EQUALS = '=='
+REGEX_IN = 'in'
+REGEX_PREFIX = 'prefix'
+
+
+class RegexAnalysis:
+    """
+    Index friendly predicate equivalent to a regex filter
+
+    str operator - "==" for an exact match, "in" for an alternation of exact matches, "prefix" for a prefix match or
+                   None when the pattern is too complex and has to stay a regexp_like
+    value - The string for "==" and "prefix", the sorted list of strings for "in"
+    """
+
+    def __init__(self, operator: Optional[str] = None, value: Union[str, List[str], None] = None):
+        self.operator = operator
+        self.value = value
+
+    def __repr__(self):
+        return f'RegexAnalysis({self.operator!r}, {self.value!r})'
+
+    @property
+    def is_complex(self) -> bool:
+        return self.operator is None
+
+
+class NeverMatches(Exception):
+    pass
+
+
+def _parse_literal(text: str) -> Optional[str]:
+    """
+    Unescape a regex made only of literal characters
+
+    :param str text: Regex without anchors
+    :return: The literal string or None if the regex has any special construct
+    :raises NeverMatches: When an anchor is in the middle of literal characters. i.e. "UA^1"
+    """
+    literal = []
+    position = 0
+    while position < len(text):
+        character = text[position]
+        if character == '\\':
+            if position + 1 >= len(text) or text[position + 1].isalnum():
+                # \d, \w, \b, ... are character classes or assertions
+                return None
+            literal.append(text[position + 1])
+            position += 2
+            continue
+
+        if character == '^' and literal:
+            raise NeverMatches()
+        if character == '$' and position + 1 < len(text):
+            raise NeverMatches()
+        if character in REGEX_METACHARACTERS:
+            return None
+
+        literal.append(character)
+        position += 1
+    return ''.join(literal)
+
+
+def _strip_end_anchor(pattern: str):
+    if not pattern.endswith('$'):
+        return pattern, False
+    backslashes = len(pattern[:-1]) - len(pattern[:-1].rstrip('\\'))
+    if backslashes % 2:
+        return pattern, False
+    return pattern[:-1], True
+
+
+def _split_alternatives(body: str) -> Optional[List[str]]:
+    """
+    Split "(a|b)" or "(?:a|b)" into its alternatives. A body without a group is a single alternative
+
+    :return: List of alternatives or None if the groups or alternations are not a single wrapping group
+    """
+    if body.startswith('(') and body.endswith(')') and not body.endswith('\\)'):
+        inner = body[3:-1] if body.startswith('(?:') else body[1:-1]
+        if inner.startswith('?') or '(' in inner or ')' in inner:
+            return None
+        return inner.split('|')
+
+    if '|' in body.replace('\\|', ''):
+        return None
+    return [body]
+
+
+def find_java_syntax_error(pattern: str) -> Optional[str]:
+    """
+    Structural check of a pattern in java.util.regex syntax, the one Pinot uses: unbalanced groups, unclosed
+    character classes, trailing backslashes and dangling quantifiers. It doesn't check the content of the escapes and
+    groups so a pattern it accepts may still be rejected by Pinot
+
+    :param str pattern: Regex pattern
+    :return: Description of the error or None when the pattern looks valid
+    """
+    if pattern[:1] in ('*', '+', '?'):
+        return f'dangling meta character "{pattern[0]}"'
+
+    depth = 0
+    class_depth = 0
+    position = 0
+    while position < len(pattern):
+        character = pattern[position]
+        if character == '\\':
+            if position + 1 >= len(pattern):
+                return 'trailing backslash'
+            if pattern[position + 1] == 'Q':
+                # Quoted until "\E" or the end of the pattern
+                end = pattern.find('\\E', position + 2)
+                if end == -1:
+                    return None
+                position = end + 2
+                continue
+            position += 2
+            continue
+
+        if character == '[':
+            class_depth += 1
+        elif class_depth:
+            if character == ']':
+                class_depth -= 1
+        elif character == '(':
+            depth += 1
+            if pattern[position + 1:position + 2] in ('*', '+'):
+                return f'dangling meta character "{pattern[position + 1]}"'
+        elif character == ')':
+            depth -= 1
+            if depth < 0:
+                return 'unmatched closing ")"'
+        position += 1
+
+    if class_depth:
+        return 'unclosed character class'
+    if depth:
+        return 'unclosed group'
+    return None
+
+
+def analyze_regex(pattern: str) -> RegexAnalysis:
+    """
+    Find an index friendly predicate equivalent to the regex filter. Pinot's regexp_like matches anywhere in the value
+    so only patterns anchored at the start can be rewritten:
+
+     1. "^UA123$" is an exact match
+     2. "^(UA|AA)$" is an IN over the alternatives
+     3. "^UA" or "^UA.*" is a prefix match, a range over the sorted dictionary
+
+    Patterns only valid in Java's syntax are left as they are
+
+    :param str pattern: Regex pattern of the filter
+    :return: RegexAnalysis instance
+    :raises ValueError: When the pattern is invalid or can never match
+    """
+    try:
+        re.compile(pattern)
+    except re.error as error:
+        # Pinot evaluates the pattern with Java's syntax, i.e. "\p{Lu}" and "\Q.\E" are only valid in Java
+        java_error = find_java_syntax_error(pattern)
+        if java_error is not None:
+            raise ValueError(f'Invalid regex filter "{pattern}": {java_error}') from error
+        return RegexAnalysis()
+
+    anchored_start = pattern.startswith('^')
+    body, anchored_end = _strip_end_anchor(pattern[1:] if anchored_start else pattern)
+    if anchored_start and body.endswith('.*') and not body.endswith('\\.*'):
+        # "^UA.*" and "^UA.*$" are the same as "^UA"
+        body = body[:-2]
+        anchored_end = False
+
+    alternatives = _split_alternatives(body)
+    if alternatives is None:
+        return RegexAnalysis()
+
+    try:
+        literals = [_parse_literal(alternative) for alternative in alternatives]
+    except NeverMatches:
+        raise ValueError(f'Regex filter "{pattern}" can never match')
+
+    if not anchored_start or any(literal is None for literal in literals):
+        return RegexAnalysis()
+
+    if anchored_end:
+        values = sorted(set(literals))
+        if len(values) == 1:
+            return RegexAnalysis(REGEX_EQUALS, values[0])
+        return RegexAnalysis(REGEX_IN, values)
+
+    if len(literals) == 1 and literals[0] and ord(literals[0][-1]) < 0x10FFFF:
+        return RegexAnalysis(REGEX_PREFIX, literals[0])
+
+    return RegexAnalysis()
+
+
+def get_prefix_upper_bound(prefix: str) -> str:
+    """
+    Smallest string greater than every string starting with the prefix. i.e. "UA" to "UB"
+
+    :param str prefix: Non empty prefix
+    :return: Exclusive upper bound
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,179 @@
+import hashlib
+import json
+from typing import TYPE_CHECKING, Iterable, Mapping, Optional, Type, Union
+
+from pypika import Order
+
+from sommelier.query_builder.fields.raw_criterion import build_raw_criterion, render_criterion
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.query_cache import ALL_COLUMNS, get_query_columns
+from sommelier.query_builder.table import MAX_AUTO_GROUP_BY_LIMIT, Filter, Table
+from sommelier.query_builder.table_definition import MetricsTableDefinition, TableDefinition
+
+if TYPE_CHECKING:
+    from sommelier.query_builder.cost import TableStatistics
+
+SPEC_VERSION = 1
+
+# Keys of the encoded spec, kept short since specs are sent in bulk
+KEY_VERSION = 'v'
+KEY_TABLE = 't'
+KEY_DEFINITION = 'd'
+KEY_SELECTED = 's'
+KEY_FILTERS = 'f'
+KEY_CUSTOM_FILTERS = 'c'
+KEY_GROUP_BY = 'g'
+KEY_ORDER_BY = 'o'
+KEY_ORDER = 'r'
+KEY_LIMIT = 'l'
+KEY_CARDINALITIES = 'n'
+KEY_MAX_GROUP_BY_LIMIT = 'm'
+KEY_STATISTICS = 'x'
+
+
+class QuerySpecError(ValueError):
+    """
+    Raised when a spec can't be decoded
+    """
+    pass
+
+
+def get_definition_reference(definition: TableDefinition, columns: Optional[Iterable[str]] = None) -> str:
+    """
+    Short digest of the columns and their types, so a spec is never decoded on a definition where its columns differ.
+    Only the columns of the query are digested, so adding or changing other columns keeps the specs and cache keys
+
+    :param TableDefinition definition: Table definition
+    :param columns: Columns of the query, see "get_query_columns". All the columns when None or when it has "*"
+    :return: Hexadecimal digest
+    """
+    if columns is None or ALL_COLUMNS in columns:
+        columns = definition.column_names
+    described = sorted((column, definition.describe_column(column)) for column in columns)
+    return hashlib.sha1(repr((definition.table_name, described)).encode()).hexdigest()[:12]
+
+
+def get_query_spec(query: Table) -> dict:
+    """
+    Canonical state of the query as a dict of JSON types. The selected terms are sorted since their order doesn't
+    change the SQL, the filters are ordered by column and custom filters are rendered to SQL. Statistics set with
+    "set_statistics" are not encoded, only the fact the query has its own, see "decode_query".
+
+    :param query: Query builder instance
+    :return: dict
+    """
+    definition = query.definition
+    spec = {
+        KEY_VERSION: SPEC_VERSION,
+        KEY_TABLE: query.table_name,
+        KEY_DEFINITION: get_definition_reference(definition, get_query_columns(query)),
+    }
+    if query._selected:
+        spec[KEY_SELECTED] = sorted(query._selected)
+    filters = [[column, operator, value] for column, operator, value in query.iter_filters()]
+    if filters:
+        spec[KEY_FILTERS] = filters
+    if query.custom_filters:
+        spec[KEY_CUSTOM_FILTERS] = [list(render_criterion(criterion)) for criterion in query.custom_filters]
+    if query._group_by:
+        spec[KEY_GROUP_BY] = list(query._group_by)
+    if query._order_by:
+        spec[KEY_ORDER_BY] = list(query._order_by)
+    if query._order is not None:
+        spec[KEY_ORDER] = query._order.value
+    if query._limit is not None:
+        spec[KEY_LIMIT] = query._limit
+    if query.cardinalities is not definition.cardinalities and query.cardinalities != definition.cardinalities:
+        spec[KEY_CARDINALITIES] = dict(query.cardinalities)
+    if query.max_group_by_limit != MAX_AUTO_GROUP_BY_LIMIT:
+        spec[KEY_MAX_GROUP_BY_LIMIT] = query.max_group_by_limit
+    statistics = getattr(query, 'statistics', None)
+    if statistics is not None and statistics is not definition.statistics:
+        spec[KEY_STATISTICS] = 1
+    return spec
+
+
+def encode_query(query: Table) -> str:
+    """
+    Compact, canonical and versioned encoding of the query state. Equivalent queries have the same encoding so it can
+    be used as a cache key, see "get_cache_key". It only changes with the columns the query references
+
+    :param query: Query builder instance
+    :return: JSON string
+    :raises TypeError: When a filter value can't be encoded, i.e. a set
+    """
+    return json.dumps(get_query_spec(query), separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+
+
+def get_cache_key(query: Table) -> str:
+    """
+    :param query: Query builder instance
+    :return: Hexadecimal digest of the encoded query
+    """
+    return hashlib.sha1(encode_query(query).encode()).hexdigest()
+
+
+def _get_definition(table_name: str, definitions) -> TableDefinition:
+    if isinstance(definitions, TableDefinition):
+        if definitions.table_name != table_name:
+            raise QuerySpecError(f'Spec is for table "{table_name}", not "{definitions.table_name}"')
+        return definitions
+
+    definition = definitions.get(table_name)
+    if definition is None:
+        raise QuerySpecError(f'No definition for table "{table_name}"')
+    return definition
+
+
+def decode_query(encoded: Union[str, bytes, dict],
+                 definitions: Union[TableDefinition, Mapping[str, TableDefinition]],
+                 query_class: Optional[Type[Table]] = None,
+                 statistics: Optional['TableStatistics'] = None) -> Table:
+    """
+    Build the query back from its encoding. The query is built on the definition of its table so no column
+    information is sent with the spec.
+
+    The statistics of the query change its SQL, i.e. JSON_EXTRACT_SCALAR filters become JSON_MATCH on columns with a
+    JSON index. The ones of the definition are used unless the query had its own, set with "set_statistics", these
+    aren't in the spec and must be given again
+
+    :param encoded: Output of "encode_query", or of "get_query_spec"
+    :param definitions: Definition of the table, or a mapping of the table names to their definitions
+    :param query_class: Class of the query, defaults to MetricsTable for metrics definitions and Table otherwise
+    :param TableStatistics statistics: Statistics the encoded query was given with "set_statistics"
+    :return: Query builder instance
+    :raises QuerySpecError: When the spec version is unknown, the definition doesn't match or the query had its own
+                            statistics and none are given
+    """
+    spec = encoded if isinstance(encoded, dict) else json.loads(encoded)
+    if spec.get(KEY_VERSION) != SPEC_VERSION:
+        raise QuerySpecError(f'Unsupported query spec version {spec.get(KEY_VERSION)!r}')
+
+    definition = _get_definition(spec[KEY_TABLE], definitions)
+    if query_class is None:
+        query_class = MetricsTable if isinstance(definition, MetricsTableDefinition) else Table
+
+    query = query_class.from_definition(definition)
+    query._selected = list(spec.get(KEY_SELECTED, ()))
+    for column, operator, value in spec.get(KEY_FILTERS, ()):
+        query.filters[column] = (*query.filters.get(column, ()), Filter(operator, value))
+    query.custom_filters = [build_raw_criterion(sql, comparator) for sql, comparator in spec.get(KEY_CUSTOM_FILTERS, ())]
+    query._group_by = tuple(spec.get(KEY_GROUP_BY, ()))
+    query._order_by = tuple(spec.get(KEY_ORDER_BY, ()))
+    if KEY_ORDER in spec:
+        query._order = Order(spec[KEY_ORDER])
+    query._limit = spec.get(KEY_LIMIT)
+    if KEY_CARDINALITIES in spec:
+        query.cardinalities = spec[KEY_CARDINALITIES]
+    query.max_group_by_limit = spec.get(KEY_MAX_GROUP_BY_LIMIT, MAX_AUTO_GROUP_BY_LIMIT)
+    if statistics is not None:
+        if not isinstance(query, MetricsTable):
+            raise QuerySpecError(f'Statistics can\'t be set on a {query_class.__name__} query')
+        query.set_statistics(statistics)
+    elif KEY_STATISTICS in spec:
+        raise QuerySpecError(f'The query on table "{definition.table_name}" was encoded with its own statistics, '
+                             f'pass them with "statistics"')
+
+    if spec[KEY_DEFINITION] != get_definition_reference(definition, get_query_columns(query)):
+        raise QuerySpecError(f'The columns of table "{definition.table_name}" differ from the ones of the spec')
+    return query
@@ -0,0 +1,203 @@
+import re
+import warnings
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sommelier.query_builder.cost import is_aggregation
+from sommelier.query_builder.regex_analysis import analyze_regex
+from sommelier.query_builder.table import FIELD_AGGREGATION_PATTERN, Filter
+
+# Predicates the star-tree can solve, all of them on a dimension of the split order
+STAR_TREE_OPERATORS = {'==', '!=', 'in', 'isin', 'notin', 'nin', '>', '>=', '<', '<=', 'between'}
+
+FUNCTION_NAME_SUFFIX = re.compile(r'\d+\Z')
+
+
+class StarTreeFallbackWarning(UserWarning):
+    """
+    Emitted when a query can't be solved by any star-tree index and falls back to scanning the segments
+    """
+    pass
+
+
+def get_function_column_pair(column_string: str) -> Optional[str]:
+    """
+    Convert an aggregation into the star-tree "functionColumnPairs" notation. i.e. sum(price) to SUM__price,
+    PERCENTILETDIGEST95(price) to PERCENTILETDIGEST__price
+
+    :param str column_string: Aggregation term
+    :return: Function column pair or None if it is not an aggregation
+    """
+    matches = FIELD_AGGREGATION_PATTERN.match(column_string)
+    if not matches:
+        return None
+    function, column = matches.groups()
+    return f'{normalize_function_name(function)}__{column.strip()}'
+
+
+def normalize_function_name(function: str) -> str:
+    return FUNCTION_NAME_SUFFIX.sub('', function.upper().replace('_', ''))
+
+
+class StarTreeIndexConfig:
+    """
+    Star-tree index of a Pinot table.
+    See reference at https://docs.pinot.apache.org/basics/indexing/star-tree-index
+
+    list dimensions_split_order - Dimensions the star-tree is built on
+    set function_column_pairs - Pre-aggregated functions. i.e. {"SUM__price", "COUNT__*"}
+    """
+
+    def __init__(self, dimensions_split_order: Iterable[str], function_column_pairs: Iterable[str]):
+        self.dimensions_split_order = list(dimensions_split_order)
+        self.dimensions = frozenset(self.dimensions_split_order)
+        self.function_column_pairs = frozenset(self._normalize_pair(pair) for pair in function_column_pairs)
+
+    def __repr__(self):
+        return f'StarTreeIndexConfig({self.dimensions_split_order!r}, {sorted(self.function_column_pairs)!r})'
+
+    @staticmethod
+    def _normalize_pair(pair: str) -> str:
+        function, column = pair.split('__', 1)
+        return f'{normalize_function_name(function)}__{column}'
+
+    @classmethod
+    def from_config(cls, config) -> 'StarTreeIndexConfig':
+        """
+        :param dict config: Element of "starTreeIndexConfigs" in the "tableIndexConfig" of the table configuration
+        :return: StarTreeIndexConfig instance
+        """
+        pairs = list(config.get('functionColumnPairs') or [])
+        for aggregation_config in config.get('aggregationConfigs') or []:
+            pairs.append(f'{aggregation_config["aggregationFunction"]}__{aggregation_config["columnName"]}')
+        return cls(config.get('dimensionsSplitOrder') or [], pairs)
+
+    def get_mismatches(self, query, rewritable_filters: Iterable[Tuple[str, str]] = ()) -> List[str]:
+        """
+        Find the reasons the query can't be solved by this star-tree
+
+        :param query: Query builder instance
+        :param rewritable_filters: (column, pattern) of the regex filters that will be rewritten into IN filters
+        :return: List of reasons, empty if the star-tree can be used
+        """
+        reasons = []
+        aggregations = [field for field in query._selected if is_aggregation(field)]
+        if not aggregations:
+            reasons.append('selection queries without aggregations can\'t use a star-tree')
+
+        for aggregation in sorted(aggregations):
+            if get_function_column_pair(aggregation) not in self.function_column_pairs:
+                reasons.append(f'aggregation {aggregation} is not in the function column pairs')
+
+        for field in sorted(query._selected):
+            if not is_aggregation(field) and field not in query._group_by:
+                reasons.append(f'selected column {field} is not aggregated or grouped')
+
+        for column in query._group_by:
+            if column not in self.dimensions:
+                reasons.append(f'group by {column} is not in the dimensions split order')
+
+        for column, operator, value in query.iter_filters():
+            if column not in self.dimensions:
+                reasons.append(f'filter on {column} is not in the dimensions split order')
+            elif operator == 'regex' and (column, value) in rewritable_filters:
+                continue
+            elif operator == 'regex' and query.can_rewrite_regex(column) and not analyze_regex(value).is_complex:
+                # Compiled into an equality, IN or range predicate
+                continue
+            elif operator not in STAR_TREE_OPERATORS:
+                reasons.append(f'{operator} filter on {column} is not supported by the star-tree')
+
+        if query.custom_filters:
+            reasons.append('custom filters can\'t be checked against the star-tree')
+
+        return reasons
+
+
+class StarTreeReport:
+    """
+    Result of checking a query against the star-tree indexes of its table
+
+    StarTreeIndexConfig star_tree - The star-tree the query uses, None if it falls back to a scan
+    dict fallback_reasons - Reasons each star-tree (by position) can't be used
+    list rewrites - Descriptions of the rewrites done so the query can use the star-tree
+    """
+
+    def __init__(self,
+                 star_tree: Optional[StarTreeIndexConfig],
+                 fallback_reasons: Dict[int, List[str]],
+                 rewrites: List[str]):
+        self.star_tree = star_tree
+        self.fallback_reasons = fallback_reasons
+        self.rewrites = rewrites
+
+    def __repr__(self):
+        return f'StarTreeReport(uses_star_tree={self.uses_star_tree}, fallback_reasons={self.fallback_reasons})'
+
+    @property
+    def uses_star_tree(self) -> bool:
+        return self.star_tree is not None
+
+
+def get_regex_rewrites(query, known_values: Dict[str, Iterable]) -> Dict[Tuple[str, str], List]:
+    """
+    Regex filters on columns with known values can be replaced by an IN filter on the matching values. Pinot's
+    regexp_like matches anywhere in the value, like re.search
+
+    :param query: Query builder instance
+    :param dict known_values: Column name to all the values of the column
+    :return: Dict of (column, pattern) to the sorted matching values. Patterns matching nothing or only valid in Java's
+             syntax are left out
+    """
+    rewrites = {}
+    for column, operator, value in query.iter_filters():
+        if operator != 'regex' or column not in known_values:
+            continue
+        try:
+            pattern = re.compile(value)
+        except re.error:
+            # i.e. "\p{Lu}" is only valid in Java, Pinot has to evaluate the regexp_like itself
+            continue
+        matching = sorted(known for known in known_values[column] if pattern.search(str(known)))
+        if matching:
+            rewrites[(column, value)] = matching
+    return rewrites
+
+
+def shape_for_star_tree(query,
+                        star_trees: List[StarTreeIndexConfig],
+                        known_values: Optional[Dict[str, Iterable]] = None):
+    """
+    Check the query against the star-trees and rewrite it when it is safe so it can use one of them. The query itself
+    is never modified.
+
+    :param query: Query builder instance
+    :param list star_trees: StarTreeIndexConfig instances of the table
+    :param dict known_values: Column name to all the values of the column, used to rewrite regex filters
+    :return: Tuple of the query (a rewritten copy when rewrites were done) and a StarTreeReport
+    """
+    regex_rewrites = get_regex_rewrites(query, known_values or {})
+
+    fallback_reasons = {}
+    for position, star_tree in enumerate(star_trees):
+        reasons = star_tree.get_mismatches(query, regex_rewrites)
+        if reasons:
+            fallback_reasons[position] = reasons
+            continue
+
+        if not regex_rewrites:
+            return query, StarTreeReport(star_tree, fallback_reasons, [])
+
+        shaped = query.copy()
+        descriptions = []
+        for (column, pattern), values in sorted(regex_rewrites.items()):
+            shaped.filters[column] = tuple(
+                Filter('in', values) if shaped.get_filter_operator_and_value(filter_value) == ('regex', pattern)
+                else filter_value
+                for filter_value in shaped.filters[column]
+            )
+            descriptions.append(f'regex {pattern!r} on {column} rewritten to IN over {len(values)} known values')
+        return shaped, StarTreeReport(star_tree, fallback_reasons, descriptions)
+
+    warnings.warn(f'Query on "{query.table_name}" can\'t use a star-tree index and falls back to a scan: '
+                  f'{fallback_reasons or "the table has no star-tree index"}', StarTreeFallbackWarning, stacklevel=2)
+    return query, StarTreeReport(None, fallback_reasons, [])
@@ -1,18 +1,61 @@
-from collections import defaultdict
+import copy
 import re
-from typing import Dict, Iterable, List, Union
+import warnings
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from sommelier.query_builder.coercion import coerce_filter_value
+from sommelier.query_builder.filter_operators import (OPERATOR_JSON_EXTRACT_SCALAR, OPERATOR_JSON_MATCH,
+                                                      OPERATOR_MV_ALL, OPERATOR_MV_ANY, OPERATOR_MV_NONE,
+                                                      OPERATOR_TEXT_MATCH, check_column_kind, get_json_index_filter)
+from sommelier.query_builder.instrumentation import (COUNTER_SQL_BYTES, PHASE_BUILD_CRITERION, PHASE_GENERATE_TERM,
+                                                      PHASE_RENDER)
+from sommelier.query_builder.regex_analysis import (REGEX_EQUALS, REGEX_IN, REGEX_PREFIX, RegexAnalysis,
+                                                    analyze_regex, get_prefix_upper_bound)
+from sommelier.query_builder.table_definition import TableDefinition, get_cached_definition
+from sommelier.types import ColumnTypeDict
 
-import pypika
-from pypika import functions
-from pypika.terms import Field, Star
+if TYPE_CHECKING:
+    from pypika.terms import Field
 
-from sommelier.query_builder.fields.regex_like import RegexLike
-from sommelier.query_builder.functions import PercentileEst, PercentileTDigest, Percentile, DistinctCount
-from sommelier.types import ColumnTypeDict
+# pypika and the aggregate function classes are imported when a query is first compiled, building a query only needs
+# the standard library so short lived processes start fast
 
 FIELD_AGGREGATION_PATTERN = re.compile(r'(.+)\((.+)\)\Z')
 PERCENTILE_EXTRACTION = re.compile(r'(\D+)(\d+)')
 
+# Pinot returns only this many groups when a group by query has no LIMIT
+PINOT_DEFAULT_GROUP_BY_LIMIT = 10
+# Upper bound for automatically sized group by limits so a large cardinality can't blow up the broker memory
+MAX_AUTO_GROUP_BY_LIMIT = 100000
+
+_NOT_IN_DEFINITION = object()
+
+
+class Filter(NamedTuple):
+    """
+    Filter on a column. It is a tuple of the operator and the value but still supports filter["op"] and
+    filter["value"] like the dicts filters used to be stored as
+    """
+    op: str
+    value: Any
+
+    def __getitem__(self, key):
+        if key == 'op':
+            return self.op
+        if key == 'value':
+            return self.value
+        if isinstance(key, str):
+            raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+
+class GroupByTruncationWarning(UserWarning):
+    """
+    Emitted when a group by query may be silently truncated to Pinot's default limit
+    """
+    pass
+
 
 class Table(object):
     """
@@ -21,40 +64,184 @@ class Table(object):
 
     str table_name - The Pinot table name
     set columns - List of string column names that exist in the table
+
+    Applications hold many query instances at once so the per query state is kept compact: there is no instance
+    __dict__, the filters of a column are a tuple of Filter tuples, the group by and order by are tuples and everything
+    about the table is in a TableDefinition shared by reference.
+
+    "filters" is a defaultdict, the filters of a column without any are an empty tuple. Filters are added with
+    "filter_column_by_value", a column's tuple can't be appended to. Assigning "table_name" or "columns" gives the query
+    its own definition, the other queries on the table are not changed.
     """
+    __slots__ = (
+        '_definition',
+        '_selected',
+        'filters',
+        'custom_filters',
+        '_group_by',
+        '_order_by',
+        '_order',
+        '_limit',
+        'cardinalities',
+        'max_group_by_limit',
+        '_tracer',
+    )
+
     def __repr__(self):
         return self.get_sql_query()
 
     def __init__(self, table_name: str, columns: ColumnTypeDict):
-        self.table_name = table_name
-        self.columns = columns
+        definition = get_cached_definition(table_name, (columns,), lambda: TableDefinition(table_name, columns))
+        self._init_query(definition)
+
+    @classmethod
+    def from_definition(cls, definition: TableDefinition):
+        """
+        Build a query on a table definition. Only the per query state is allocated, everything about the table is
+        shared with the other queries on the definition
+
+        :param TableDefinition definition: Definition of the table
+        :return: New query instance
+        """
+        query = cls.__new__(cls)
+        query._init_query(definition)
+        return query
 
-        self._selected = set()
-        self.filters = defaultdict(list)
+    def _init_query(self, definition: TableDefinition):
+        self._definition = definition
+        self._selected: List[str] = []
+        self.filters: Dict[str, Tuple[Filter, ...]] = defaultdict(tuple)
         self.custom_filters = []
-        self._group_by = []
-        self._order_by = []
+        self._group_by = ()
+        self._order_by = ()
         self._order = None
         self._limit = None
-        self._pypika_table = None
+        self.cardinalities: Dict[str, int] = definition.cardinalities
+        self.max_group_by_limit = MAX_AUTO_GROUP_BY_LIMIT
+        self._tracer = None
+
+    def __getstate__(self):
+        # Attributes still pointing to the definition's read only mappings are restored from the definition so they
+        # are shared again once unpickled
+        definition = self._definition
+        state = {}
+        shared = []
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(self, name)
+                if value is getattr(definition, name, _NOT_IN_DEFINITION):
+                    shared.append(name)
+                else:
+                    state[name] = value
+        return state, shared
+
+    def __setstate__(self, state):
+        attributes, shared = state
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        for name in shared:
+            setattr(self, name, getattr(self._definition, name))
+
+    @property
+    def definition(self) -> TableDefinition:
+        return self._definition
+
+    @property
+    def table_name(self) -> str:
+        return self._definition.table_name
+
+    @table_name.setter
+    def table_name(self, table_name: str):
+        # The definition is shared with other queries, this query gets its own copy
+        definition = copy.copy(self._definition)
+        definition.rename(table_name)
+        self._definition = definition
+
+    @property
+    def columns(self) -> ColumnTypeDict:
+        return self._definition.columns
+
+    @columns.setter
+    def columns(self, columns: ColumnTypeDict):
+        # The definition is shared with other queries, this query gets its own copy
+        definition = copy.copy(self._definition)
+        definition.update_columns(columns)
+        self._definition = definition
+
+    def copy(self):
+        """
+        Create an independent copy of the query so the copy can be modified without changing this instance
+
+        :return: New query instance of the same class
+        """
+        duplicate = copy.copy(self)
+        duplicate._selected = list(self._selected)
+        duplicate.filters = defaultdict(tuple, self.filters)
+        duplicate.custom_filters = list(self.custom_filters)
+        return duplicate
+
+    def get_fingerprint(self) -> str:
+        """
+        Identify the shape of the query: the same table, selected terms, filtered columns and operators, group by,
+        order by and whether it has a limit. Filter values are left out so queries only differing by their values
+        share the fingerprint
+
+        :return: Hexadecimal digest
+        """
+        shape = repr((
+            self.table_name,
+            sorted(self._selected_column_strings()),
+            sorted({(column, operator) for column, operator, _ in self.iter_filters()}),
+            len(self.custom_filters),
+            self._group_by,
+            self._order_by,
+            str(self._order),
+            self._limit is not None,
+        ))
+        import hashlib
+
+        return hashlib.sha1(shape.encode()).hexdigest()[:16]
 
     def get_pypika_table(self):
-        if not self._pypika_table:
-            self._pypika_table = pypika.Table(self.table_name)
-        return self._pypika_table
+        return self._definition.get_pypika_table()
+
+    def set_tracer(self, tracer):
+        """
+        Time the build phases of the query and count its filters. Copies of the query share the tracer
+
+        :param sommelier.query_builder.instrumentation.QueryTracer tracer: Tracer or None to disable tracing
+        :return: The current query instance
+        """
+        self._tracer = tracer
+        return self
+
+    def get_tracer(self):
+        return self._tracer
 
     def get_sql_query(self):
-        return self.get_query().get_sql(quote_char=None)
+        tracer = self._tracer
+        if tracer is None:
+            return self.get_query().get_sql(quote_char=None)
+
+        query = self.get_query()
+        with tracer.phase(PHASE_RENDER):
+            sql = query.get_sql(quote_char=None)
+        tracer.count(COUNTER_SQL_BYTES, len(sql.encode()))
+        return sql
 
     @staticmethod
-    def operator_to_criterion(operator: str, column: Field, value: Union[str, int, float]):
+    def operator_to_criterion(operator: str, column: 'Field', value: Union[str, int, float], rewrite_regex=True):
         """
-        Converts the operator, column, and value into a criterion
+        Converts the operator, column, and value into a criterion. Regex filters that are exact matches, alternations
+        of exact matches or prefixes are converted into equality, IN or range criteria that can use the indexes.
+        The JSON, multi-value and text operators are in "sommelier.query_builder.filter_operators"
 
-        :param str operator: Expected to be one of the eight supported strings
+        :param str operator: Expected to be one of the supported strings
         :param pypika.terms.Field column: This is expected to be a column from ta pypika table.
         :param [int, float, str] value: The value to produce a filter on for the column
+        :param bool rewrite_regex: Whether regex filters can be rewritten, see "can_rewrite_regex"
         :return: pypika.terms.Criterion or None if the operator is not supported
+        :raises ValueError: When a regex filter is invalid or can never match
         """
         if operator == '==':
             return column == value
@@ -77,9 +264,60 @@ class Table(object):
             advanced_criterion &= column <= value[1]
             return advanced_criterion
         elif operator == 'regex':
+            analysis = analyze_regex(value) if rewrite_regex else RegexAnalysis()
+            if analysis.operator == REGEX_EQUALS:
+                return column == analysis.value
+            elif analysis.operator == REGEX_IN:
+                return column.isin(analysis.value)
+            elif analysis.operator == REGEX_PREFIX:
+                prefix_criterion = column >= analysis.value
+                prefix_criterion &= column < get_prefix_upper_bound(analysis.value)
+                return prefix_criterion
+            from sommelier.query_builder.fields.regex_like import RegexLike
+
             return RegexLike(column, value)
+        elif operator == OPERATOR_MV_ANY:
+            return column.isin(value)
+        elif operator == OPERATOR_MV_ALL:
+            # Every value of the list is one of the values of the row
+            all_criterion = column == value[0]
+            for element in value[1:]:
+                all_criterion &= column == element
+            return all_criterion
+        elif operator == OPERATOR_MV_NONE:
+            return column.notin(value)
+
+        from pypika.terms import Function
+
+        if operator == OPERATOR_JSON_MATCH:
+            return Function('JSON_MATCH', column, value)
+        elif operator == OPERATOR_JSON_EXTRACT_SCALAR:
+            path, result_type, scalar_operator, scalar_value = value
+            extracted = Function('JSON_EXTRACT_SCALAR', column, path, result_type)
+            return Table.operator_to_criterion(scalar_operator, extracted, scalar_value)
+        elif operator == OPERATOR_TEXT_MATCH:
+            return Function('TEXT_MATCH', column, value)
         return None
 
+    def can_rewrite_regex(self, column: str) -> bool:
+        """
+        Whether regex filters on the column can be rewritten into equality, IN or range predicates. Only single value
+        string columns compare like the regex matches
+
+        :param str column: Column name
+        :return: bool
+        """
+        return self.columns.get(column) is str and column not in self._definition.multi_value_columns
+
+    def has_json_index(self, column: str) -> bool:
+        """
+        Whether JSON filters on the column can use a JSON index. Tables without statistics don't know their indexes
+
+        :param str column: Column name
+        :return: False, see MetricsTable
+        """
+        return False
+
     def _selected_column_strings(self):
         """
         Expected to return a list of string column names. This is for child classes to override if needed
@@ -95,28 +333,39 @@ class Table(object):
 
         :return: QueryBuilder instance from the pypika lib
         """
+        generate_term = self.generate_term
+        build_criterion_for_filter = self.build_criterion_for_filter
+        tracer = self._tracer
+        if tracer is not None:
+            generate_term = tracer.wrap(PHASE_GENERATE_TERM, generate_term)
+            build_criterion_for_filter = tracer.wrap(PHASE_BUILD_CRITERION, build_criterion_for_filter)
+            tracer.count_query(self)
+
         table = self.get_pypika_table()
         fields = sorted(self._selected_column_strings(), key=lambda x: str(x))
         parsed_terms = []
         for field in fields:
-            parsed_term = self.generate_term(field)
+            parsed_term = generate_term(field)
             if parsed_term:
                 parsed_terms.append(parsed_term)
 
+        import pypika
+
         query = pypika.Query.from_(table).select(*parsed_terms)
 
-        criterion_for_basic_ops = self.build_criterion_for_filter(self.filters)
+        criterion_for_basic_ops = build_criterion_for_filter(self.filters)
         if criterion_for_basic_ops:
             query = query.where(criterion_for_basic_ops)
 
-        if self._limit:
-            query = query.limit(self._limit)
+        limit = self.get_effective_limit()
+        if limit:
+            query = query.limit(limit)
 
         if self._group_by:
             query = query.groupby(*self._group_by)
 
         if self._order_by:
-            parsed_order_by = [self.generate_term(field) for field in self._order_by]
+            parsed_order_by = [generate_term(field) for field in self._order_by]
             query = query.orderby(order=self._order, *parsed_order_by)
 
         if self.custom_filters:
@@ -132,8 +381,7 @@ class Table(object):
         :param str column: string names
         :return: The current query instance
         """
-        self._group_by.append(column)
-        self._group_by = sorted(self._group_by)
+        self._group_by = tuple(sorted((*self._group_by, column)))
         return self
 
     def group_by_columns(self, columns: List[str]):
@@ -143,9 +391,37 @@ class Table(object):
         :param list columns: string names
         :return: The current query instance
         """
-        self._group_by = sorted(columns)
+        self._group_by = tuple(sorted(columns))
         return self
 
+    @property
+    def selected_terms(self) -> Tuple[str, ...]:
+        """
+        :return: Selected terms as they are compiled, see "_selected_column_strings"
+        """
+        return tuple(self._selected_column_strings())
+
+    @property
+    def group_by_terms(self) -> Tuple[str, ...]:
+        """
+        :return: Sorted columns the query is grouped by
+        """
+        return self._group_by
+
+    @property
+    def order_by_terms(self) -> Tuple[str, ...]:
+        """
+        :return: Terms the query is ordered by, in order
+        """
+        return self._order_by
+
+    @property
+    def row_limit(self) -> Optional[int]:
+        """
+        :return: Limit set with "limit" or "top_n", None when there is none
+        """
+        return self._limit
+
     def order_by(self, *fields: str, order=None):
         """
         SQL ORDER BY keyword
@@ -154,8 +430,7 @@ class Table(object):
         :param fields: fields to order by
         :return: Current query instances
         """
-        for field in fields:
-            self._order_by.append(field)
+        self._order_by = (*self._order_by, *fields)
         self._order = order
         return self
 
@@ -169,6 +444,133 @@ class Table(object):
         self._limit = value
         return self
 
+    def top_n(self, value: int, aggregation: str, order=None):
+        """
+        Select the aggregation, order the groups by it and keep only the first "value" groups. Pinot trims the groups
+        on the servers for these queries so this is cheap even for high cardinality group bys
+
+        :param int value: Number of groups to return
+        :param str aggregation: Aggregation to rank the groups by. i.e. SUM(price)
+        :param order: DESC (default) or ASC
+        :return: The current query instance
+        """
+        if not FIELD_AGGREGATION_PATTERN.match(aggregation):
+            raise ValueError(f'"{aggregation}" is not an aggregation')
+
+        if order is None:
+            from pypika import Order
+            order = Order.desc
+
+        self._order_by = ()
+        return self.select(aggregation).order_by(aggregation, order=order).limit(value)
+
+    def replace_terms(self, replace) -> bool:
+        """
+        Rewrite the selected, group by and order by terms
+
+        :param callable replace: Called with each term, returns the new term or None to keep it
+        :return: True if any term was replaced
+        """
+        replaced = False
+
+        def replace_all(terms):
+            nonlocal replaced
+            new_terms = []
+            for term in terms:
+                new_term = replace(term)
+                if new_term is not None and new_term != term:
+                    replaced = True
+                    term = new_term
+                new_terms.append(term)
+            return new_terms
+
+        self._selected = list(dict.fromkeys(replace_all(self._selected)))
+        self._group_by = tuple(sorted(replace_all(self._group_by)))
+        self._order_by = tuple(replace_all(self._order_by))
+        return replaced
+
+    def set_cardinalities(self, cardinalities: Dict[str, int]):
+        """
+        Known number of distinct values per column. Used to size the LIMIT of group by queries
+
+        :param dict cardinalities: Keys are column names and values are the number of distinct values
+        :return: The current query instance
+        """
+        self.cardinalities = cardinalities
+        return self
+
+    def is_ordered_by_aggregation(self) -> bool:
+        return any(FIELD_AGGREGATION_PATTERN.match(field) for field in self._order_by)
+
+    def is_top_n(self) -> bool:
+        """
+        A top-N query is a group by ordered by an aggregation with an explicit limit. Getting exactly "limit" rows back
+        is expected for these queries and is not a truncation
+
+        :return: bool
+        """
+        return bool(self._group_by and self._limit and self.is_ordered_by_aggregation())
+
+    def estimate_group_count(self) -> Optional[int]:
+        """
+        Upper bound of the number of groups from the cardinalities of the group by columns
+
+        :return: Product of the cardinalities or None if the cardinality of a column is unknown
+        """
+        estimate = 1
+        for column in self._group_by:
+            cardinality = self.cardinalities.get(column)
+            if cardinality is None:
+                return None
+            estimate *= cardinality
+        return estimate
+
+    def get_effective_limit(self) -> Optional[int]:
+        """
+        The LIMIT to send to Pinot. Explicit limits are always used as is. Group by queries without a limit are
+        otherwise silently truncated by Pinot to 10 groups, so:
+
+         1. When ordered by an aggregation, the query is a top-N and the default is kept, use "limit" or "top_n" to
+            choose N.
+         2. When the cardinalities of all the group by columns are known, the limit is sized to the number of possible
+            groups (capped by "max_group_by_limit").
+         3. Otherwise Pinot's default is kept.
+
+        See "warn_group_by_limit" for the warnings about the cases 1, 3 and the capped limits
+
+        :return: Limit or None if no LIMIT should be emitted
+        """
+        if self._limit or not self._group_by or self.is_ordered_by_aggregation():
+            return self._limit
+
+        estimate = self.estimate_group_count()
+        if estimate is None:
+            return None
+        return min(estimate, self.max_group_by_limit)
+
+    def warn_group_by_limit(self):
+        """
+        Emit a GroupByTruncationWarning when the effective limit of a group by query may truncate its groups. Called
+        when the query is executed, see "sommelier.broker.execute_query", so compiling or printing a query is silent
+        """
+        if self._limit or not self._group_by:
+            return
+
+        if self.is_ordered_by_aggregation():
+            warnings.warn(f'Group by query on "{self.table_name}" ordered by an aggregation has no limit, only the top '
+                          f'{PINOT_DEFAULT_GROUP_BY_LIMIT} groups are returned. Use limit() or top_n()',
+                          GroupByTruncationWarning, stacklevel=3)
+            return
+
+        estimate = self.estimate_group_count()
+        if estimate is None:
+            warnings.warn(f'Group by query on "{self.table_name}" has no limit and the cardinality of '
+                          f'{self._group_by} is unknown, Pinot returns only {PINOT_DEFAULT_GROUP_BY_LIMIT} groups',
+                          GroupByTruncationWarning, stacklevel=3)
+        elif estimate > self.max_group_by_limit:
+            warnings.warn(f'Group by query on "{self.table_name}" may return up to {estimate} groups, the limit is '
+                          f'capped to {self.max_group_by_limit}', GroupByTruncationWarning, stacklevel=3)
+
     def generate_term(self, column_string: str):
         """
         Convert string object in Pypika aggregation and Field objects
@@ -176,6 +578,11 @@ class Table(object):
         :param column_string: string representation of term. i.e. SUM(foo)
         :return: Pypika terms
         """
+        from pypika import functions
+        from pypika.terms import Field, Star
+
+        from sommelier.query_builder.functions import DistinctCount, Percentile, PercentileEst, PercentileTDigest
+
         matches = FIELD_AGGREGATION_PATTERN.match(column_string)
         if matches and len(matches.groups()) == 2:
             column = matches.groups()[1]
@@ -216,7 +623,8 @@ class Table(object):
         :param str column: Name of the column to add to select
         :return: The current query instance
         """
-        self._selected.add(column)
+        if column not in self._selected:
+            self._selected.append(column)
 
         return self
 
@@ -243,18 +651,55 @@ class Table(object):
 
     def filter_column_by_value(self, column: str, value, operator: str = '=='):
         """
-        Check if the column exists in the table and then add the filter config to the filters dict
+        Check if the column exists in the table and then add the filter config to the filters dict. The value is
+        converted to the column type once, here, so the literals in the SQL always match the column type
 
         :param str column: Column name
         :param * value: Can be string, number, or array
-        :param str operator: Currently supports "==", "!=", ">", "<", "<=", ">=", "isin", "between"
+        :param str operator: Currently supports "==", "!=", ">", "<", "<=", ">=", "isin", "notin", "between", "regex",
+                             "json_match", "json_extract_scalar", "mv_any", "mv_all", "mv_none" and "text_match"
         :return: The current query instance
+        :raises ValueError: When a regex filter is invalid or can never match, or the operator doesn't apply to the
+                            column, i.e. "json_match" on a column that isn't a JSON column
+        :raises FilterValueError: When the value, or an element of an "in" list or a "between" bound, doesn't match the
+                                  column type
         """
         if column in self.columns:
-            self.filters[column].append({'op': operator, 'value': value})
+            # Fail on invalid values when the filter is added rather than when the query is compiled
+            check_column_kind(self._definition, column, operator)
+            if operator == 'regex':
+                analyze_regex(value)
+            else:
+                value = coerce_filter_value(self._definition.get_coercer(column), column, operator, value)
+            self.filters[column] = (*self.filters.get(column, ()), Filter(operator, value))
 
         return self
 
+    @staticmethod
+    def get_filter_operator_and_value(filter_value):
+        """
+        Filters are either a Filter, a dict with the "op" and "value" keys or a plain value which means equality
+
+        :param filter_value: Filter entry of the filters dict
+        :return: Tuple of operator and value
+        """
+        if type(filter_value) is Filter:
+            return filter_value
+        if type(filter_value) is dict:
+            return filter_value['op'], filter_value['value']
+        return '==', filter_value
+
+    def iter_filters(self):
+        """
+        Iterate over the filters in the same order they are compiled
+
+        :return: Generator of column name, operator, and value tuples
+        """
+        for column in sorted(self.filters):
+            for filter_value in self.filters[column]:
+                operator, value = self.get_filter_operator_and_value(filter_value)
+                yield column, operator, value
+
     def add_custom_filter(self, criterion):
         """
         Add the criterion as a custom special case filter since it's built for pypika already.
@@ -298,20 +743,20 @@ class Table(object):
         :param bool concatenate_by_and: Indicates whether to concatenate via AND or OR
         :return: pypika.terms.ComplexCriterion
         """
-        table = self.get_pypika_table()
+        definition = self._definition
         final_criterion = None
 
         for column in sorted(column_filters):
-            table_column = getattr(table, column)
+            table_column = definition.get_field(column)
             for filter_value in column_filters[column]:
-                if type(filter_value) is dict:
-                    operator = filter_value['op']
-                    value = filter_value['value']
+                operator, value = self.get_filter_operator_and_value(filter_value)
+                if operator == OPERATOR_JSON_EXTRACT_SCALAR:
+                    operator, value = get_json_index_filter(value, self.has_json_index(column))
+                if operator == 'regex':
+                    criterion = self.operator_to_criterion(operator, table_column, value,
+                                                           rewrite_regex=self.can_rewrite_regex(column))
                 else:
-                    operator = '=='
-                    value = filter_value
-
-                criterion = self.operator_to_criterion(operator, table_column, value)
+                    criterion = self.operator_to_criterion(operator, table_column, value)
 
                 if criterion is None:
                     continue
@@ -0,0 +1,359 @@
+import sys
+from collections import OrderedDict
+from threading import Lock
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, Optional
+
+from sommelier.query_builder.coercion import Coercer, compile_coercer, compile_date_coercer
+from sommelier.query_builder.date_types import DateField
+from sommelier.types import ColumnTypeDict, DateTypeDict
+
+# Number of definitions kept for the queries built through the Table and MetricsTable constructors
+DEFINITION_CACHE_SIZE = 256
+
+NO_VALUES = MappingProxyType({})
+
+if TYPE_CHECKING:
+    import pypika
+    from pypika.terms import Field
+
+
+def _intern_columns(columns) -> Dict[str, Callable]:
+    return {sys.intern(column): column_type for column, column_type in columns.items()}
+
+
+class TableDefinition:
+    """
+    Everything about a Pinot table that is the same for every query on it: the name, the columns and the pypika
+    objects. It is built once and shared by reference by the query builders, see "Table.from_definition".
+
+    str table_name - The Pinot table name
+    dict columns - Read only mapping of the column names to their python type
+    frozenset column_names - Names of the columns
+    TableStatistics statistics - Optional, used to estimate the cost of the queries
+    list star_trees - Optional StarTreeIndexConfig of the table
+    dict known_values - Optional, all the values of some dimensions
+    frozenset multi_value_columns - Optional, names of the multi-value columns
+    frozenset json_columns - Optional, names of the JSON columns
+    """
+    __slots__ = (
+        'table_name',
+        'columns',
+        'column_names',
+        'statistics',
+        'star_trees',
+        'known_values',
+        'cardinalities',
+        'multi_value_columns',
+        'json_columns',
+        '_pypika_table',
+        '_fields',
+        '_coercers',
+    )
+
+    def __init__(self,
+                 table_name: str,
+                 columns: ColumnTypeDict,
+                 statistics=None,
+                 star_trees: Iterable = (),
+                 known_values: Optional[Dict[str, Iterable]] = None,
+                 multi_value_columns: Iterable[str] = (),
+                 json_columns: Iterable[str] = ()):
+        self.table_name = sys.intern(table_name)
+        self._set_columns(columns)
+        self.statistics = statistics
+        self.star_trees = tuple(star_trees)
+        self.known_values = MappingProxyType(dict(known_values)) if known_values else NO_VALUES
+        self.cardinalities = MappingProxyType(statistics.get_cardinalities()) if statistics else NO_VALUES
+        self.multi_value_columns: FrozenSet[str] = frozenset(multi_value_columns)
+        self.json_columns: FrozenSet[str] = frozenset(json_columns)
+        # Built on first use so pypika is only imported when a query is compiled
+        self._pypika_table = None
+        self._fields: Dict[str, 'Field'] = {}
+        self._coercers: Dict[str, Coercer] = {}
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.table_name!r}, columns={sorted(self.column_names)!r})'
+
+    def _set_columns(self, columns: ColumnTypeDict):
+        self.columns = MappingProxyType(_intern_columns(columns))
+        self.column_names: FrozenSet[str] = frozenset(self.columns)
+
+    def _forget_columns(self, columns: Iterable[str]):
+        # Removed columns and columns whose type changed
+        for column in columns:
+            self._fields.pop(column, None)
+            self._coercers.pop(column, None)
+
+    def update_columns(self, columns: ColumnTypeDict, changed_columns: Iterable[str] = ()):
+        """
+        Replace the columns in place so the queries sharing this definition see them
+
+        :param dict columns: New column names to their python type
+        :param changed_columns: Columns whose type changed, their cached fields and coercers are dropped
+        """
+        self._set_columns(columns)
+        self._forget_columns(changed_columns)
+        forget_cached_definition(self)
+
+    def __copy__(self):
+        # The read only mappings are shared, the caches are not so the copy can be updated in place on its own
+        duplicate = type(self).__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                setattr(duplicate, name, getattr(self, name))
+        duplicate._fields = dict(self._fields)
+        duplicate._coercers = dict(self._coercers)
+        return duplicate
+
+    def rename(self, table_name: str):
+        """
+        Replace the table name in place so the queries sharing this definition see it
+
+        :param str table_name: New Pinot table name
+        """
+        self.table_name = sys.intern(table_name)
+        # The cached fields belong to the pypika table of the old name
+        self._pypika_table = None
+        self._fields = {}
+        forget_cached_definition(self)
+
+    def __reduce__(self):
+        # Read only mappings and the pypika objects can't be pickled, rebuild the definition from its arguments
+        args, kwargs = self._get_init_arguments()
+        return _rebuild_definition, (type(self), args, kwargs)
+
+    def _get_init_arguments(self):
+        return (self.table_name, dict(self.columns)), {
+            'statistics': self.statistics,
+            'star_trees': self.star_trees,
+            'known_values': dict(self.known_values),
+            'multi_value_columns': self.multi_value_columns,
+            'json_columns': self.json_columns,
+        }
+
+    def get_pypika_table(self) -> 'pypika.Table':
+        if self._pypika_table is None:
+            import pypika
+
+            self._pypika_table = pypika.Table(self.table_name)
+        return self._pypika_table
+
+    def get_field(self, column: str) -> 'Field':
+        """
+        :param str column: Column name
+        :return: Cached pypika Field of the column
+        """
+        field = self._fields.get(column)
+        if field is None:
+            from pypika.terms import Field
+
+            field = self._fields[column] = Field(column, table=self.get_pypika_table())
+        return field
+
+    def get_coercer(self, column: str) -> Optional[Coercer]:
+        """
+        :param str column: Column name
+        :return: Cached function converting the filter values of the column to its type, None for unknown columns
+        """
+        coercer = self._coercers.get(column)
+        if coercer is None and column in self.column_names:
+            coercer = self._coercers[column] = self._compile_coercer(column)
+        return coercer
+
+    def _compile_coercer(self, column: str) -> Coercer:
+        return compile_coercer(column, self.columns[column])
+
+    def describe_column(self, column: str) -> Optional[tuple]:
+        """
+        :param str column: Column name
+        :return: Everything about the column that changes the SQL or the coercion of its values, None for unknown
+                 columns
+        """
+        if column not in self.column_names:
+            return None
+        return _get_type_name(self.columns[column]), column in self.multi_value_columns, column in self.json_columns
+
+
+class MetricsTableDefinition(TableDefinition):
+    """
+    Definition of a dimension + metrics table, see MetricsTable
+
+    dict dimensions - Read only mapping of the dimension names to their python type
+    dict metrics - Read only mapping of the metric names to their python type
+    dict datetime_columns - Read only mapping of the datetime column names to their DateField
+    frozenset metrics_and_dimensions - Names of the metrics and dimensions
+    """
+    __slots__ = (
+        'dimensions',
+        'metrics',
+        'datetime_columns',
+        'metrics_and_dimensions',
+    )
+
+    def __init__(self,
+                 table_name: str,
+                 dimension_columns: ColumnTypeDict,
+                 metrics_columns: ColumnTypeDict,
+                 datetime_columns: DateTypeDict,
+                 **kwargs):
+        super(MetricsTableDefinition, self).__init__(
+            table_name, _get_all_columns(dimension_columns, metrics_columns, datetime_columns), **kwargs)
+        self._set_roles(dimension_columns, metrics_columns, datetime_columns)
+
+    def _set_roles(self, dimension_columns: ColumnTypeDict, metrics_columns: ColumnTypeDict,
+                   datetime_columns: DateTypeDict):
+        self.dimensions = MappingProxyType(_intern_columns(dimension_columns))
+        self.metrics = MappingProxyType(_intern_columns(metrics_columns))
+        self.datetime_columns = MappingProxyType(_intern_columns(datetime_columns))
+        self.metrics_and_dimensions: FrozenSet[str] = frozenset(self.dimensions) | frozenset(self.metrics)
+
+    def update_schema(self,
+                      dimension_columns: ColumnTypeDict,
+                      metrics_columns: ColumnTypeDict,
+                      datetime_columns: DateTypeDict,
+                      multi_value_columns: Iterable[str] = (),
+                      json_columns: Iterable[str] = (),
+                      changed_columns: Iterable[str] = ()):
+        """
+        Replace the columns in place so the queries sharing this definition see the new schema. Each mapping is swapped
+        at once, the cached fields and coercers of the unchanged columns are kept.
+        See "sommelier.schema_watcher.SchemaWatcher"
+
+        :param dict dimension_columns: New dimensions
+        :param dict metrics_columns: New metrics
+        :param dict datetime_columns: New datetime columns
+        :param multi_value_columns: Names of the multi-value columns
+        :param json_columns: Names of the JSON columns
+        :param changed_columns: Columns whose type or format changed, their cached fields and coercers are dropped
+        """
+        self._set_columns(_get_all_columns(dimension_columns, metrics_columns, datetime_columns))
+        self._set_roles(dimension_columns, metrics_columns, datetime_columns)
+        self.multi_value_columns = frozenset(multi_value_columns)
+        self.json_columns = frozenset(json_columns)
+        self._forget_columns(changed_columns)
+        forget_cached_definition(self)
+
+    def _get_init_arguments(self):
+        _, kwargs = super(MetricsTableDefinition, self)._get_init_arguments()
+        return (self.table_name, dict(self.dimensions), dict(self.metrics), dict(self.datetime_columns)), kwargs
+
+    def _compile_coercer(self, column: str) -> Coercer:
+        if column in self.datetime_columns:
+            return compile_date_coercer(column, self.datetime_columns[column])
+        return super(MetricsTableDefinition, self)._compile_coercer(column)
+
+    def describe_column(self, column: str) -> Optional[tuple]:
+        description = super(MetricsTableDefinition, self).describe_column(column)
+        if column in self.datetime_columns:
+            date_field = self.datetime_columns[column]
+            return ('datetime', *description, date_field.date_format, date_field.granularity)
+        if description is not None:
+            return ('dimension' if column in self.dimensions else 'metric', *description)
+        return None
+
+    @classmethod
+    def from_schema(cls,
+                    table_name: str,
+                    schema_configuration,
+                    table_configuration=None,
+                    statistics_configuration=None,
+                    known_values: Optional[Dict[str, Iterable]] = None) -> 'MetricsTableDefinition':
+        """
+        Build the definition from the Pinot schema, and optionally the table configuration and statistics
+
+        :param str table_name: The Pinot table name
+        :param schema_configuration: Schema JSON but a dict
+        :param table_configuration: Table configuration JSON but a dict, used for the indexes and star-trees
+        :param statistics_configuration: See "sommelier.schema_parser.get_table_statistics"
+        :param dict known_values: All the values of some dimensions
+        :return: MetricsTableDefinition instance
+        """
+        from sommelier.schema_parser import (get_json_columns, get_multi_value_columns, get_star_tree_index_configs,
+                                             get_table_information_from_schema, get_table_statistics)
+
+        dimensions, metrics, time_columns = get_table_information_from_schema(schema_configuration)
+        statistics = None
+        star_trees = ()
+        if table_configuration is not None or statistics_configuration is not None:
+            statistics = get_table_statistics(statistics_configuration, table_configuration)
+        if table_configuration is not None:
+            star_trees = get_star_tree_index_configs(table_configuration)
+
+        return cls(table_name, dimensions, metrics, time_columns,
+                   statistics=statistics, star_trees=star_trees, known_values=known_values,
+                   multi_value_columns=get_multi_value_columns(schema_configuration),
+                   json_columns=get_json_columns(schema_configuration))
+
+
+def _get_all_columns(dimension_columns: ColumnTypeDict, metrics_columns: ColumnTypeDict,
+                     datetime_columns: DateTypeDict) -> ColumnTypeDict:
+    converted_date_columns: ColumnTypeDict = {}
+
+    for datetime_column_name, column_info in datetime_columns.items():
+        converted_date_columns[datetime_column_name] = column_info.data_type
+
+    return dict(
+        **dimension_columns,
+        **metrics_columns,
+        **converted_date_columns
+    )
+
+
+def _get_type_name(column_type) -> str:
+    return getattr(column_type, '__name__', repr(column_type))
+
+
+def _rebuild_definition(cls, args, kwargs):
+    return cls(*args, **kwargs)
+
+
+_definitions: 'OrderedDict[tuple, TableDefinition]' = OrderedDict()
+_definitions_lock = Lock()
+
+
+def _snapshot_columns(column_dict) -> FrozenSet[tuple]:
+    # Hashable copy of the contents of a column dict, DateField instances are compared by value
+    return frozenset(
+        (column, (value.name, value.data_type, value.date_format, value.granularity))
+        if isinstance(value, DateField) else (column, value)
+        for column, value in column_dict.items()
+    )
+
+
+def get_cached_definition(table_name: str, column_dicts: tuple, factory: Callable[[], TableDefinition]):
+    """
+    Definitions for the queries built through the constructors. Queries built from the same table name and column dicts
+    contents share one definition, a dict modified since gets a new definition.
+
+    :param str table_name: The Pinot table name
+    :param tuple column_dicts: The dicts the definition is built from
+    :param callable factory: Builds the definition when it is not cached
+    :return: TableDefinition instance
+    """
+    key = (table_name, *(_snapshot_columns(column_dict) for column_dict in column_dicts))
+    with _definitions_lock:
+        definition = _definitions.get(key)
+        if definition is not None:
+            _definitions.move_to_end(key)
+            return definition
+
+    definition = factory()
+    with _definitions_lock:
+        _definitions[key] = definition
+        if len(_definitions) > DEFINITION_CACHE_SIZE:
+            _definitions.popitem(last=False)
+
+    return definition
+
+
+def forget_cached_definition(definition: TableDefinition):
+    """
+    Drop the definition from the constructors' cache. It is called when the definition is updated in place, since it no
+    longer matches the column dicts it is cached for and the constructors must build a new one from them
+
+    :param TableDefinition definition: Updated definition
+    """
+    with _definitions_lock:
+        for key in [key for key, cached in _definitions.items() if cached is definition]:
+            del _definitions[key]
@@ -0,0 +1,324 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+from typing import Callable, Dict, Optional
+
+from sommelier.broker import TRUNCATION_RAISE, BrokerResponse, execute_query
+from sommelier.execution_stats import ExecutionStatsRecorder
+from sommelier.query_builder.cost import get_downgraded_query
+from sommelier.query_builder.instrumentation import PHASE_QUEUE_WAIT
+from sommelier.types import QueryExecutor
+
+# Lower values are dispatched first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# What to do with a query that can't meet its deadline
+ON_DEADLINE_DROP = 'drop'
+ON_DEADLINE_DOWNGRADE = 'downgrade'
+
+DEFAULT_TENANT = 'default'
+DEFAULT_WORKERS = 4
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised when a query is dropped because it can't be executed before its deadline
+    """
+
+    def __init__(self, sql: str, queue_wait_seconds: float, reason: str):
+        self.sql = sql
+        self.queue_wait_seconds = queue_wait_seconds
+        super(DeadlineExceededError, self).__init__(f'Query dropped after waiting {queue_wait_seconds:.3f}s '
+                                                    f'({reason}): "{sql}"')
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, i.e. the QPS quota of a broker or a tenant. Thread safe.
+
+    float rate - Tokens added per second
+    float burst - Maximum number of tokens, defaults to the rate
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available
+
+        :return: 0 when a token was taken, otherwise the seconds until one is available
+        """
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class ScheduledResult:
+    """
+    Result of a scheduled query
+
+    BrokerResponse response - Response of the executed query
+    float queue_wait_seconds - Time between the submission and the start of the execution
+    float execution_seconds - Time spent executing, including the group by retries
+    bool downgraded - Whether a downgraded copy of the query was executed to meet the deadline
+    """
+
+    def __init__(self, response: BrokerResponse, queue_wait_seconds: float, execution_seconds: float,
+                 downgraded: bool = False):
+        self.response = response
+        self.queue_wait_seconds = queue_wait_seconds
+        self.execution_seconds = execution_seconds
+        self.downgraded = downgraded
+
+    def __repr__(self):
+        return (f'ScheduledResult(rows={len(self.response)}, queue_wait_seconds={self.queue_wait_seconds:.4f}, '
+                f'execution_seconds={self.execution_seconds:.4f}, downgraded={self.downgraded})')
+
+
+class _Entry:
+    __slots__ = ('priority', 'deadline', 'sequence', 'query', 'tenant', 'on_deadline', 'submitted', 'future')
+
+    def __init__(self, priority, deadline, sequence, query, tenant, on_deadline, submitted, future):
+        self.priority = priority
+        self.deadline = deadline
+        self.sequence = sequence
+        self.query = query
+        self.tenant = tenant
+        self.on_deadline = on_deadline
+        self.submitted = submitted
+        self.future = future
+
+    def __lt__(self, other):
+        # Highest priority first, then earliest deadline, then first submitted
+        return ((self.priority, self.deadline is None, self.deadline or 0, self.sequence) <
+                (other.priority, other.deadline is None, other.deadline or 0, other.sequence))
+
+
+class QueryScheduler:
+    """
+    Execute queries by priority class while staying within the QPS quotas of the brokers or tenants.
+
+    Queries wait in a priority queue ordered by priority, then deadline. A query is dispatched when a worker is free
+    and its tenant's token bucket has a token, so interactive queries skip ahead of queued batch work and a tenant over
+    its quota doesn't block the other tenants. A query whose deadline passed while queued, or that is expected to miss
+    it based on the p50 latency of its fingerprint in the recorder, is dropped with a DeadlineExceededError or
+    downgraded (approximate aggregations, coarser time buckets) when "on_deadline" is "downgrade".
+
+    Example:
+
+    scheduler = QueryScheduler(executor, rate_limits={'dashboards': TokenBucket(50), 'reports': TokenBucket(5)})
+    future = scheduler.submit(query, tenant='dashboards', timeout=2.0)
+    future.result().response.rows, future.result().queue_wait_seconds
+
+    QueryExecutor executor - Callable that sends the SQL to the broker and returns the decoded JSON response
+    dict rate_limits - Token bucket per tenant. Tenants without a bucket are not rate limited
+    int workers - Maximum number of queries executing at once
+    ExecutionStatsRecorder recorder - Records the executions, its latencies are used to predict missed deadlines
+    str on_truncation - See "sommelier.broker.execute_query"
+    """
+
+    def __init__(self,
+                 executor: QueryExecutor,
+                 rate_limits: Optional[Dict[str, TokenBucket]] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 recorder: Optional[ExecutionStatsRecorder] = None,
+                 on_truncation: str = TRUNCATION_RAISE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.executor = executor
+        self.rate_limits = rate_limits or {}
+        self.workers = workers
+        self.recorder = recorder
+        self.on_truncation = on_truncation
+        self._clock = clock
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._closed = False
+        self._condition = Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._dispatcher = Thread(target=self._dispatch_loop, name='sommelier-query-scheduler', daemon=True)
+        self._dispatcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self,
+               query,
+               priority: int = PRIORITY_INTERACTIVE,
+               tenant: str = DEFAULT_TENANT,
+               timeout: Optional[float] = None,
+               on_deadline: str = ON_DEADLINE_DROP) -> 'Future[ScheduledResult]':
+        """
+        Queue the query for execution
+
+        :param query: Query builder instance
+        :param int priority: PRIORITY_INTERACTIVE, PRIORITY_BATCH or any int, lower values are dispatched first
+        :param str tenant: Name of the token bucket in "rate_limits"
+        :param float timeout: Seconds from now the query must be executed by, None for no deadline
+        :param str on_deadline: "drop" or "downgrade"
+        :return: Future of a ScheduledResult
+        """
+        if on_deadline not in (ON_DEADLINE_DROP, ON_DEADLINE_DOWNGRADE):
+            raise ValueError(f'Unknown on_deadline "{on_deadline}"')
+
+        future = Future()
+        now = self._clock()
+        deadline = now + timeout if timeout is not None else None
+        entry = _Entry(priority, deadline, next(self._sequence), query, tenant, on_deadline, now, future)
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The scheduler is shut down')
+            heapq.heappush(self._queue, entry)
+            self._condition.notify()
+        return future
+
+    def queued(self) -> int:
+        with self._condition:
+            return len(self._queue)
+
+    def shutdown(self, wait: bool = True, cancel_queued: bool = False):
+        """
+        Stop accepting queries. The queued queries are still executed unless "cancel_queued" is set
+
+        :param bool wait: Wait for the queued and running queries to finish
+        :param bool cancel_queued: Cancel the queries that are still queued
+        """
+        with self._condition:
+            self._closed = True
+            if cancel_queued:
+                for entry in self._queue:
+                    entry.future.cancel()
+                self._queue = []
+            self._condition.notify_all()
+
+        if wait:
+            self._dispatcher.join()
+        self._pool.shutdown(wait=wait)
+
+    def _get_expected_seconds(self, query) -> Optional[float]:
+        if self.recorder is None:
+            return None
+        summary = self.recorder.summary(query.get_fingerprint())
+        return summary.p50_ms / 1000 if summary else None
+
+    def _check_deadline(self, entry: _Entry, now: float):
+        """
+        :return: The query to execute and whether it is downgraded, or None when the query is dropped
+        """
+        query = entry.query
+        if entry.deadline is None:
+            return query, False
+
+        if now >= entry.deadline:
+            entry.future.set_exception(
+                DeadlineExceededError(query.get_sql_query(), now - entry.submitted, 'deadline passed while queued'))
+            return None
+
+        expected = self._get_expected_seconds(query)
+        if expected is None or now + expected <= entry.deadline:
+            return query, False
+
+        if entry.on_deadline == ON_DEADLINE_DOWNGRADE:
+            downgraded = get_downgraded_query(query)
+            if downgraded is not None:
+                return downgraded, True
+
+        entry.future.set_exception(DeadlineExceededError(query.get_sql_query(), now - entry.submitted,
+                                                         f'expected to take {expected:.3f}s'))
+        return None
+
+    def _next_entry(self, now: float):
+        """
+        Pop the first queued entry whose tenant has a token. Entries whose tenant is over its quota stay queued
+
+        :return: Tuple of the entry, or None, and the seconds until a token is available for a skipped entry
+        """
+        skipped = []
+        retry_in = None
+        entry = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if candidate.future.cancelled():
+                continue
+            if candidate.deadline is not None and now >= candidate.deadline:
+                self._check_deadline(candidate, now)
+                continue
+
+            bucket = self.rate_limits.get(candidate.tenant)
+            wait = bucket.try_acquire() if bucket is not None else 0.0
+            if wait == 0.0:
+                entry = candidate
+                break
+
+            skipped.append(candidate)
+            retry_in = wait if retry_in is None else min(retry_in, wait)
+
+        for candidate in skipped:
+            heapq.heappush(self._queue, candidate)
+        return entry, retry_in
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while not self._queue or self._running >= self.workers:
+                    if self._closed and not self._queue:
+                        return
+                    self._condition.wait()
+
+                now = self._clock()
+                entry, retry_in = self._next_entry(now)
+                if entry is None:
+                    if retry_in is not None:
+                        self._condition.wait(retry_in)
+                    continue
+
+                if not entry.future.set_running_or_notify_cancel():
+                    continue
+                checked = self._check_deadline(entry, now)
+                if checked is None:
+                    continue
+                self._running += 1
+
+            query, downgraded = checked
+            self._pool.submit(self._execute, entry, query, downgraded, now - entry.submitted)
+
+    def _execute(self, entry: _Entry, query, downgraded: bool, queue_wait_seconds: float):
+        tracer = query.get_tracer()
+        if tracer is not None:
+            tracer.record_phase(PHASE_QUEUE_WAIT, queue_wait_seconds)
+
+        start = time.perf_counter()
+        try:
+            response = execute_query(query, self.executor, self.on_truncation, self.recorder)
+        except BaseException as error:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(ScheduledResult(response, queue_wait_seconds, time.perf_counter() - start,
+                                                    downgraded))
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify()
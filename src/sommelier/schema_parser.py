@@ -1,4 +1,10 @@
+from collections import defaultdict
+from typing import List, Set
+
+from sommelier.query_builder.cost import (INDEX_BLOOM, INDEX_INVERTED, INDEX_JSON, INDEX_RANGE, INDEX_SORTED,
+                                          INDEX_TEXT, ColumnStatistics, TableStatistics)
 from sommelier.query_builder.date_types import DateField
+from sommelier.query_builder.star_tree import StarTreeIndexConfig
 from sommelier.types import ColumnTypeDict, DateTypeDict
 
 pinot_type_to_python_type = {
@@ -14,6 +20,15 @@ pinot_type_to_python_type = {
     'BYTES': bytes,
 }
 
+# "tableIndexConfig" keys of the table configuration and the index they create
+TABLE_INDEX_CONFIG_KEYS = {
+    'sortedColumn': INDEX_SORTED,
+    'invertedIndexColumns': INDEX_INVERTED,
+    'rangeIndexColumns': INDEX_RANGE,
+    'bloomFilterColumns': INDEX_BLOOM,
+    'jsonIndexColumns': INDEX_JSON,
+}
+
 
 def get_table_information_from_schema(schema_configuration):
     """
@@ -44,3 +59,96 @@ def get_table_information_from_schema(schema_configuration):
             )
 
     return dimensions, metrics, time_columns
+
+
+def _iter_field_specs(schema_configuration):
+    for specs_key in ('dimensionFieldSpecs', 'metricFieldSpecs', 'dateTimeFieldSpecs'):
+        yield from schema_configuration.get(specs_key) or []
+
+
+def get_multi_value_columns(schema_configuration) -> Set[str]:
+    """
+    Columns whose field spec has "singleValueField": false. Filters on them match rows with any of their values
+
+    :param schema_configuration: Configuration JSON but a dict
+    :return: Set of column names
+    """
+    return {field_spec['name'] for field_spec in _iter_field_specs(schema_configuration)
+            if field_spec.get('singleValueField', True) is False}
+
+
+def get_json_columns(schema_configuration) -> Set[str]:
+    """
+    Columns of the JSON data type, they are strings for the query builders but can be filtered with JSON_MATCH and
+    JSON_EXTRACT_SCALAR
+
+    :param schema_configuration: Configuration JSON but a dict
+    :return: Set of column names
+    """
+    return {field_spec['name'] for field_spec in _iter_field_specs(schema_configuration)
+            if field_spec.get('dataType') == 'JSON'}
+
+
+def get_table_statistics(statistics_configuration=None, table_configuration=None) -> TableStatistics:
+    """
+    Build the statistics used to estimate the cost of queries. Pinot schemas don't carry statistics so they are
+    expected to be loaded alongside the schema, usually from the segment metadata, in the following format:
+
+    {
+        'totalDocs': 1200000000,
+        'rowsPerDay': 4000000,
+        'columns': {
+            'airport': {'cardinality': 300, 'indexes': ['inverted']},
+            'price': {'cardinality': 25000}
+        }
+    }
+
+    The indexes are also read from the "tableIndexConfig" and "fieldConfigList" of the table configuration when it
+    is provided.
+    See reference at https://docs.pinot.apache.org/configuration-reference/table#table-index-config
+
+    :param statistics_configuration: Statistics as described above
+    :param table_configuration: Pinot table configuration JSON but a dict
+    :return: TableStatistics instance
+    """
+    statistics_configuration = statistics_configuration or {}
+    cardinalities = {}
+    indexes = defaultdict(set)
+
+    for column_name, column_config in statistics_configuration.get('columns', {}).items():
+        cardinalities[column_name] = column_config.get('cardinality')
+        indexes[column_name].update(column_config.get('indexes', []))
+
+    table_configuration = table_configuration or {}
+    index_config = table_configuration.get('tableIndexConfig', {})
+    for config_key, index_type in TABLE_INDEX_CONFIG_KEYS.items():
+        for column_name in index_config.get(config_key) or []:
+            indexes[column_name].add(index_type)
+
+    for field_config in table_configuration.get('fieldConfigList') or []:
+        field_index_types = field_config.get('indexTypes') or [field_config.get('indexType')]
+        if 'TEXT' in field_index_types:
+            indexes[field_config['name']].add(INDEX_TEXT)
+        if 'JSON' in field_index_types:
+            indexes[field_config['name']].add(INDEX_JSON)
+
+    columns = {
+        column_name: ColumnStatistics(column_name, cardinality=cardinalities.get(column_name),
+                                      indexes=indexes.get(column_name, ()))
+        for column_name in set(cardinalities) | set(indexes)
+    }
+
+    return TableStatistics(columns=columns,
+                           total_docs=statistics_configuration.get('totalDocs'),
+                           rows_per_day=statistics_configuration.get('rowsPerDay'))
+
+
+def get_star_tree_index_configs(table_configuration) -> List[StarTreeIndexConfig]:
+    """
+    See reference at https://docs.pinot.apache.org/basics/indexing/star-tree-index#index-generation-configuration
+
+    :param table_configuration: Pinot table configuration JSON but a dict
+    :return: List of StarTreeIndexConfig in the order of the "starTreeIndexConfigs"
+    """
+    index_config = table_configuration.get('tableIndexConfig', {})
+    return [StarTreeIndexConfig.from_config(config) for config in index_config.get('starTreeIndexConfigs') or []]
@@ -0,0 +1,187 @@
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from sommelier.query_builder.query_cache import ColumnDependentCache
+from sommelier.query_builder.table_definition import MetricsTableDefinition
+from sommelier.schema_parser import get_json_columns, get_multi_value_columns, get_table_information_from_schema
+
+DEFAULT_POLL_SECONDS = 60.0
+
+# Column roles of a metrics table
+ROLE_DIMENSION = 'dimension'
+ROLE_METRIC = 'metric'
+ROLE_DATETIME = 'datetime'
+
+
+def _describe_columns(dimensions, metrics, datetime_columns, multi_value_columns, json_columns) -> Dict[str, tuple]:
+    # Everything about a column that changes the SQL or the coercion of its values
+    described = {}
+    for name, column_type in dimensions.items():
+        described[name] = (ROLE_DIMENSION, column_type)
+    for name, column_type in metrics.items():
+        described[name] = (ROLE_METRIC, column_type)
+    for name, date_field in datetime_columns.items():
+        described[name] = (ROLE_DATETIME, date_field.data_type, date_field.date_format, date_field.granularity)
+    return {name: (*description, name in multi_value_columns, name in json_columns)
+            for name, description in described.items()}
+
+
+class SchemaDiff:
+    """
+    Columns that differ between two versions of a schema
+
+    frozenset added - New columns
+    frozenset removed - Dropped columns
+    frozenset changed - Columns whose role, type, format, granularity, multi-value or JSON flag changed
+    """
+
+    def __init__(self, added: Iterable[str] = (), removed: Iterable[str] = (), changed: Iterable[str] = ()):
+        self.added: FrozenSet[str] = frozenset(added)
+        self.removed: FrozenSet[str] = frozenset(removed)
+        self.changed: FrozenSet[str] = frozenset(changed)
+
+    def __repr__(self):
+        return (f'SchemaDiff(added={sorted(self.added)}, removed={sorted(self.removed)}, '
+                f'changed={sorted(self.changed)})')
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    @property
+    def affected(self) -> FrozenSet[str]:
+        """
+        :return: Columns whose cached queries, templates and results are no longer valid
+        """
+        return self.removed | self.changed
+
+
+def diff_schema(definition: MetricsTableDefinition, schema_configuration) -> SchemaDiff:
+    """
+    :param MetricsTableDefinition definition: The loaded definition
+    :param schema_configuration: New schema JSON but a dict
+    :return: SchemaDiff instance
+    """
+    dimensions, metrics, datetime_columns = get_table_information_from_schema(schema_configuration)
+    new = _describe_columns(dimensions, metrics, datetime_columns, get_multi_value_columns(schema_configuration),
+                            get_json_columns(schema_configuration))
+    old = _describe_columns(definition.dimensions, definition.metrics, definition.datetime_columns,
+                            definition.multi_value_columns, definition.json_columns)
+    return SchemaDiff(added=new.keys() - old.keys(), removed=old.keys() - new.keys(),
+                      changed=[name for name in new.keys() & old.keys() if new[name] != old[name]])
+
+
+def apply_schema(definition: MetricsTableDefinition,
+                 schema_configuration,
+                 caches: Iterable[ColumnDependentCache] = ()) -> SchemaDiff:
+    """
+    Update the definition in place to the new schema and evict the cache entries depending on the changed or removed
+    columns. Nothing is touched when the schema is the same
+
+    :param MetricsTableDefinition definition: The loaded definition, shared by its queries
+    :param schema_configuration: New schema JSON but a dict
+    :param caches: ColumnDependentCache instances holding compiled queries, templates or results of the table
+    :return: SchemaDiff instance
+    """
+    diff = diff_schema(definition, schema_configuration)
+    if not diff:
+        return diff
+
+    dimensions, metrics, datetime_columns = get_table_information_from_schema(schema_configuration)
+    definition.update_schema(dimensions, metrics, datetime_columns,
+                             multi_value_columns=get_multi_value_columns(schema_configuration),
+                             json_columns=get_json_columns(schema_configuration),
+                             changed_columns=diff.affected)
+    for cache in caches:
+        cache.invalidate_columns(diff.affected, columns_added=bool(diff.added))
+    return diff
+
+
+class SchemaWatcher:
+    """
+    Keep a table definition in sync with its Pinot schema while the application runs. The schema is reloaded on
+    "refresh", or every "poll_seconds" once started, and applied with "apply_schema": queries sharing the definition
+    see the new columns and only the cache entries referencing changed or removed columns are evicted.
+
+    Example:
+
+    watcher = SchemaWatcher(definition, lambda: controller.get_schema('flights'), caches=[sql_cache, result_cache])
+    watcher.start()
+
+    MetricsTableDefinition definition - The watched definition
+    callable load_schema - Returns the current schema JSON but a dict
+    list caches - ColumnDependentCache instances to invalidate
+    list listeners - Called with every non empty SchemaDiff, i.e. to clear other caches
+    """
+
+    def __init__(self,
+                 definition: MetricsTableDefinition,
+                 load_schema: Callable[[], Dict[str, Any]],
+                 caches: Iterable[ColumnDependentCache] = (),
+                 poll_seconds: float = DEFAULT_POLL_SECONDS,
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        self.definition = definition
+        self.load_schema = load_schema
+        self.caches: List[ColumnDependentCache] = list(caches)
+        self.listeners: List[Callable[[SchemaDiff], None]] = []
+        self.poll_seconds = poll_seconds
+        self.on_error = on_error
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def add_cache(self, cache: ColumnDependentCache):
+        self.caches.append(cache)
+        return self
+
+    def add_listener(self, listener: Callable[[SchemaDiff], None]):
+        self.listeners.append(listener)
+        return self
+
+    def refresh(self, schema_configuration: Optional[Dict[str, Any]] = None) -> SchemaDiff:
+        """
+        Apply the schema, loaded with "load_schema" unless it is given
+
+        :return: SchemaDiff instance, empty when the schema didn't change
+        """
+        if schema_configuration is None:
+            schema_configuration = self.load_schema()
+
+        with self._lock:
+            diff = apply_schema(self.definition, schema_configuration, self.caches)
+        if diff:
+            for listener in self.listeners:
+                listener(diff)
+        return diff
+
+    def start(self):
+        """
+        Refresh every "poll_seconds" in a daemon thread until "stop" is called. Errors are passed to "on_error" and
+        the next refresh is attempted
+        """
+        if self._thread is not None:
+            raise RuntimeError('The schema watcher is already started')
+        self._stopped.clear()
+        self._thread = Thread(target=self._poll, name=f'sommelier-schema-watcher-{self.definition.table_name}',
+                              daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception as error:
+                if self.on_error is not None:
+                    self.on_error(error)
@@ -0,0 +1,483 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from sommelier.broker import BrokerResponse
+from sommelier.schema_parser import pinot_type_to_python_type
+from sommelier.types import ColumnTypeDict
+
+# array typecodes of the fixed width columns, the other types are dictionary encoded
+FIXED_WIDTH_TYPECODES = {
+    int: 'q',
+    float: 'd',
+    bool: 'b',
+}
+DICTIONARY_CODE_TYPECODE = 'I'
+# End offsets of the values of the raw columns in their data file
+RAW_OFFSET_TYPECODE = 'Q'
+
+# Rows buffered per column before they are appended to the column files
+DEFAULT_BUFFER_ROWS = 65536
+# Distinct values kept in memory per dictionary encoded column, columns with more values are stored raw
+DEFAULT_MAX_DICTIONARY_SIZE = 65536
+
+COLUMN_FILE_SUFFIX = '.col'
+NULLS_FILE_SUFFIX = '.nulls'
+DATA_FILE_SUFFIX = '.data'
+
+# Pinot data types returned as strings whatever the type of the table column. BIG_DECIMAL keeps its precision
+STRING_PINOT_TYPES = frozenset(('BIG_DECIMAL',))
+
+
+def get_spill_type(column_name: str, pinot_type: Optional[str], column_types: ColumnTypeDict):
+    """
+    Python type of a result column: the type of the table column, otherwise the type of the Pinot data type of the
+    result, i.e. for aggregations. BIG_DECIMAL values are stored as strings
+
+    :param str column_name: Result column name
+    :param str pinot_type: Pinot data type from the response's data schema
+    :param dict column_types: Types of the table's columns
+    :return: Python type
+    """
+    if pinot_type in STRING_PINOT_TYPES:
+        return str
+    if column_name in column_types:
+        return column_types[column_name]
+    return pinot_type_to_python_type.get(pinot_type, str)
+
+
+def _encode_raw(value) -> bytes:
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def _decode_raw(data) -> Any:
+    value = json.loads(bytes(data))
+    # Multi value columns, like in the dictionary encoded columns
+    return tuple(value) if type(value) is list else value
+
+
+def _is_null(null_bits, index: int) -> bool:
+    return bool(null_bits[index >> 3] & (1 << (index & 7)))
+
+
+class DictionaryColumn:
+    """
+    Read only view of a dictionary encoded column. The codes are a memoryview over the spill file
+
+    memoryview codes - Dictionary code of every row
+    list dictionary - Distinct values, indexed by code
+    """
+
+    def __init__(self, codes: memoryview, dictionary: List[Any]):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index: int):
+        return self.dictionary[self.codes[index]]
+
+    def __iter__(self):
+        dictionary = self.dictionary
+        return (dictionary[code] for code in self.codes)
+
+
+class RawColumn:
+    """
+    Read only view of a column with too many distinct values to be dictionary encoded. The values are JSON encoded
+    one after the other in the data file
+
+    memoryview offsets - End offset of every value in the data
+    data - Memory mapped values
+    """
+
+    def __init__(self, offsets: memoryview, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self.offsets)
+        start = self.offsets[index - 1] if index else 0
+        return _decode_raw(self.data[start:self.offsets[index]])
+
+    def __iter__(self):
+        start = 0
+        data = self.data
+        for end in self.offsets:
+            yield _decode_raw(data[start:end])
+            start = end
+
+
+class NullableColumn:
+    """
+    Read only view of a fixed width column with nulls, the rows whose bit is set in the null bitmap are None
+
+    values - Column view, the nulls are stored as 0
+    null_bits - Memory mapped bitmap, bit "index % 8" of byte "index // 8" is set for the null rows
+    """
+
+    def __init__(self, values, null_bits):
+        self.values = values
+        self.null_bits = null_bits
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self.values)
+        return None if _is_null(self.null_bits, index) else self.values[index]
+
+    def __iter__(self):
+        null_bits = self.null_bits
+        return (None if _is_null(null_bits, index) else value for index, value in enumerate(self.values))
+
+
+class _ColumnFile:
+    def __init__(self, path: str, column_type, max_dictionary_size: int = DEFAULT_MAX_DICTIONARY_SIZE):
+        self.path = path
+        self.typecode = FIXED_WIDTH_TYPECODES.get(column_type)
+        self.is_dictionary = self.typecode is None
+        self.is_raw = False
+        self.max_dictionary_size = max_dictionary_size
+        self.buffer = array(self.typecode or DICTIONARY_CODE_TYPECODE)
+        self.dictionary: List[Any] = []
+        self.codes: Dict[Any, int] = {}
+        self.file = open(path, 'wb')
+        self.row_count = 0
+        # Null bitmap of the fixed width columns, the dictionary and raw columns store None as a value
+        self.null_count = 0
+        self.null_bits = bytearray()
+        self.null_base_row = 0
+        self.nulls_file = None
+        # Data file of the raw columns
+        self.data_buffer = bytearray()
+        self.data_size = 0
+        self.data_file = None
+
+    @property
+    def file_typecode(self) -> str:
+        if self.is_raw:
+            return RAW_OFFSET_TYPECODE
+        return self.typecode or DICTIONARY_CODE_TYPECODE
+
+    @property
+    def nulls_path(self) -> str:
+        return self.path + NULLS_FILE_SUFFIX
+
+    @property
+    def data_path(self) -> str:
+        return self.path + DATA_FILE_SUFFIX
+
+    def append(self, value):
+        if self.is_dictionary:
+            if type(value) is list:
+                # Multi value columns
+                value = tuple(value)
+            if self.is_raw:
+                self._append_raw(value)
+            else:
+                code = self.codes.get(value)
+                if code is None:
+                    if len(self.dictionary) >= self.max_dictionary_size:
+                        self._switch_to_raw()
+                        self._append_raw(value)
+                        self.row_count += 1
+                        return
+                    code = self.codes[value] = len(self.dictionary)
+                    self.dictionary.append(value)
+                self.buffer.append(code)
+        elif value is None:
+            self._set_null(self.row_count)
+            self.buffer.append(0)
+        else:
+            self.buffer.append(value)
+        self.row_count += 1
+
+    def _set_null(self, row: int):
+        if self.nulls_file is None:
+            # The rows before the first null are written as not null at once
+            self.nulls_file = open(self.nulls_path, 'wb')
+            self.null_base_row = row - row % 8
+            self.nulls_file.write(bytes(self.null_base_row // 8))
+        offset = row - self.null_base_row
+        missing = offset // 8 + 1 - len(self.null_bits)
+        if missing > 0:
+            self.null_bits.extend(bytes(missing))
+        self.null_bits[offset // 8] |= 1 << (offset % 8)
+        self.null_count += 1
+
+    def _flush_nulls(self, final: bool = False):
+        if self.nulls_file is None:
+            return
+        # Only the complete bytes are written until the end, the last one may still get bits
+        byte_count = (self.row_count - self.null_base_row + (7 if final else 0)) // 8
+        if byte_count > len(self.null_bits):
+            self.null_bits.extend(bytes(byte_count - len(self.null_bits)))
+        self.nulls_file.write(self.null_bits[:byte_count])
+        del self.null_bits[:byte_count]
+        self.null_base_row += byte_count * 8
+
+    def _append_raw(self, value):
+        encoded = _encode_raw(value)
+        self.data_buffer += encoded
+        self.data_size += len(encoded)
+        self.buffer.append(self.data_size)
+
+    def _switch_to_raw(self):
+        """
+        Too many distinct values: rewrite the codes already written as raw values and drop the dictionary
+        """
+        self.flush()
+        self.file.close()
+        codes_path = self.path + '.codes'
+        os.replace(self.path, codes_path)
+
+        dictionary = self.dictionary
+        self.is_raw = True
+        self.buffer = array(RAW_OFFSET_TYPECODE)
+        self.file = open(self.path, 'wb')
+        self.data_file = open(self.data_path, 'wb')
+        codes = array(DICTIONARY_CODE_TYPECODE)
+        chunk_bytes = DEFAULT_BUFFER_ROWS * codes.itemsize
+        with open(codes_path, 'rb') as codes_file:
+            chunk = codes_file.read(chunk_bytes)
+            while chunk:
+                codes.frombytes(chunk)
+                for code in codes:
+                    self._append_raw(dictionary[code])
+                del codes[:]
+                self.flush()
+                chunk = codes_file.read(chunk_bytes)
+        os.remove(codes_path)
+        self.dictionary = []
+        self.codes = {}
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.tofile(self.file)
+            del self.buffer[:]
+        if self.data_buffer:
+            self.data_file.write(self.data_buffer)
+            self.data_buffer = bytearray()
+        self._flush_nulls()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self._flush_nulls(final=True)
+        self.file.close()
+        for file in (self.nulls_file, self.data_file):
+            if file is not None:
+                file.close()
+        self.codes = {}
+
+
+class SpilledResult:
+    """
+    Result rows spilled to memory mapped column files. Columns are zero-copy views over the files so only the pages
+    being read are resident. The dictionaries of the string columns are kept in memory, they are capped by
+    "max_dictionary_size" and the columns with more distinct values are stored raw.
+
+    list column_names - Result column names
+    """
+
+    def __init__(self, directory: str, column_names: List[str], column_files: List[_ColumnFile], row_count: int,
+                 owns_directory: bool):
+        self.directory = directory
+        self.column_names = column_names
+        self._column_files = column_files
+        self._row_count = row_count
+        self._owns_directory = owns_directory
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._views: List[memoryview] = []
+
+    def __len__(self):
+        return self._row_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _map(self, path: str) -> mmap.mmap:
+        memory_map = self._maps.get(path)
+        if memory_map is None:
+            with open(path, 'rb') as file:
+                memory_map = self._maps[path] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memory_map
+
+    def _get_codes(self, index: int) -> memoryview:
+        column_file = self._column_files[index]
+        typecode = column_file.file_typecode
+        if not self._row_count:
+            return memoryview(array(typecode))
+
+        view = memoryview(self._map(column_file.path)).cast(typecode)
+        self._views.append(view)
+        return view
+
+    def column(self, column: Union[str, int]) -> Union[memoryview, DictionaryColumn, RawColumn, NullableColumn]:
+        """
+        :param column: Column name or index
+        :return: memoryview of the values for fixed width columns, NullableColumn when they have nulls,
+                 DictionaryColumn or RawColumn for the others
+        """
+        index = column if isinstance(column, int) else self.column_names.index(column)
+        codes = self._get_codes(index)
+        column_file = self._column_files[index]
+        if column_file.is_raw:
+            return RawColumn(codes, self._map(column_file.data_path))
+        if column_file.is_dictionary:
+            return DictionaryColumn(codes, column_file.dictionary)
+
+        values = DictionaryColumn(codes, [False, True]) if column_file.typecode == 'b' else codes
+        if column_file.null_count:
+            return NullableColumn(values, self._map(column_file.nulls_path))
+        return values
+
+    def iter_rows(self) -> Iterator[tuple]:
+        """
+        :return: Generator of the rows as tuples
+        """
+        return zip(*(self.column(index) for index in range(len(self.column_names))))
+
+    def close(self):
+        """
+        Release the memory maps and delete the files when they are in a temporary directory. Column views can't be
+        used after closing
+        """
+        for view in self._views:
+            view.release()
+        self._views = []
+        for memory_map in self._maps.values():
+            memory_map.close()
+        self._maps = {}
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ColumnarSpillWriter:
+    """
+    Append rows to one file per column: fixed width numeric columns with a null bitmap and dictionary encoded string
+    columns. Only "buffer_rows" rows per column and at most "max_dictionary_size" distinct values per dictionary are
+    held in memory, the columns with more distinct values switch to raw values in a data file.
+
+    list column_names - Result column names
+    list column_types - Python type of every column, see "get_spill_type"
+    str directory - Directory of the column files, a temporary directory deleted on close by default
+    int buffer_rows - Rows buffered before being written
+    int max_dictionary_size - Distinct values of a dictionary encoded column kept in memory
+    """
+
+    def __init__(self,
+                 column_names: Sequence[str],
+                 column_types: Sequence[Any],
+                 directory: Optional[str] = None,
+                 buffer_rows: int = DEFAULT_BUFFER_ROWS,
+                 max_dictionary_size: int = DEFAULT_MAX_DICTIONARY_SIZE):
+        if len(column_names) != len(column_types):
+            raise ValueError('There must be one type per column')
+
+        self.owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='sommelier-spill-')
+        self.column_names = list(column_names)
+        self.buffer_rows = buffer_rows
+        self._column_files = [_ColumnFile(os.path.join(self.directory, f'{index}{COLUMN_FILE_SUFFIX}'), column_type,
+                                          max_dictionary_size)
+                              for index, column_type in enumerate(column_types)]
+        self._row_count = 0
+        self._buffered = 0
+
+    @classmethod
+    def for_response(cls, response: BrokerResponse, column_types: ColumnTypeDict, **kwargs) -> 'ColumnarSpillWriter':
+        """
+        :param BrokerResponse response: First response, i.e. the first page, used for the column names and types
+        :param dict column_types: Types of the table's columns, i.e. query.columns
+        :return: ColumnarSpillWriter instance
+        """
+        pinot_types = response.column_types or [None] * len(response.column_names)
+        types = [get_spill_type(name, pinot_type, column_types)
+                 for name, pinot_type in zip(response.column_names, pinot_types)]
+        return cls(response.column_names, types, **kwargs)
+
+    def __len__(self):
+        return self._row_count
+
+    def append(self, row: Sequence[Any]):
+        for column_file, value in zip(self._column_files, row):
+            column_file.append(value)
+        self._row_count += 1
+        self._buffered += 1
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+
+    def extend(self, rows: Iterable[Sequence[Any]]):
+        for row in rows:
+            self.append(row)
+
+    def append_response(self, response: BrokerResponse):
+        """
+        Move the rows of the response to the spill, the response's rows are emptied to free their memory
+        """
+        if response.column_names != self.column_names:
+            raise ValueError(f'Columns {response.column_names} differ from the spilled columns {self.column_names}')
+        self.extend(response.rows)
+        response.rows = []
+
+    def flush(self):
+        for column_file in self._column_files:
+            column_file.flush()
+        self._buffered = 0
+
+    def finish(self) -> SpilledResult:
+        """
+        :return: SpilledResult over the written rows, no more rows can be appended
+        """
+        for column_file in self._column_files:
+            column_file.close()
+        return SpilledResult(self.directory, self.column_names, self._column_files, self._row_count,
+                             self.owns_directory)
+
+
+def spill_responses(responses: Iterable[BrokerResponse],
+                    column_types: ColumnTypeDict,
+                    directory: Optional[str] = None,
+                    buffer_rows: int = DEFAULT_BUFFER_ROWS,
+                    max_dictionary_size: int = DEFAULT_MAX_DICTIONARY_SIZE) -> SpilledResult:
+    """
+    Spill the rows of a sequence of responses, i.e. the pages of "sommelier.query_builder.pagination.paginate", so
+    only one page and the write buffers are in memory at once.
+
+    Example:
+
+    with spill_responses(paginate(query, executor, 'flight_id'), query.columns) as result:
+        total = sum(result.column('price'))
+
+    :param responses: Iterable of BrokerResponse with the same columns
+    :param dict column_types: Types of the table's columns
+    :param str directory: Directory of the column files, a temporary directory by default
+    :param int buffer_rows: Rows buffered before being written
+    :param int max_dictionary_size: Distinct values of a dictionary encoded column kept in memory
+    :return: SpilledResult instance
+    """
+    writer = None
+    for response in responses:
+        if writer is None:
+            writer = ColumnarSpillWriter.for_response(response, column_types, directory=directory,
+                                                      buffer_rows=buffer_rows, max_dictionary_size=max_dictionary_size)
+        writer.append_response(response)
+
+    if writer is None:
+        writer = ColumnarSpillWriter([], [], directory=directory, buffer_rows=buffer_rows)
+    return writer.finish()
@@ -0,0 +1,379 @@
+import re
+from typing import Any, List, Optional, Tuple
+
+# Tokens of the SQL emitted by the query builders
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<identifier>[A-Za-z_$][\w$.]*|"[^"]+")
+  | (?P<operator><>|!=|>=|<=|=|<|>)
+  | (?P<punctuation>[(),*])
+""", re.VERBOSE)
+
+KEYWORDS = {'SELECT', 'FROM', 'WHERE', 'GROUP', 'BY', 'ORDER', 'LIMIT', 'AND', 'OR', 'NOT', 'IN', 'AS', 'ASC', 'DESC',
+            'BETWEEN', 'TRUE', 'FALSE', 'NULL', 'IS', 'OPTION'}
+
+# Literal SQL keywords and their values
+LITERAL_KEYWORDS = {'TRUE': True, 'FALSE': False, 'NULL': None}
+
+
+class SqlSyntaxError(ValueError):
+    """
+    Raised when the SQL is not part of the supported subset
+    """
+
+    def __init__(self, sql: str, position: int, message: str):
+        self.sql = sql
+        self.position = position
+        super(SqlSyntaxError, self).__init__(f'{message} at position {position}: "{sql}"')
+
+
+class Token:
+    __slots__ = ('kind', 'text', 'start', 'end')
+
+    def __init__(self, kind: str, text: str, start: int, end: int):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'Token({self.kind!r}, {self.text!r})'
+
+    @property
+    def keyword(self) -> Optional[str]:
+        if self.kind == 'identifier' and self.text.upper() in KEYWORDS:
+            return self.text.upper()
+        return None
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens = []
+    position = 0
+    while position < len(sql):
+        matches = TOKEN_PATTERN.match(sql, position)
+        if not matches:
+            raise SqlSyntaxError(sql, position, f'Unexpected character "{sql[position]}"')
+        if matches.lastgroup != 'space':
+            tokens.append(Token(matches.lastgroup, matches.group(), matches.start(), matches.end()))
+        position = matches.end()
+    return tokens
+
+
+class Expression:
+    """
+    Column, literal, function call or "*" of a select, group by or order by term
+
+    str kind - "column", "literal", "function" or "star"
+    str text - The SQL the expression was parsed from
+    """
+
+    def __init__(self, kind: str, text: str, name: Optional[str] = None, arguments: Tuple = (), value: Any = None):
+        self.kind = kind
+        self.text = text
+        self.name = name
+        self.arguments = arguments
+        self.value = value
+
+    def __repr__(self):
+        return f'Expression({self.kind!r}, {self.text!r})'
+
+    def columns(self) -> List[str]:
+        """
+        :return: Names of the columns the expression reads
+        """
+        if self.kind == 'column':
+            return [self.name]
+        return [column for argument in self.arguments for column in argument.columns()]
+
+
+class SelectItem:
+    def __init__(self, expression: Expression, alias: Optional[str] = None):
+        self.expression = expression
+        self.alias = alias
+
+    def __repr__(self):
+        return f'SelectItem({self.expression!r}, alias={self.alias!r})'
+
+
+class Predicate:
+    """
+    Node of the WHERE clause
+
+    str kind - "and", "or", "not", "compare", "in", "between" or "function"
+    str operator - Comparison operator for "compare" nodes, function name for "function" nodes
+    tuple children - Sub predicates of "and", "or" and "not" nodes
+    Expression expression - Left hand side of the other nodes
+    value - Literal of "compare", tuple of literals for "in" and "between"
+    bool negated - For "in" and "between"
+    """
+
+    def __init__(self, kind: str, text: str, operator: Optional[str] = None, children: Tuple = (),
+                 expression: Optional[Expression] = None, value: Any = None, negated: bool = False):
+        self.kind = kind
+        self.text = text
+        self.operator = operator
+        self.children = children
+        self.expression = expression
+        self.value = value
+        self.negated = negated
+
+    def __repr__(self):
+        return f'Predicate({self.kind!r}, {self.text!r})'
+
+
+class SelectStatement:
+    def __init__(self):
+        self.select: List[SelectItem] = []
+        self.table_name: Optional[str] = None
+        self.where: Optional[Predicate] = None
+        self.group_by: List[Expression] = []
+        self.order_by: List[Tuple[Expression, bool]] = []
+        self.limit: Optional[int] = None
+        self.offset: Optional[int] = None
+
+
+class Parser:
+    """
+    Recursive descent parser of the SELECT statements emitted by the query builders
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.position = 0
+
+    def error(self, message: str):
+        token = self.peek()
+        raise SqlSyntaxError(self.sql, token.start if token else len(self.sql), message)
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def next(self) -> Token:
+        token = self.peek()
+        if token is None:
+            self.error('Unexpected end of the query')
+        self.position += 1
+        return token
+
+    def accept_keyword(self, *keywords: str) -> bool:
+        token = self.peek()
+        if token is not None and token.keyword in keywords:
+            self.position += 1
+            return True
+        return False
+
+    def expect_keyword(self, keyword: str):
+        if not self.accept_keyword(keyword):
+            self.error(f'Expected {keyword}')
+
+    def accept(self, text: str) -> bool:
+        token = self.peek()
+        if token is not None and token.kind in ('punctuation', 'operator') and token.text == text:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text: str):
+        if not self.accept(text):
+            self.error(f'Expected "{text}"')
+
+    def text_since(self, start_token: Token) -> str:
+        return self.sql[start_token.start:self.tokens[self.position - 1].end]
+
+    def parse(self) -> SelectStatement:
+        statement = SelectStatement()
+        self.expect_keyword('SELECT')
+        statement.select.append(self.parse_select_item())
+        while self.accept(','):
+            statement.select.append(self.parse_select_item())
+
+        self.expect_keyword('FROM')
+        statement.table_name = self.parse_identifier()
+
+        if self.accept_keyword('WHERE'):
+            statement.where = self.parse_or()
+
+        if self.accept_keyword('GROUP'):
+            self.expect_keyword('BY')
+            statement.group_by.append(self.parse_expression())
+            while self.accept(','):
+                statement.group_by.append(self.parse_expression())
+
+        if self.accept_keyword('ORDER'):
+            self.expect_keyword('BY')
+            statement.order_by.append(self.parse_order_item())
+            while self.accept(','):
+                statement.order_by.append(self.parse_order_item())
+
+        if self.accept_keyword('LIMIT'):
+            first = self.parse_integer()
+            if self.accept(','):
+                statement.offset, statement.limit = first, self.parse_integer()
+            else:
+                statement.limit = first
+
+        if self.peek() is not None:
+            self.error(f'Unsupported "{self.peek().text}"')
+        return statement
+
+    def parse_identifier(self) -> str:
+        token = self.next()
+        if token.kind != 'identifier' or token.keyword:
+            self.position -= 1
+            self.error('Expected an identifier')
+        return token.text.strip('"')
+
+    def parse_integer(self) -> int:
+        token = self.next()
+        if token.kind != 'number':
+            self.position -= 1
+            self.error('Expected a number')
+        return int(token.text)
+
+    def parse_select_item(self) -> SelectItem:
+        expression = self.parse_expression()
+        alias = None
+        if self.accept_keyword('AS'):
+            alias = self.parse_identifier()
+        return SelectItem(expression, alias)
+
+    def parse_order_item(self) -> Tuple[Expression, bool]:
+        expression = self.parse_expression()
+        descending = False
+        if self.accept_keyword('DESC'):
+            descending = True
+        else:
+            self.accept_keyword('ASC')
+        return expression, descending
+
+    def parse_literal(self):
+        token = self.next()
+        if token.kind == 'string':
+            return token.text[1:-1].replace("''", "'")
+        if token.kind == 'number':
+            text = token.text
+            return float(text) if any(character in text for character in '.eE') else int(text)
+        if token.keyword in LITERAL_KEYWORDS:
+            return LITERAL_KEYWORDS[token.keyword]
+        self.position -= 1
+        self.error('Expected a literal')
+
+    def parse_expression(self) -> Expression:
+        start = self.peek()
+        if start is None:
+            self.error('Expected an expression')
+
+        if self.accept('*'):
+            return Expression('star', '*')
+
+        if start.kind in ('string', 'number') or start.keyword in LITERAL_KEYWORDS:
+            return Expression('literal', start.text, value=self.parse_literal())
+
+        name = self.parse_identifier()
+        if not self.accept('('):
+            return Expression('column', name, name=name)
+
+        arguments = []
+        if not self.accept(')'):
+            arguments.append(self.parse_expression())
+            while self.accept(','):
+                arguments.append(self.parse_expression())
+            self.expect(')')
+        return Expression('function', self.text_since(start), name=name.upper(), arguments=tuple(arguments))
+
+    def parse_or(self) -> Predicate:
+        start = self.peek()
+        predicate = self.parse_and()
+        while self.accept_keyword('OR'):
+            predicate = Predicate('or', '', children=(predicate, self.parse_and()))
+            predicate.text = self.text_since(start)
+        return predicate
+
+    def parse_and(self) -> Predicate:
+        start = self.peek()
+        predicate = self.parse_not()
+        while self.accept_keyword('AND'):
+            predicate = Predicate('and', '', children=(predicate, self.parse_not()))
+            predicate.text = self.text_since(start)
+        return predicate
+
+    def parse_not(self) -> Predicate:
+        start = self.peek()
+        if self.accept_keyword('NOT'):
+            child = self.parse_not()
+            return Predicate('not', self.text_since(start), children=(child,))
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> Predicate:
+        start = self.peek()
+        if start is not None and start.kind == 'punctuation' and start.text == '(':
+            # A parenthesized predicate, as opposed to a function call which starts with an identifier
+            self.next()
+            predicate = self.parse_or()
+            self.expect(')')
+            return predicate
+
+        expression = self.parse_expression()
+        token = self.peek()
+
+        if token is not None and token.kind == 'operator':
+            operator = self.next().text
+            value = self.parse_literal()
+            return Predicate('compare', self.text_since(start), operator='<>' if operator == '!=' else operator,
+                             expression=expression, value=value)
+
+        negated = self.accept_keyword('NOT')
+        if self.accept_keyword('IN'):
+            self.expect('(')
+            values = [self.parse_literal()]
+            while self.accept(','):
+                values.append(self.parse_literal())
+            self.expect(')')
+            return Predicate('in', self.text_since(start), expression=expression, value=tuple(values), negated=negated)
+
+        if self.accept_keyword('BETWEEN'):
+            low = self.parse_literal()
+            self.expect_keyword('AND')
+            high = self.parse_literal()
+            return Predicate('between', self.text_since(start), expression=expression, value=(low, high),
+                             negated=negated)
+
+        if negated:
+            self.error('Expected IN or BETWEEN')
+
+        if expression.kind == 'function':
+            # Boolean functions i.e. regexp_like(column, 'pattern')
+            return Predicate('function', expression.text, operator=expression.name, expression=expression)
+
+        self.error('Expected a comparison')
+
+
+def parse_sql(sql: str) -> SelectStatement:
+    """
+    Parse the subset of SQL emitted by the query builders: SELECT of columns and function calls with aliases,
+    FROM a table, WHERE with comparisons, IN, BETWEEN, boolean functions, AND, OR and NOT, GROUP BY, ORDER BY and LIMIT
+
+    :param str sql: SQL query string
+    :return: SelectStatement instance
+    :raises SqlSyntaxError: When the SQL is not part of the subset
+    """
+    return Parser(sql).parse()
+
+
+def parse_predicate(sql: str) -> Predicate:
+    """
+    Parse a standalone predicate of the WHERE subset, i.e. the filter expression of JSON_MATCH
+
+    :param str sql: Predicate string. i.e. "$.airport" IN ('SFO','JFK')
+    :return: Predicate instance
+    :raises SqlSyntaxError: When the predicate is not part of the subset
+    """
+    parser = Parser(sql)
+    predicate = parser.parse_or()
+    if parser.peek() is not None:
+        parser.error(f'Unsupported "{parser.peek().text}"')
+    return predicate
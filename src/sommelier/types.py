@@ -1,7 +1,9 @@
-from typing import Dict, Callable
+from typing import Any, Callable, Dict, Union
 
 from sommelier.query_builder.date_types import DateField
 
 
 ColumnTypeDict = Dict[str, Callable]
 DateTypeDict = Dict[str, DateField]
+# Sends a SQL string to the Pinot broker and returns the JSON response, decoded or as the raw body
+QueryExecutor = Callable[[str], Union[Dict[str, Any], str, bytes]]
@@ -0,0 +1,40 @@
+import pytest
+
+from sommelier.query_builder.bulk import apply_variant, compile_variants, generate_sql_bulk
+from test_metrics_table import get_fake_table
+
+
+def get_variants():
+    return [
+        {'filters': {'airport': airport, 'price': {'op': '>', 'value': price}}, 'dates': ('2020-01-01', '2020-01-31')}
+        for airport in ('SFO', 'JFK', 'LAX') for price in range(4)
+    ]
+
+
+def test_apply_variant():
+    base = get_fake_table().select('model').select('SUM(price)').group_by('model').limit(10)
+    query = apply_variant(base.copy(), {
+        'select': ['SUM(distance)'],
+        'filters': {'airport': 'SFO', 'model': [{'op': '!=', 'value': 'B777'}]},
+        'dates': (None, '2020-01-31'),
+        'limit': 5
+    })
+
+    assert query.get_sql_query() == ("SELECT SUM(distance),SUM(price),model FROM fake_table WHERE airport='SFO' "
+                                     "AND date<='2020-01-31' AND model<>'B777' GROUP BY model LIMIT 5")
+    assert base.get_sql_query() == 'SELECT SUM(price),model FROM fake_table GROUP BY model LIMIT 10'
+
+    with pytest.raises(ValueError):
+        apply_variant(base.copy(), {'filter': {}})
+
+
+def test_generate_sql_bulk():
+    base = get_fake_table().select('SUM(price)')
+    expected = compile_variants(base, get_variants())
+
+    assert len(expected) == 12
+    assert expected[0] == ("SELECT SUM(price) FROM fake_table WHERE airport='SFO' "
+                           "AND date>='2020-01-01' AND date<='2020-01-31' AND price>0")
+    assert list(generate_sql_bulk(base, get_variants(), processes=1, chunk_size=5)) == expected
+    assert list(generate_sql_bulk(base, iter(get_variants()), processes=2, chunk_size=5)) == expected
+    assert base.get_sql_query() == 'SELECT SUM(price) FROM fake_table'
@@ -0,0 +1,126 @@
+import pytest
+from test_metrics_table import get_fake_table
+
+from sommelier.query_builder.bulk_filters import BulkFilterError, apply_bulk_filters, compile_bulk_filters
+from sommelier.query_builder.coercion import FilterValueError
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.query_cache import ColumnDependentCache
+
+test_payload = {
+    'airport': 'sfo',
+    'flight_number': {
+        'value': ['UA12', 'UA456'],
+        'op': 'in'
+    },
+    'price': [{
+        'value': '100',
+        'op': '>='
+    }, {
+        'value': 500,
+        'op': '<'
+    }]
+}
+
+
+def test_apply_bulk_filters_matches_filter_column_by_value():
+    expected = get_fake_table()
+    for column, value, operator in expected.parse_bulk_filters(test_payload):
+        expected.filter_column_by_value(column, value, operator)
+
+    query = get_fake_table()
+    result = apply_bulk_filters(query, test_payload)
+    assert result.errors == ()
+    assert query.filters == expected.filters
+    assert query.get_sql_query() == expected.get_sql_query()
+
+
+def test_apply_bulk_filters_appends_to_existing_filters():
+    query = get_fake_table().filter_column_by_value('price', 10, '>')
+    apply_bulk_filters(query, {'price': {'value': 20, 'op': '<'}})
+    assert [tuple(filter_value) for filter_value in query.filters['price']] == [('>', 10), ('<', 20)]
+
+
+def test_bulk_filter_errors_do_not_abort_the_payload():
+    payload = {
+        'airport': 'sfo',
+        'country': 'US',
+        'price': [{'value': 'cheap', 'op': '<'}, {'value': 5, 'op': 'bt'}, {'value': 10, 'op': '>'}],
+        'model': {'op': '=='},
+    }
+    query = get_fake_table()
+    result = apply_bulk_filters(query, payload)
+
+    assert set(query.filters) == {'airport', 'price'}
+    assert [tuple(filter_value) for filter_value in query.filters['price']] == [('>', 10)]
+    assert [(error.column, error.position) for error in result.errors] == [
+        ('country', None), ('price', 0), ('price', 1), ('model', None)]
+    assert isinstance(result.errors[1].error, FilterValueError)
+    assert str(result.errors[2]) == "price[1]: Unsupported operator 'bt'"
+
+    with pytest.raises(BulkFilterError) as error:
+        result.raise_for_errors()
+    assert len(error.value.errors) == 4
+    assert compile_bulk_filters(query.definition, test_payload).raise_for_errors().errors == ()
+
+
+def test_bulk_filters_cache():
+    cache = ColumnDependentCache()
+    first = get_fake_table()
+    second = get_fake_table()
+    result = apply_bulk_filters(first, test_payload, cache=cache)
+    assert apply_bulk_filters(second, test_payload, cache=cache) is result
+    assert len(cache) == 1
+    assert second.filters == first.filters
+
+    # Same payload in another key order
+    reordered = dict(reversed(list(test_payload.items())))
+    assert apply_bulk_filters(get_fake_table(), reordered, cache=cache) is result
+
+    # Only the payloads with a changed column are evicted
+    apply_bulk_filters(get_fake_table(), {'model': 'B787'}, cache=cache)
+    assert cache.invalidate_columns({'price'}) == 1
+    assert len(cache) == 1
+
+
+def test_bulk_filters_cache_unknown_columns():
+    cache = ColumnDependentCache()
+    result = apply_bulk_filters(get_fake_table(), {'country': 'US'}, cache=cache)
+    assert len(result.errors) == 1
+    assert cache.invalidate_columns((), columns_added=True) == 1
+
+
+def test_bulk_filters_check_the_column_kind():
+    query = get_fake_table()
+    result = apply_bulk_filters(query, {'airport': {'op': 'json_match', 'value': ['$.code', 'SFO']},
+                                        'model': {'op': 'mv_any', 'value': ['B787']}, 'price': 10})
+    assert set(query.filters) == {'price'}
+    assert [str(error) for error in result.errors] == [
+        'airport: "json_match" filters need a JSON column, "airport" is not one',
+        'model: "mv_any" filters need a multi-value column, "model" is not one']
+
+
+def test_bulk_filter_type_errors_do_not_abort_the_payload():
+    query = get_fake_table()
+    result = apply_bulk_filters(query, {'model': {'op': 'regex', 'value': 5}, 'airport': 'SFO'})
+    assert set(query.filters) == {'airport'}
+    assert [(error.column, type(error.error)) for error in result.errors] == [('model', TypeError)]
+
+    # Java syntax Python doesn't support is passed through to Pinot
+    result = apply_bulk_filters(get_fake_table(), {'model': {'op': 'regex', 'value': r'^\p{Lu}+'}})
+    assert result.errors == ()
+
+
+def test_bulk_filters_cache_is_per_definition():
+    cache = ColumnDependentCache()
+    query = get_fake_table()
+    as_string = MetricsTable('fake_table', dict(query.dimensions), dict(query.metrics, price=str),
+                             dict(query.datetime_columns))
+    as_int = apply_bulk_filters(query, {'price': '100'}, cache=cache)
+    assert apply_bulk_filters(as_string, {'price': '100'}, cache=cache) is not as_int
+    assert query.filters['price'][0].value == 100
+    assert as_string.filters['price'][0].value == '100'
+
+    # Columns outside of the payload don't matter
+    other = MetricsTable('fake_table', dict(query.dimensions, gate=str), dict(query.metrics),
+                         dict(query.datetime_columns))
+    assert apply_bulk_filters(other, {'price': '100'}, cache=cache) is as_int
@@ -0,0 +1,82 @@
+from datetime import date, datetime
+
+import pytest
+
+from sommelier.query_builder.coercion import FilterValueError
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.table_definition import MetricsTableDefinition
+from test_metrics_table import get_fake_table
+
+test_schema = {
+    'schemaName': 'flights',
+    'dimensionFieldSpecs': [
+        {'name': 'flightNumber', 'dataType': 'LONG'},
+        {'name': 'airport', 'dataType': 'STRING'},
+        {'name': 'cancelled', 'dataType': 'BOOLEAN'},
+    ],
+    'metricFieldSpecs': [{'name': 'price', 'dataType': 'DOUBLE'}],
+    'dateTimeFieldSpecs': [
+        {'name': 'hoursSinceEpoch', 'dataType': 'INT', 'format': '1:HOURS:EPOCH', 'granularity': '1:HOURS'},
+        {'name': 'day', 'dataType': 'INT', 'format': '1:DAYS:SIMPLE_DATE_FORMAT:yyyyMMdd', 'granularity': '1:DAYS'},
+    ]
+}
+
+
+def get_query():
+    return MetricsTable.from_definition(MetricsTableDefinition.from_schema('flights', test_schema)).select('COUNT(*)')
+
+
+def test_values_are_converted_to_the_column_type():
+    query = get_query() \
+        .filter_column_by_value('flightNumber', '123') \
+        .filter_column_by_value('airport', 123) \
+        .filter_column_by_value('price', '10.5', operator='>') \
+        .filter_column_by_value('cancelled', 'false')
+    assert query.get_sql_query() == 'SELECT COUNT(*) FROM flights ' \
+                                    'WHERE airport=\'123\' AND cancelled=false AND flightNumber=123 AND price>10.5'
+
+
+def test_list_and_between_values_are_converted():
+    query = get_query() \
+        .filter_column_by_value('flightNumber', ('1', 2, 3.0), operator='in') \
+        .filter_column_by_value('price', ['10', 20], operator='between')
+    assert query.filters['flightNumber'][0].value == [1, 2, 3]
+    assert query.filters['price'][0].value == [10.0, 20]
+
+
+def test_invalid_values_are_rejected_when_added():
+    with pytest.raises(FilterValueError, match='flightNumber'):
+        get_query().filter_column_by_value('flightNumber', 'UA123')
+    with pytest.raises(FilterValueError):
+        get_query().filter_column_by_value('flightNumber', [1, 'two'], operator='in')
+    with pytest.raises(FilterValueError):
+        get_query().filter_column_by_value('price', [10], operator='between')
+    with pytest.raises(FilterValueError):
+        get_query().filter_column_by_value('airport', 'SFO', operator='in')
+    with pytest.raises(FilterValueError):
+        get_query().filter_column_by_value('cancelled', 'maybe')
+
+
+def test_datetime_values():
+    query = get_query() \
+        .filter_column_by_value('hoursSinceEpoch', datetime(2020, 1, 1, 5), operator='>=') \
+        .filter_column_by_value('day', [date(2020, 1, 1), '20200131'], operator='between')
+    assert query.filters['hoursSinceEpoch'][0].value == 438293
+    assert query.filters['day'][0].value == [20200101, 20200131]
+
+    with pytest.raises(FilterValueError, match='yyyyMMdd'):
+        get_query().filter_column_by_value('day', '2020-01-01')
+
+
+def test_string_dates_keep_their_format():
+    query = get_fake_table().filter_dates_between(date(2018, 1, 1), '2018-01-06')
+    assert query.filters['date'][0].value == ['2018-01-01', '2018-01-06']
+
+    with pytest.raises(FilterValueError):
+        get_fake_table().filter_dates_between('20180101')
+
+
+def test_coercers_are_compiled_once_per_column():
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    assert definition.get_coercer('flightNumber') is definition.get_coercer('flightNumber')
+    assert definition.get_coercer('missing') is None
@@ -0,0 +1,136 @@
+import pytest
+
+from sommelier.query_builder.cost import (CostBudget, QueryCostExceededError, get_approximate_aggregate,
+                                          get_coarser_time_bucket)
+from sommelier.schema_parser import get_table_statistics
+from test_metrics_table import get_fake_table
+
+HOURLY_BUCKETS = "DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', '1:MILLISECONDS:EPOCH', '1:HOURS')"
+
+
+def get_statistics():
+    return get_table_statistics({
+        'totalDocs': 100000000,
+        'rowsPerDay': 1000000,
+        'columns': {
+            'airport': {'cardinality': 100},
+            'model': {'cardinality': 10},
+            'flight_number': {'cardinality': 5000}
+        }
+    }, {
+        'tableIndexConfig': {
+            'invertedIndexColumns': ['airport'],
+            'rangeIndexColumns': ['price']
+        }
+    })
+
+
+def get_query():
+    return get_fake_table().set_statistics(get_statistics())
+
+
+def test_estimate_without_time_filter():
+    cost = get_query().select('COUNT(*)').filter_column_by_value('airport', 'SFO').estimate_cost()
+    assert cost.docs_in_scope == 100000000
+    assert cost.docs_scanned == 1000000
+    assert cost.entries_scanned_in_filter == 0
+    assert cost.result_size == 1
+    assert cost.full_scan_columns == []
+
+
+def test_estimate_with_time_filter_and_scan():
+    query = get_query() \
+        .select('COUNT(*)') \
+        .filter_dates_between('2020-03-01', '2020-03-10') \
+        .filter_column_by_value('airport', 'SFO') \
+        .filter_column_by_value('model', 'B777')
+    cost = query.estimate_cost()
+
+    assert cost.docs_in_scope == 10000000
+    # airport uses the inverted index, model scans what is left
+    assert cost.entries_scanned_in_filter == 100000
+    assert cost.docs_scanned == 10000
+    assert cost.full_scan_columns == ['model']
+
+
+def test_estimate_group_by():
+    query = get_query().select('COUNT(*)').group_by('airport').group_by('model')
+    assert query.estimate_cost().result_size == 1000
+    assert query.cardinalities['airport'] == 100
+
+    query = get_query() \
+        .select('COUNT(*)') \
+        .group_by(HOURLY_BUCKETS) \
+        .filter_column_by_value('ms', [1583020800000, 1583107200000 - 1], operator='between') \
+        .limit(100)
+    assert query.estimate_cost().result_size == 24
+
+
+def test_estimate_group_by_is_capped_by_the_limit():
+    # Without a limit, Pinot returns its default 10 groups when the number of groups is unknown
+    query = get_query() \
+        .select('COUNT(*)') \
+        .group_by(HOURLY_BUCKETS) \
+        .filter_column_by_value('ms', [1583020800000, 1583107200000 - 1], operator='between')
+    assert query.estimate_cost().result_size == 10
+
+    # or the limit sized from the cardinalities
+    query = get_query().select('COUNT(*)').group_by('airport').group_by('model')
+    query.max_group_by_limit = 500
+    assert query.get_effective_limit() == 500
+    assert query.estimate_cost().result_size == 500
+    query.set_cost_budget(CostBudget(max_result_size=500))
+    assert query.apply_cost_budget() is query
+
+    assert query.limit(20).estimate_cost().result_size == 20
+
+
+def test_estimate_requires_statistics():
+    with pytest.raises(ValueError):
+        get_fake_table().estimate_cost()
+
+
+def test_cost_budget_rejects():
+    query = get_query().select('COUNT(*)').set_cost_budget(CostBudget(max_docs_scanned=1000))
+    with pytest.raises(QueryCostExceededError):
+        query.apply_cost_budget()
+
+    query.set_cost_budget(CostBudget(max_docs_scanned=10 ** 9))
+    assert query.apply_cost_budget() is query
+
+
+def test_cost_budget_downgrades():
+    query = get_query() \
+        .select('DISTINCTCOUNT(flight_number)') \
+        .select(HOURLY_BUCKETS) \
+        .group_by(HOURLY_BUCKETS) \
+        .filter_column_by_value('ms', [1583020800000, 1583107200000 * 2 - 1583020800000 - 1], operator='between') \
+        .limit(100) \
+        .set_cost_budget(CostBudget(max_result_size=10, max_exact_aggregation_docs=1000, downgrade=True))
+
+    downgraded = query.apply_cost_budget()
+    assert downgraded is not query
+    assert 'DISTINCTCOUNTHLL(flight_number)' in downgraded._selected
+    assert downgraded._group_by == (HOURLY_BUCKETS.replace('1:HOURS', '1:DAYS'),)
+    assert downgraded.estimate_cost().result_size == 2
+    # The original query is unchanged
+    assert 'DISTINCTCOUNT(flight_number)' in query._selected
+
+
+def test_downgrade_helpers():
+    assert get_approximate_aggregate('distinctcount(airport)') == 'DISTINCTCOUNTHLL(airport)'
+    assert get_approximate_aggregate('percentile95(price)') == 'PERCENTILETDIGEST95(price)'
+    assert get_approximate_aggregate('sum(price)') is None
+    assert get_coarser_time_bucket(HOURLY_BUCKETS) == HOURLY_BUCKETS.replace('1:HOURS', '1:DAYS')
+    assert get_coarser_time_bucket(HOURLY_BUCKETS.replace('1:HOURS', '1:DAYS')) is None
+    assert get_coarser_time_bucket('airport') is None
+
+
+def test_estimate_index_friendly_regex():
+    query = get_query().select('COUNT(*)').filter_column_by_value('airport', '^(SFO|LAX)$', operator='regex')
+    cost = query.estimate_cost()
+    assert cost.docs_scanned == 2000000
+    assert cost.full_scan_columns == []
+
+    query = get_query().select('COUNT(*)').filter_column_by_value('airport', 'SF', operator='regex')
+    assert query.estimate_cost().full_scan_columns == ['airport']
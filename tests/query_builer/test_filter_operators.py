@@ -0,0 +1,118 @@
+import pytest
+
+from sommelier.query_builder.coercion import FilterValueError
+from sommelier.query_builder.cost import TableStatistics, ColumnStatistics
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.table_definition import MetricsTableDefinition
+
+test_schema = {
+    'schemaName': 'flights',
+    'dimensionFieldSpecs': [
+        {'name': 'airport', 'dataType': 'STRING'},
+        {'name': 'tags', 'dataType': 'STRING', 'singleValueField': False},
+        {'name': 'details', 'dataType': 'JSON'},
+        {'name': 'notes', 'dataType': 'STRING'},
+    ],
+    'metricFieldSpecs': [{'name': 'price', 'dataType': 'DOUBLE'}],
+}
+
+
+def get_query(table_configuration=None):
+    definition = MetricsTableDefinition.from_schema('flights', test_schema, table_configuration=table_configuration)
+    return MetricsTable.from_definition(definition).select('COUNT(*)')
+
+
+def get_where(query):
+    return query.get_sql_query().split(' WHERE ', 1)[1]
+
+
+def test_definition_knows_the_column_kinds():
+    query = get_query()
+    assert query.multi_value_columns == {'tags'}
+    assert query.json_columns == {'details'}
+
+
+def test_multi_value_filters():
+    assert get_where(get_query().filter_column_by_value('tags', ['a', 'b'], operator='mv_any')) == "tags IN ('a','b')"
+    assert get_where(get_query().filter_column_by_value('tags', ['a', 'b'], operator='mv_all')) == \
+        "tags='a' AND tags='b'"
+    assert get_where(get_query().filter_column_by_value('tags', ['a'], operator='mv_none')) == "tags NOT IN ('a')"
+
+    with pytest.raises(FilterValueError):
+        get_query().filter_column_by_value('tags', 'a', operator='mv_any')
+
+
+def test_json_match():
+    query = get_query().filter_column_by_value('details', ('$.gate', 'A1'), operator='json_match')
+    assert get_where(query) == 'JSON_MATCH(details,\'"$.gate"=\'\'A1\'\'\')'
+
+    query = get_query().filter_column_by_value('details', ('$.gate', ['A1', 'B2']), operator='json_match')
+    assert query.filters['details'][0].value == '"$.gate" IN (\'A1\',\'B2\')'
+
+    raw = '"$.delay" > 10'
+    assert get_query().filter_column_by_value('details', raw, operator='json_match').filters['details'][0].value == raw
+
+    with pytest.raises(ValueError):
+        get_query().filter_column_by_value('details', ('gate', 'A1'), operator='json_match')
+    with pytest.raises(ValueError):
+        get_query().filter_column_by_value('details', ('$.delay', '>', 10), operator='json_match')
+
+
+def test_json_extract_scalar():
+    query = get_query().filter_column_by_value('details', ('$.delay', '>', 10), operator='json_extract_scalar')
+    assert get_where(query) == 'JSON_EXTRACT_SCALAR(details,\'$.delay\',\'LONG\')>10'
+
+    query = get_query().filter_column_by_value('details', ('$.gate', 'A1'), operator='json_extract_scalar')
+    assert get_where(query) == 'JSON_EXTRACT_SCALAR(details,\'$.gate\',\'STRING\')=\'A1\''
+
+
+def test_json_extract_scalar_uses_the_json_index():
+    query = get_query({'tableIndexConfig': {'jsonIndexColumns': ['details']}})
+    query.filter_column_by_value('details', ('$.gate', 'A1'), operator='json_extract_scalar')
+    assert get_where(query) == 'JSON_MATCH(details,\'"$.gate"=\'\'A1\'\'\')'
+
+    query = get_query({'tableIndexConfig': {'jsonIndexColumns': ['details']}})
+    query.filter_column_by_value('details', ('$.delay', '>', 10), operator='json_extract_scalar')
+    assert get_where(query).startswith('JSON_EXTRACT_SCALAR')
+
+
+def test_text_match():
+    query = get_query().filter_column_by_value('notes', 'delayed AND weather', operator='text_match')
+    assert get_where(query) == 'TEXT_MATCH(notes,\'delayed AND weather\')'
+
+    with pytest.raises(FilterValueError):
+        get_query().filter_column_by_value('notes', ['delayed'], operator='text_match')
+
+
+def test_cost_of_index_filters():
+    statistics = TableStatistics(columns={
+        'details': ColumnStatistics('details', indexes=['json']),
+        'notes': ColumnStatistics('notes', indexes=['text']),
+    }, total_docs=1000000)
+    query = get_query().set_statistics(statistics) \
+        .filter_column_by_value('details', ('$.gate', 'A1'), operator='json_extract_scalar') \
+        .filter_column_by_value('notes', 'delayed', operator='text_match')
+    assert query.estimate_cost().full_scan_columns == []
+
+
+def test_operators_need_the_column_kind():
+    for column, value, operator in [
+        ('airport', ('$.gate', 'A1'), 'json_match'),
+        ('airport', ('$.gate', 'A1'), 'json_extract_scalar'),
+        ('airport', ['SFO'], 'mv_any'),
+        ('details', ['A1'], 'mv_all'),
+        ('price', 'delayed', 'text_match'),
+        ('details', 'delayed', 'text_match'),
+    ]:
+        with pytest.raises(ValueError, match=f'"{column}" is not one'):
+            get_query().filter_column_by_value(column, value, operator=operator)
+
+
+def test_empty_lists_are_rejected():
+    for operator in ['mv_any', 'mv_all', 'mv_none']:
+        with pytest.raises(FilterValueError, match='non empty list'):
+            get_query().filter_column_by_value('tags', [], operator=operator)
+    with pytest.raises(FilterValueError, match='non empty list'):
+        get_query().filter_column_by_value('airport', [], operator='in')
+    with pytest.raises(ValueError, match='non empty list'):
+        get_query().filter_column_by_value('details', ('$.gate', []), operator='json_match')
@@ -0,0 +1,54 @@
+import json
+
+from sommelier.broker import execute_query
+from sommelier.query_builder.instrumentation import QueryTracer
+from test_metrics_table import get_fake_table
+
+
+def get_query():
+    return get_fake_table() \
+        .select('airport') \
+        .select('model') \
+        .filter_column_by_value('airport', ['SFO', 'LAX', 'JFK'], operator='in') \
+        .filter_column_by_value('model', ['B777'], operator='in') \
+        .filter_column_by_value('flight_number', 'UA1')
+
+
+def test_tracer_records_build_phases_and_counters():
+    query = get_query()
+    tracer = QueryTracer()
+    with tracer.tracing(query):
+        sql = query.get_sql_query()
+
+    assert tracer.phases['generate_term'].calls == 2
+    assert tracer.phases['build_criterion_for_filter'].calls == 1
+    assert tracer.phases['get_sql_query'].calls == 1
+    assert tracer.counters == {
+        'queries': 1,
+        'filters': 3,
+        'in_list_values': 4,
+        'max_in_list_size': 3,
+        'sql_bytes': len(sql)
+    }
+
+    # The tracer is detached after the context
+    assert query.get_tracer() is None
+    query.get_sql_query()
+    assert tracer.counters['queries'] == 1
+
+
+def test_tracer_records_network_and_decode():
+    phases = []
+    tracer = QueryTracer(on_phase=lambda name, seconds: phases.append(name))
+    query = get_query().set_tracer(tracer)
+
+    def executor(sql):
+        return json.dumps({'resultTable': {'dataSchema': {'columnNames': ['airport']}, 'rows': [['SFO']]}})
+
+    response = execute_query(query, executor)
+    assert response.rows == [['SFO']]
+    assert phases[-2:] == ['network', 'decode']
+    assert tracer.phases['network'].total_seconds >= 0
+
+    tracer.reset()
+    assert tracer.phases == {}
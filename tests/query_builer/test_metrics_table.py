@@ -71,23 +71,23 @@ def test_select_all_metrics():
 def test_filter_date_between():
     query = get_fake_table()
     query.select_all_dimensions()
-    query.filter_dates_between('20180101')
+    query.filter_dates_between('2018-01-01')
     assert 'date' in query.filters
     assert query.filters['date'][0]['op'] == '>='
 
     query = get_fake_table()
     query.select_all_dimensions()
-    query.filter_dates_between(None, '20180101')
+    query.filter_dates_between(None, '2018-01-01')
     assert query.filters['date'][0]['op'] == '<='
 
     query = get_fake_table()
     query.select_all_dimensions()
-    query.filter_dates_between('20180101', '20180106')
+    query.filter_dates_between('2018-01-01', '2018-01-06')
     assert 'date' in query.filters
     assert query.filters['date'][0]['op'] == 'between'
     sql = query.get_sql_query()
-    assert 'date>=\'20180101\'' in sql
-    assert 'date<=\'20180106\'' in sql
+    assert 'date>=\'2018-01-01\'' in sql
+    assert 'date<=\'2018-01-06\'' in sql
 
 
 def test_parse_bulk_filters():
@@ -143,3 +143,30 @@ def test_get_milliseconds_datetime_column():
     ms_column_information = query_builder.get_milliseconds_datetime_column()
 
     assert ms_column_information.name == 'ms'
+
+
+def test_compact_query_state():
+    """
+    Queries have no instance dict, store filters as tuples and share the column metadata of the same definition
+    """
+    dimensions = {'airport': str}
+    metrics = {'price': int}
+    datetime_columns = {'ms': DateField(name='ms', data_type=int, date_format='1:MILLISECONDS:EPOCH',
+                                        granularity='15:MINUTES')}
+
+    query = MetricsTable('fake_table', dimensions, metrics, datetime_columns)
+    other_query = MetricsTable('fake_table', dimensions, metrics, datetime_columns)
+
+    assert not hasattr(query, '__dict__')
+    assert query.columns is other_query.columns
+    assert query.columns == {'airport': str, 'price': int, 'ms': int}
+
+    query.filter_column_by_value('airport', 'SFO', operator='!=')
+    assert query.filters['airport'][0] == ('!=', 'SFO')
+    assert query.filters['airport'][0]['op'] == '!='
+    assert query.filters['airport'][0]['value'] == 'SFO'
+    assert 'airport' not in other_query.filters
+
+    copied = query.copy().filter_column_by_value('airport', 'LAX')
+    assert len(query.filters['airport']) == 1
+    assert len(copied.filters['airport']) == 2
@@ -0,0 +1,132 @@
+import pytest
+
+from sommelier.broker import BrokerError
+from sommelier.query_builder.pagination import KeysetPaginator, paginate
+from test_metrics_table import get_fake_table
+
+
+def fake_executor(pages):
+    """
+    Return the pages in order and record the SQL that was sent
+    """
+    sent = []
+
+    def executor(sql):
+        sent.append(sql)
+        rows = pages[len(sent) - 1]
+        return {
+            'resultTable': {
+                'dataSchema': {'columnNames': ['date', 'flight_number'], 'columnDataTypes': ['INT', 'STRING']},
+                'rows': rows
+            },
+            'exceptions': []
+        }
+
+    return executor, sent
+
+
+def get_selection_query():
+    query = get_fake_table()
+    query.select('flight_number')
+    return query
+
+
+@pytest.mark.parametrize('prefetch', (False, True))
+def test_paginate(prefetch):
+    executor, sent = fake_executor([
+        [[1, 'UA1'], [1, 'UA2']],
+        [[2, 'UA1'], [3, 'UA1']],
+        [[3, 'UA9']],
+    ])
+    query = get_selection_query()
+    pages = list(paginate(query, executor, tie_breaker_column='flight_number', page_size=2, prefetch=prefetch))
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert len(sent) == 3
+    assert sent[0] == 'SELECT date,flight_number FROM fake_table ORDER BY date ASC,flight_number ASC LIMIT 2'
+    assert 'WHERE date>1 OR (date=1 AND flight_number>\'UA2\')' in sent[1]
+    assert 'WHERE date>3 OR (date=3 AND flight_number>\'UA1\')' in sent[2]
+    assert 'OFFSET' not in ''.join(sent)
+
+    # The original query is left untouched
+    assert query.get_sql_query() == 'SELECT flight_number FROM fake_table'
+
+
+def test_paginate_stops_on_empty_page():
+    executor, sent = fake_executor([[[1, 'UA1'], [1, 'UA2']], []])
+    pages = list(paginate(get_selection_query(), executor, tie_breaker_column='flight_number', page_size=2))
+    assert len(pages) == 1
+    assert len(sent) == 2
+
+
+def test_paginate_is_lazy():
+    executor, sent = fake_executor([[[1, 'UA1']]])
+    pages = paginate(get_selection_query(), executor, tie_breaker_column='flight_number', page_size=1)
+    assert len(sent) == 0
+    next(pages)
+    assert len(sent) == 1
+
+
+def test_paginate_invalid_queries():
+    executor, _ = fake_executor([])
+
+    with pytest.raises(ValueError):
+        paginate(get_selection_query().group_by('airport'), executor, tie_breaker_column='flight_number')
+
+    with pytest.raises(ValueError):
+        paginate(get_selection_query().order_by('price'), executor, tie_breaker_column='flight_number')
+
+    with pytest.raises(ValueError):
+        paginate(get_selection_query(), executor, tie_breaker_column='does_not_exist')
+
+    for page_size, limit in ((0, None), (-1, None), (10, 0), (10, -5)):
+        with pytest.raises(ValueError):
+            paginate(get_selection_query().limit(limit), executor, tie_breaker_column='flight_number',
+                     page_size=page_size)
+
+
+def test_paginate_broker_error():
+    def executor(sql):
+        return {'exceptions': [{'errorCode': 150, 'message': 'bad query'}]}
+
+    with pytest.raises(BrokerError):
+        next(paginate(get_selection_query(), executor, tie_breaker_column='flight_number'))
+
+
+def test_page_query_keeps_existing_filters():
+    executor, sent = fake_executor([[[1, 'UA1']], []])
+    query = get_selection_query().filter_column_by_value('airport', 'SFO')
+    list(paginate(query, executor, tie_breaker_column='flight_number', page_size=1))
+    assert 'WHERE airport=\'SFO\' AND (date>1 OR (date=1 AND flight_number>\'UA1\'))' in sent[1]
+
+
+@pytest.mark.parametrize('prefetch', (False, True))
+def test_paginate_keeps_the_query_limit(prefetch):
+    executor, sent = fake_executor([
+        [[1, 'UA1'], [1, 'UA2']],
+        [[2, 'UA1'], [3, 'UA1']],
+        [[3, 'UA9']],
+    ])
+    query = get_selection_query().limit(5)
+    pages = list(paginate(query, executor, tie_breaker_column='flight_number', page_size=2, prefetch=prefetch))
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [sql.rsplit(' ', 1)[-1] for sql in sent] == ['2', '2', '1']
+
+
+def test_paginate_stops_at_the_query_limit():
+    executor, sent = fake_executor([[[1, 'UA1'], [1, 'UA2']]])
+    pages = list(paginate(get_selection_query().limit(2), executor, tie_breaker_column='flight_number', page_size=2))
+    assert len(pages) == 1
+    assert len(sent) == 1
+
+    paginator = KeysetPaginator(get_selection_query().limit(2), executor, tie_breaker_column='flight_number')
+    with pytest.raises(ValueError):
+        paginator.get_page_query(1, 'UA2', rows_returned=2)
+
+
+def test_paginate_null_key():
+    executor, sent = fake_executor([[[1, 'UA1'], [None, 'UA2']]])
+    with pytest.raises(ValueError):
+        list(paginate(get_selection_query(), executor, tie_breaker_column='flight_number', page_size=2))
+    assert len(sent) == 1
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from pypika import Order
+
+from sommelier.query_builder.cost import ColumnStatistics, TableStatistics
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.spec import QuerySpecError, decode_query, encode_query, get_cache_key
+from sommelier.query_builder.table import Table
+from sommelier.query_builder.table_definition import MetricsTableDefinition
+from test_filter_operators import test_schema
+from test_metrics_table import get_fake_table
+
+
+def get_query():
+    query = get_fake_table()
+    table = query.get_pypika_table()
+    return query.select('model').select('SUM(price)') \
+        .filter_column_by_value('airport', ['SFO', 'JFK'], operator='in') \
+        .filter_column_by_value('price', 10, operator='>') \
+        .filter_column_by_value('price', 100, operator='<') \
+        .filter_dates_between('2020-01-01', '2020-01-31') \
+        .add_custom_filter((table.model == 'B777') | (table.distance > 500)) \
+        .group_by('model') \
+        .order_by('SUM(price)', order=Order.desc) \
+        .limit(20)
+
+
+def test_round_trip():
+    query = get_query()
+    encoded = encode_query(query)
+    decoded = decode_query(encoded, query.definition)
+
+    assert type(decoded) is MetricsTable
+    assert decoded.definition is query.definition
+    assert decoded.get_sql_query() == query.get_sql_query()
+    assert encode_query(decoded) == encoded
+    assert decode_query(encoded, {'fake_table': query.definition}).get_sql_query() == query.get_sql_query()
+
+    # Custom filters are kept as SQL and still get their parentheses when combined with other criteria
+    decoded.add_custom_filter(decoded.get_pypika_table().airport == 'LAX')
+    query.add_custom_filter(query.get_pypika_table().airport == 'LAX')
+    assert decoded.get_sql_query() == query.get_sql_query()
+    assert "AND (model='B777' OR distance>500)" in query.get_sql_query()
+
+
+def test_spec_is_compact_and_canonical():
+    query = get_query()
+    spec = json.loads(encode_query(query))
+
+    assert spec['s'] == ['SUM(price)', 'model']
+    assert spec['f'][0] == ['airport', 'in', ['SFO', 'JFK']]
+    assert spec['c'] == [["model='B777' OR distance>500", 'OR']]
+    assert 'n' not in spec and 'm' not in spec
+
+    reordered = get_fake_table().select('SUM(price)').select('model').filter_column_by_value('airport', 'SFO')
+    same = get_fake_table().select('model').select('SUM(price)').filter_column_by_value('airport', 'SFO')
+    assert get_cache_key(reordered) == get_cache_key(same)
+    assert get_cache_key(reordered) != get_cache_key(same.limit(1))
+
+
+def test_decode_errors():
+    query = get_query()
+    encoded = encode_query(query)
+
+    with pytest.raises(QuerySpecError):
+        decode_query(encoded, {})
+    with pytest.raises(QuerySpecError):
+        decode_query(encoded, Table('fake_table', {'airport': str}).definition)
+    with pytest.raises(QuerySpecError):
+        decode_query(dict(json.loads(encoded), v=99), query.definition)
+
+
+def test_spec_only_depends_on_its_columns():
+    query = get_fake_table().select('SUM(price)').filter_column_by_value('airport', 'SFO').group_by('model')
+    definition = query.definition
+    encoded = encode_query(query)
+
+    added = MetricsTable('fake_table', dict(definition.dimensions, gate=str), dict(definition.metrics),
+                         dict(definition.datetime_columns))
+    assert added.definition is not definition
+    assert decode_query(encoded, added.definition).get_sql_query() == query.get_sql_query()
+    assert get_cache_key(decode_query(encoded, added.definition)) == get_cache_key(query)
+
+    changed = MetricsTable('fake_table', dict(definition.dimensions), dict(definition.metrics, price=float),
+                           dict(definition.datetime_columns))
+    with pytest.raises(QuerySpecError):
+        decode_query(encoded, changed.definition)
+
+
+def test_round_trip_with_statistics():
+    statistics = TableStatistics(columns={
+        'details': ColumnStatistics('details', indexes=['json']),
+        'airport': ColumnStatistics('airport', cardinality=50),
+    }, total_docs=1000000)
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    query = MetricsTable.from_definition(definition).set_statistics(statistics) \
+        .select('airport').select('COUNT(*)').group_by('airport') \
+        .filter_column_by_value('details', ('$.gate', 'A1'), operator='json_extract_scalar')
+    assert 'JSON_MATCH' in query.get_sql_query()
+    encoded = encode_query(query)
+
+    # Without the statistics the JSON index is unknown and the filter would stay a JSON_EXTRACT_SCALAR
+    with pytest.raises(QuerySpecError, match='statistics'):
+        decode_query(encoded, definition)
+
+    decoded = decode_query(encoded, definition, statistics=statistics)
+    assert decoded.statistics is statistics
+    assert decoded.get_sql_query() == query.get_sql_query()
+    assert encode_query(decoded) == encoded
@@ -0,0 +1,95 @@
+import pytest
+
+from sommelier.query_builder.star_tree import StarTreeFallbackWarning, get_function_column_pair
+from sommelier.schema_parser import get_star_tree_index_configs
+from test_metrics_table import get_fake_table
+
+TABLE_CONFIG = {
+    'tableIndexConfig': {
+        'starTreeIndexConfigs': [{
+            'dimensionsSplitOrder': ['airport', 'model'],
+            'skipStarNodeCreationForDimensions': [],
+            'functionColumnPairs': ['SUM__price', 'COUNT__*'],
+            'maxLeafRecords': 10000
+        }, {
+            'dimensionsSplitOrder': ['flight_number'],
+            'aggregationConfigs': [{'columnName': 'distance', 'aggregationFunction': 'MAX'}]
+        }]
+    }
+}
+
+
+def get_query():
+    return get_fake_table().set_star_trees(get_star_tree_index_configs(TABLE_CONFIG),
+                                           known_values={'model': ['A320', 'A350', 'B777']})
+
+
+def test_get_function_column_pair():
+    assert get_function_column_pair('sum(price)') == 'SUM__price'
+    assert get_function_column_pair('COUNT(*)') == 'COUNT__*'
+    assert get_function_column_pair('PERCENTILETDIGEST95(price)') == 'PERCENTILETDIGEST__price'
+    assert get_function_column_pair('airport') is None
+
+
+def test_query_uses_star_tree():
+    query = get_query().select('SUM(price)').select('airport').group_by('airport')
+    query.filter_column_by_value('model', ['B777', 'A350'], operator='in')
+    shaped, report = query.shape_for_star_tree()
+
+    assert shaped is query
+    assert report.uses_star_tree
+    assert report.star_tree.dimensions_split_order == ['airport', 'model']
+    assert report.rewrites == []
+
+    query = get_query().select('MAX(distance)').filter_column_by_value('flight_number', 'UA1')
+    assert query.shape_for_star_tree()[1].star_tree.dimensions_split_order == ['flight_number']
+
+
+def test_regex_rewritten_to_in():
+    query = get_query().select('COUNT(*)').filter_column_by_value('model', '^A3', operator='regex')
+    shaped, report = query.shape_for_star_tree()
+
+    assert report.uses_star_tree
+    assert len(report.rewrites) == 1
+    assert shaped.filters['model'] == (('in', ['A320', 'A350']),)
+    assert query.filters['model'] == (('regex', '^A3'),)
+    assert 'model IN (\'A320\',\'A350\')' in shaped.get_sql_query()
+
+
+@pytest.mark.parametrize('query', (
+        get_query().select('AVG(price)'),
+        get_query().select('SUM(price)').group_by('flight_number'),
+        get_query().select('SUM(price)').filter_column_by_value('airport', 'S', operator='regex'),
+        get_query().select('SUM(price)').filter_column_by_value('date', '2020-01-01'),
+        get_query().select('airport'),
+))
+def test_query_falls_back(query):
+    with pytest.warns(StarTreeFallbackWarning):
+        shaped, report = query.shape_for_star_tree()
+
+    assert shaped is query
+    assert not report.uses_star_tree
+    assert set(report.fallback_reasons) == {0, 1}
+
+
+def test_table_without_star_tree():
+    with pytest.warns(StarTreeFallbackWarning):
+        _, report = get_fake_table().select('COUNT(*)').shape_for_star_tree()
+    assert not report.uses_star_tree
+
+
+def test_index_friendly_regex_uses_star_tree():
+    query = get_query().select('COUNT(*)').filter_column_by_value('airport', '^(SFO|LAX)$', operator='regex')
+    shaped, report = query.shape_for_star_tree()
+    assert shaped is query
+    assert report.uses_star_tree
+
+
+def test_java_only_regex_is_not_rewritten():
+    query = get_query().select('COUNT(*)').filter_column_by_value('model', r'^\p{Lu}', operator='regex')
+    with pytest.warns(StarTreeFallbackWarning):
+        shaped, report = query.shape_for_star_tree()
+
+    assert shaped is query
+    assert report.rewrites == []
+    assert 'regex filter on model is not supported by the star-tree' in report.fallback_reasons[0]
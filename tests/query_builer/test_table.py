@@ -1,4 +1,8 @@
-from sommelier.query_builder.table import Table
+import warnings
+
+import pytest
+
+from sommelier.query_builder.table import GroupByTruncationWarning, Table
 from pypika import Order
 
 
@@ -244,9 +248,9 @@ def test_regex_like_criterion():
     """
     Ensure the right format is outputted for pql
     """
-    test_filter = {'model': [{'op': 'regex', 'value': '^B'}]}
+    test_filter = {'model': [{'op': 'regex', 'value': '^B7+'}]}
     criterion = get_fake_table().build_criterion_for_filter(test_filter)
-    assert str(criterion) == 'regexp_like(model, \'^B\')'
+    assert str(criterion) == 'regexp_like(model, \'^B7+\')'
 
 
 def test_regex_like_integration():
@@ -255,8 +259,119 @@ def test_regex_like_integration():
     """
     query = get_fake_table()
     query.select_all_columns() \
-        .add_custom_filter(get_fake_table().build_criterion_for_filter({'model': [{'op': 'regex', 'value': '^B'}]})) \
+        .add_custom_filter(get_fake_table().build_criterion_for_filter({'model': [{'op': 'regex', 'value': 'B7'}]})) \
         .filter_column_by_value('flight_number', 'UA111')
 
     sql_str = query.get_sql_query()
-    assert 'AND regexp_like(model, \'^B\')' in sql_str
+    assert 'AND regexp_like(model, \'B7\')' in sql_str
+
+
+@pytest.mark.parametrize('pattern, expected', (
+        ('^B777$', 'model=\'B777\''),
+        ('^(B777|A350)$', 'model IN (\'A350\',\'B777\')'),
+        ('^(?:B777|A350|B777)$', 'model IN (\'A350\',\'B777\')'),
+        ('^B7', 'model>=\'B7\' AND model<\'B8\''),
+        ('^B7.*', 'model>=\'B7\' AND model<\'B8\''),
+        ('^B\\.7', 'model>=\'B.7\' AND model<\'B.8\''),
+        ('B7', 'regexp_like(model, \'B7\')'),
+        ('^B\\d+$', 'regexp_like(model, \'^B\\d+$\')'),
+        ('^(B7|A3)', 'regexp_like(model, \'^(B7|A3)\')'),
+        ('^B7|A3$', 'regexp_like(model, \'^B7|A3$\')'),
+        ('(?i)^b7', 'regexp_like(model, \'(?i)^b7\')'),
+))
+def test_regex_optimization(pattern, expected):
+    """
+    Regex filters that are exact matches, alternations or prefixes use index friendly predicates
+    """
+    query = get_fake_table().select('airport').filter_column_by_value('model', pattern, operator='regex')
+    assert query.get_sql_query() == f'SELECT airport FROM fake_table WHERE {expected}'
+
+
+@pytest.mark.parametrize('pattern', ('^\\p{Lu}+', '\\Q.\\E', '^B\\Q(7\\E'))
+def test_regex_java_syntax(pattern):
+    """
+    Patterns only valid in Java's syntax, which Pinot uses, are kept as regexp_like
+    """
+    query = get_fake_table().select('airport').filter_column_by_value('model', pattern, operator='regex')
+    assert 'regexp_like(model' in query.get_sql_query()
+
+
+def test_regex_is_not_rewritten_on_non_string_columns():
+    query = Table(table_name='fake_table', columns={'price': int, 'model': str})
+    query.select('model').filter_column_by_value('price', '^12$', operator='regex')
+    assert query.get_sql_query() == 'SELECT model FROM fake_table WHERE regexp_like(price, \'^12$\')'
+
+
+@pytest.mark.parametrize('pattern', ('^B(7', 'B7^7', '^B7$7', '^\\p{Lu}(+', '[\\p{Lu}', '*B7'))
+def test_regex_invalid_or_never_matching(pattern):
+    with pytest.raises(ValueError):
+        get_fake_table().filter_column_by_value('model', pattern, operator='regex')
+
+    with pytest.raises(ValueError):
+        get_fake_table().build_criterion_for_filter({'model': [{'op': 'regex', 'value': pattern}]})
+
+
+def test_group_by_limit_from_cardinalities():
+    """
+    Without an explicit limit the group by limit is sized from the known cardinalities and capped
+    """
+    query = get_fake_table()
+    query.select('Count(*)').group_by('airport')
+    query.set_cardinalities({'airport': 300, 'model': 40})
+    assert query.get_sql_query().endswith('GROUP BY airport LIMIT 300')
+
+    query.group_by('model')
+    query.max_group_by_limit = 1000
+    assert query.get_sql_query().endswith('GROUP BY airport,model LIMIT 1000')
+    with pytest.warns(GroupByTruncationWarning):
+        query.warn_group_by_limit()
+
+    query.limit(5)
+    assert query.get_sql_query().endswith('LIMIT 5')
+
+
+def test_group_by_limit_warnings():
+    query = get_fake_table()
+    query.select('Count(*)').group_by('airport')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        # Compiling or printing the query is silent, the warnings are emitted when it is executed
+        assert 'LIMIT' not in query.get_sql_query()
+        repr(query)
+    with pytest.warns(GroupByTruncationWarning):
+        query.warn_group_by_limit()
+
+    query.order_by('Count(*)', order=Order.desc)
+    with pytest.warns(GroupByTruncationWarning):
+        query.warn_group_by_limit()
+
+    query.limit(10)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        query.warn_group_by_limit()
+
+
+def test_top_n():
+    query = get_fake_table()
+    query.group_by('airport')
+    query.top_n(3, 'COUNT(*)')
+    assert query.is_top_n()
+    assert query.get_sql_query() == 'SELECT COUNT(*) FROM fake_table GROUP BY airport ORDER BY COUNT(*) DESC LIMIT 3'
+
+    with pytest.raises(ValueError):
+        query.top_n(3, 'airport')
+
+
+def test_assign_table_name_and_columns():
+    query = get_fake_table()
+    other = get_fake_table()
+    assert query.definition is other.definition
+
+    query.table_name = 'renamed_table'
+    query.columns = {**query.columns, 'price': int}
+    query.select('airport').filter_column_by_value('price', '100', operator='>')
+
+    assert query.get_sql_query() == 'SELECT airport FROM renamed_table WHERE price>100'
+    assert other.table_name == 'fake_table'
+    assert 'price' not in other.columns
+    assert get_fake_table().definition is other.definition
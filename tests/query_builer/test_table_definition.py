@@ -0,0 +1,110 @@
+import pickle
+
+import pytest
+
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.table import Filter, Table
+from sommelier.query_builder.table_definition import MetricsTableDefinition, TableDefinition
+
+test_schema = {
+    'schemaName': 'flights',
+    'dimensionFieldSpecs': [
+        {'name': 'flightNumber', 'dataType': 'LONG'},
+        {'name': 'tags', 'dataType': 'STRING', 'singleValueField': False}
+    ],
+    'metricFieldSpecs': [{'name': 'price', 'dataType': 'DOUBLE'}],
+    'dateTimeFieldSpecs': [
+        {'name': 'millisSinceEpoch', 'dataType': 'LONG', 'format': '1:MILLISECONDS:EPOCH', 'granularity': '15:MINUTES'},
+        {'name': 'hoursSinceEpoch', 'dataType': 'INT', 'format': '1:HOURS:EPOCH', 'granularity': '1:HOURS'},
+        {'name': 'dateString', 'dataType': 'STRING', 'format': '1:DAYS:SIMPLE_DATE_FORMAT:yyyy-MM-dd',
+         'granularity': '1:DAYS'}
+    ]
+}
+
+
+def get_definition():
+    return MetricsTableDefinition.from_schema('flights', test_schema, table_configuration={
+        'tableIndexConfig': {
+            'invertedIndexColumns': ['flightNumber'],
+            'starTreeIndexConfigs': [{'dimensionsSplitOrder': ['flightNumber'], 'functionColumnPairs': ['SUM__price']}]
+        }
+    })
+
+
+def test_definition_from_schema():
+    definition = get_definition()
+    assert definition.table_name == 'flights'
+    assert set(definition.dimensions) == {'flightNumber', 'tags'}
+    assert set(definition.metrics) == {'price'}
+    assert set(definition.datetime_columns) == {'millisSinceEpoch', 'hoursSinceEpoch', 'dateString'}
+    assert definition.metrics_and_dimensions == {'flightNumber', 'tags', 'price'}
+    assert definition.columns['price'] == float
+    assert definition.statistics.get_column('flightNumber').indexes == {'inverted'}
+    assert len(definition.star_trees) == 1
+
+    with pytest.raises(TypeError):
+        definition.columns['new_column'] = int
+
+
+def test_queries_are_views_over_the_definition():
+    definition = get_definition()
+    query = MetricsTable.from_definition(definition)
+    other_query = MetricsTable.from_definition(definition)
+
+    assert query.definition is definition
+    assert query.columns is other_query.columns
+    assert query.dimensions is definition.dimensions
+    assert query.get_pypika_table() is other_query.get_pypika_table()
+    assert query.statistics is definition.statistics
+    assert query.star_trees is definition.star_trees
+
+    query.select('SUM(price)').filter_column_by_value('flightNumber', 12)
+    assert query.get_sql_query() == 'SELECT SUM(price) FROM flights WHERE flightNumber=12'
+    assert other_query.get_sql_query() == ''
+    assert query.shape_for_star_tree()[1].uses_star_tree
+
+
+def test_field_cache():
+    definition = TableDefinition('fake_table', {'airport': str})
+    assert definition.get_field('airport') is definition.get_field('airport')
+    assert definition.get_field('airport').table is definition.get_pypika_table()
+
+    query = Table.from_definition(definition).select('airport')
+    assert query.get_sql_query() == 'SELECT airport FROM fake_table'
+
+
+def test_constructor_shares_definitions():
+    columns = {'airport': str}
+    assert Table('fake_table', columns).definition is Table('fake_table', columns).definition
+    assert Table('fake_table', columns).definition is not Table('other_table', columns).definition
+    assert Table('fake_table', columns).definition is Table('fake_table', {'airport': str}).definition
+
+    # A modified dict gets a new definition
+    columns['carrier'] = str
+    query = Table('fake_table', columns).select('airport').filter_column_by_value('carrier', 'UA')
+    assert query.get_sql_query() == 'SELECT airport FROM fake_table WHERE carrier=\'UA\''
+
+
+def test_metrics_table_public_attributes():
+    query = MetricsTable.from_definition(get_definition())
+    assert query.filters['tags'] == ()
+    query.filters['tags'] += (Filter('==', 'x'),)
+    assert list(query.iter_filters()) == [('tags', '==', 'x')]
+
+    other = MetricsTable.from_definition(query.definition)
+    query.dimensions = {**query.dimensions, 'carrier': str}
+    assert 'carrier' in query.columns
+    assert 'carrier' not in other.columns
+    assert query.filter_column_by_value('carrier', 'UA').filters['carrier'] == (Filter('==', 'UA'),)
+    assert query.definition.statistics is other.definition.statistics
+
+
+def test_pickle_query():
+    query = MetricsTable.from_definition(get_definition()).select('SUM(price)').filter_column_by_value('tags', 'x')
+    unpickled = pickle.loads(pickle.dumps(query))
+
+    assert unpickled.get_sql_query() == query.get_sql_query()
+    assert unpickled.definition.metrics_and_dimensions == query.definition.metrics_and_dimensions
+    assert unpickled.statistics is unpickled.definition.statistics
+    assert unpickled.cardinalities is unpickled.definition.cardinalities
+    assert len(unpickled.star_trees) == 1
@@ -0,0 +1,91 @@
+import pytest
+
+from sommelier.broker import BrokerError, GroupByTruncatedError, execute_query, execute_sql
+from sommelier.query_builder.table import GroupByTruncationWarning, Table
+
+
+def get_group_by_query():
+    return Table(table_name='fake_table', columns={'airport': str, 'model': str}) \
+        .select('Count(*)') \
+        .group_by('airport') \
+        .set_cardinalities({'airport': 2})
+
+
+def fake_executor(row_counts, num_groups_limit_reached=False):
+    sent = []
+
+    def executor(sql):
+        sent.append(sql)
+        row_count = row_counts[len(sent) - 1]
+        return {
+            'resultTable': {
+                'dataSchema': {'columnNames': ['airport', 'count(*)'], 'columnDataTypes': ['STRING', 'LONG']},
+                'rows': [[f'airport_{index}', 1] for index in range(row_count)]
+            },
+            'exceptions': [],
+            'numGroupsLimitReached': num_groups_limit_reached
+        }
+
+    return executor, sent
+
+
+def test_execute_sql():
+    executor, sent = fake_executor([3])
+    response = execute_sql('SELECT airport, COUNT(*) FROM fake_table GROUP BY airport', executor)
+    assert len(response) == 3
+    assert response.column_index('count(*)') == 1
+    assert response.to_dicts()[0] == {'airport': 'airport_0', 'count(*)': 1}
+
+    with pytest.raises(KeyError):
+        response.column_index('model')
+
+    with pytest.raises(BrokerError):
+        execute_sql('SELECT', lambda sql: {'exceptions': [{'errorCode': 150, 'message': 'bad'}]})
+
+
+def test_group_by_truncation_raises():
+    executor, _ = fake_executor([2])
+    with pytest.raises(GroupByTruncatedError):
+        execute_query(get_group_by_query(), executor)
+
+    executor, _ = fake_executor([1])
+    assert len(execute_query(get_group_by_query(), executor)) == 1
+
+    executor, _ = fake_executor([1], num_groups_limit_reached=True)
+    with pytest.raises(GroupByTruncatedError):
+        execute_query(get_group_by_query(), executor)
+
+
+def test_group_by_truncation_retry():
+    executor, sent = fake_executor([2, 5])
+    response = execute_query(get_group_by_query(), executor, on_truncation='retry')
+    assert len(response) == 5
+    assert sent[0].endswith('LIMIT 2')
+    assert sent[1].endswith('LIMIT 20')
+
+    query = get_group_by_query()
+    query.max_group_by_limit = 20
+    executor, sent = fake_executor([2, 20])
+    with pytest.raises(GroupByTruncatedError):
+        execute_query(query, executor, on_truncation='retry')
+
+
+def test_explicit_limit_is_not_truncation():
+    executor, sent = fake_executor([4])
+    query = get_group_by_query().limit(4)
+    assert len(execute_query(query, executor)) == 4
+    assert len(sent) == 1
+
+
+def test_default_limit_truncation_warns_and_raises():
+    query = Table(table_name='fake_table', columns={'airport': str}).select('Count(*)').group_by('airport')
+    executor, sent = fake_executor([10])
+    with pytest.warns(GroupByTruncationWarning), pytest.raises(GroupByTruncatedError):
+        execute_query(query, executor)
+    assert 'LIMIT' not in sent[0]
+
+
+def test_top_n_is_not_truncation():
+    executor, _ = fake_executor([3])
+    query = get_group_by_query().top_n(3, 'Count(*)')
+    assert len(execute_query(query, executor)) == 3
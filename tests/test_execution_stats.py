@@ -0,0 +1,70 @@
+from sommelier.broker import execute_query
+from sommelier.execution_stats import ExecutionStats, ExecutionStatsRecorder, percentile
+from sommelier.query_builder.table import Table
+
+
+def get_stats(time_used_ms=10, entries_scanned_in_filter=0, pruned_by_server=9, groups_limit_reached=False):
+    return {
+        'timeUsedMs': time_used_ms,
+        'numDocsScanned': 100,
+        'totalDocs': 1000,
+        'numEntriesScannedInFilter': entries_scanned_in_filter,
+        'numEntriesScannedPostFilter': 200,
+        'numSegmentsQueried': 10,
+        'numSegmentsProcessed': 1,
+        'numSegmentsMatched': 1,
+        'numSegmentsPrunedByServer': pruned_by_server,
+        'numGroupsLimitReached': groups_limit_reached
+    }
+
+
+def get_query(airport='SFO'):
+    return Table(table_name='fake_table', columns={'airport': str, 'model': str}) \
+        .select('model') \
+        .filter_column_by_value('airport', airport)
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+def test_execution_stats():
+    stats = ExecutionStats(get_stats(entries_scanned_in_filter=500))
+    assert stats.num_segments_pruned == 9
+    assert stats.filter_scan_ratio == 0.5
+    assert stats.pruned_ratio == 0.9
+    assert stats.get_flags() == ['missing_index']
+
+    stats = ExecutionStats(get_stats(pruned_by_server=0, groups_limit_reached=True))
+    assert stats.get_flags() == ['groups_limit_reached']
+    assert stats.get_flags(has_time_filter=True) == ['time_pruning_failed', 'groups_limit_reached']
+
+
+def test_fingerprint_ignores_values():
+    assert get_query('SFO').get_fingerprint() == get_query('LAX').get_fingerprint()
+    assert get_query().get_fingerprint() != get_query().filter_column_by_value('model', 'B777').get_fingerprint()
+    assert get_query().get_fingerprint() != get_query().limit(5).get_fingerprint()
+
+
+def test_recorder_aggregates_per_fingerprint():
+    recorder = ExecutionStatsRecorder(window=50)
+    for time_used_ms in range(1, 101):
+        response = get_stats(time_used_ms=time_used_ms, entries_scanned_in_filter=900)
+        result = execute_query(get_query(), lambda sql: response, recorder=recorder)
+        assert result.stats.time_used_ms == time_used_ms
+        assert result.flags == ['missing_index']
+
+    execute_query(get_query().limit(1), lambda sql: get_stats(), recorder=recorder)
+
+    summary = recorder.summary(get_query().get_fingerprint())
+    assert summary.count == 50
+    assert summary.p50_ms == 75
+    assert summary.p99_ms == 100
+    assert summary.filter_scan_ratio == 0.9
+    assert summary.flags == ['missing_index']
+
+    assert len(recorder.fingerprints()) == 2
+    assert [flagged.fingerprint for flagged in recorder.flagged()] == [get_query().get_fingerprint()]
+    assert recorder.summary('unknown') is None
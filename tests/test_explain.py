@@ -0,0 +1,95 @@
+import pytest
+
+from sommelier.broker import BrokerError, execute_query
+from sommelier.explain import (ExplainPlan, FullScanError, RecordedPlans, check_index_usage, explain_query,
+                               parse_operator)
+from sommelier.local_engine import LocalEngine, LocalTable
+from sommelier.query_builder.metrics_table import MetricsTable
+
+PLAN = [
+    ['BROKER_REDUCE(limit:10)', 1, 0],
+    ['COMBINE_AGGREGATE', 2, 1],
+    ['PLAN_START(numSegmentsForThisPlan:3)', -1, -1],
+    ['AGGREGATE(aggregations:sum(price))', 3, 2],
+    ['TRANSFORM_PASSTHROUGH(price)', 4, 3],
+    ['PROJECT(price)', 5, 4],
+    ['DOC_ID_SET', 6, 5],
+    ['FILTER_AND', 7, 6],
+    ['FILTER_INVERTED_INDEX(indexLookUp:inverted_index,operator:IN,predicate:airport IN (\'SFO\',\'JFK\'))', 8, 7],
+    ['FILTER_RANGE_INDEX(indexLookUp:range_index,operator:RANGE,predicate:price > \'10\')', 9, 7],
+    ['FILTER_FULL_SCAN(operator:REGEXP_LIKE,predicate:regexp_like(model,\'^A\'))', 10, 7],
+    ['PLAN_START(numSegmentsForThisPlan:1)', -1, -1],
+    ['FILTER_EMPTY', 11, 2],
+]
+
+
+def get_query():
+    return MetricsTable(
+        table_name='flights',
+        dimension_columns={'airport': str, 'model': str},
+        metrics_columns={'price': int},
+        datetime_columns={}) \
+        .select('SUM(price)') \
+        .filter_column_by_value('airport', ['SFO', 'JFK'], operator='in') \
+        .filter_column_by_value('price', 10, operator='>') \
+        .filter_column_by_value('model', '^A', operator='regex')
+
+
+def get_plans(rows=PLAN):
+    return RecordedPlans({get_query().get_sql_query(): rows})
+
+
+def test_parse_operator():
+    name, attributes = parse_operator(PLAN[8][0])
+    assert name == 'FILTER_INVERTED_INDEX'
+    assert attributes == {'indexLookUp': 'inverted_index', 'operator': 'IN', 'predicate': 'airport IN (\'SFO\',\'JFK\')'}
+    assert parse_operator('DOC_ID_SET') == ('DOC_ID_SET', {})
+
+
+def test_plan_tree():
+    plan = ExplainPlan('SELECT ...', PLAN)
+    assert [root.name for root in plan.roots] == ['BROKER_REDUCE']
+    assert len(plan.plan_starts) == 2
+    assert [child.name for child in plan.find('FILTER_AND')[0].children] == \
+        ['FILTER_INVERTED_INDEX', 'FILTER_RANGE_INDEX', 'FILTER_FULL_SCAN']
+    assert [node.name for node in plan.roots[0].walk()][:3] == ['BROKER_REDUCE', 'COMBINE_AGGREGATE', 'AGGREGATE']
+    assert plan.format().splitlines()[2] == '    AGGREGATE(aggregations:sum(price))'
+
+
+def test_index_usage():
+    query = get_query()
+    plan = explain_query(query, get_plans())
+    assert plan.sql == query.get_sql_query()
+
+    report = plan.get_index_usage()
+    assert report.by_column() == {'airport': ['inverted'], 'price': ['range'], 'model': [None]}
+    assert [usage.column for usage in report.full_scans] == ['model']
+    assert not report.uses_star_tree
+    assert report.for_filters(query)[0] == {'column': 'airport', 'operator': 'in', 'value': ['SFO', 'JFK'],
+                                            'indexes': ['inverted']}
+
+
+def test_full_scan_gate():
+    with pytest.raises(FullScanError, match='regexp_like'):
+        check_index_usage(get_query(), get_plans())
+    assert check_index_usage(get_query(), get_plans(), allow_full_scan=['model']).has_full_scan
+
+
+def test_recorded_plans(tmp_path):
+    path = str(tmp_path / 'plans.json')
+    get_plans().save(path)
+
+    engine = LocalEngine([LocalTable.from_rows('flights', ['airport', 'model', 'price'], [['SFO', 'A320', 20]])])
+    plans = RecordedPlans.load(path, fallback=engine)
+    assert get_query().get_sql_query() in plans
+    assert explain_query(get_query(), plans).get_index_usage().by_column()['price'] == ['range']
+    assert execute_query(get_query(), plans).rows == [[20]]
+
+    with pytest.raises(BrokerError, match='No recorded plan'):
+        explain_query(get_query().filter_column_by_value('price', 5, operator='<'), plans)
+
+
+def test_record_plans():
+    plans = get_plans()
+    recorded = RecordedPlans.record(plans, [get_query().get_sql_query()])
+    assert recorded.plans == plans.plans
@@ -0,0 +1,145 @@
+import time
+
+import pytest
+from pypika import Order
+
+from sommelier.broker import GroupByTruncatedError
+from sommelier.fan_out import (UnmergeableAggregationError, check_mergeable, compile_for_tables, fan_out,
+                               fan_out_hybrid, get_hybrid_table_names, merge_rows)
+from sommelier.query_builder.date_types import DateField
+from sommelier.query_builder.table import Table
+
+ROWS = {
+    'flights_OFFLINE': [['SFO', 10, 3, 1], ['JFK', 5, 1, 2]],
+    'flights_REALTIME': [['SFO', 4, 2, 0], ['LAX', 7, 1, 9]],
+}
+
+
+def get_query():
+    return Table(table_name='flights', columns={'airport': str, 'price': int}) \
+        .select('airport').select('SUM(price)').select('COUNT(*)').select('MIN(price)') \
+        .filter_column_by_value('airport', 'flights') \
+        .group_by('airport') \
+        .order_by('SUM(price)', order=Order.desc) \
+        .limit(2)
+
+
+def fake_executor(delay=0.0, num_groups_limit_reached=False):
+    sent = []
+
+    def executor(sql):
+        sent.append(sql)
+        time.sleep(delay)
+        table_name = sql.split(' FROM ')[1].split(' ')[0]
+        return {
+            'resultTable': {
+                'dataSchema': {'columnNames': ['airport', 'sum(price)', 'count(*)', 'min(price)'],
+                               'columnDataTypes': ['STRING', 'DOUBLE', 'LONG', 'DOUBLE']},
+                'rows': ROWS[table_name]
+            },
+            'numDocsScanned': 10,
+            'timeUsedMs': 5,
+            'numGroupsLimitReached': num_groups_limit_reached
+        }
+
+    return executor, sent
+
+
+def test_compile_for_tables():
+    sql = compile_for_tables(get_query(), get_hybrid_table_names('flights'))
+
+    # Only the table name is swapped, filter values equal to the table name are left alone
+    assert sql['flights_REALTIME'] == ("SELECT COUNT(*),MIN(price),SUM(price),airport FROM flights_REALTIME "
+                                       "WHERE airport='flights' GROUP BY airport ORDER BY SUM(price) DESC LIMIT 2")
+    assert sql['flights_OFFLINE'] == sql['flights_REALTIME'].replace('flights_REALTIME', 'flights_OFFLINE')
+
+
+def test_fan_out():
+    executor, sent = fake_executor(delay=0.2)
+    start = time.perf_counter()
+    response = fan_out(get_query(), get_hybrid_table_names('flights'), executor)
+
+    assert time.perf_counter() - start < 0.35
+    assert len(sent) == 2
+    assert response.rows == [['SFO', 14, 5, 0], ['LAX', 7, 1, 9]]
+    assert response.stats.num_docs_scanned == 20
+    assert response.stats.time_used_ms == 5
+    assert set(response.responses) == {'flights_OFFLINE', 'flights_REALTIME'}
+
+    executor, _ = fake_executor(num_groups_limit_reached=True)
+    with pytest.raises(GroupByTruncatedError):
+        fan_out(get_query(), get_hybrid_table_names('flights'), executor)
+
+
+def test_unmergeable_aggregations():
+    executor, sent = fake_executor()
+    with pytest.raises(UnmergeableAggregationError):
+        fan_out(get_query().select('AVG(price)'), get_hybrid_table_names('flights'), executor)
+    assert not sent
+
+    with pytest.raises(UnmergeableAggregationError):
+        merge_rows(['airport', 'distinctcount(model)'], [[['SFO', 1]]])
+
+    assert merge_rows(['airport', 'price'], [[['SFO', 1]], [['SFO', 1]]]) == [['SFO', 1], ['SFO', 1]]
+
+
+def test_fan_out_hybrid():
+    executor, sent = fake_executor()
+    query = Table(table_name='flights', columns={'airport': str, 'price': int, 'day': int}) \
+        .select('airport').select('SUM(price)').select('COUNT(*)').select('MIN(price)') \
+        .group_by('airport') \
+        .limit(5)
+    response = fan_out_hybrid(query, executor, time_boundary=20200101, time_column='day')
+
+    assert sorted(sent) == [
+        'SELECT COUNT(*),MIN(price),SUM(price),airport FROM flights_OFFLINE WHERE day<=20200101 GROUP BY airport '
+        'LIMIT 5',
+        'SELECT COUNT(*),MIN(price),SUM(price),airport FROM flights_REALTIME WHERE day>20200101 GROUP BY airport '
+        'LIMIT 5',
+    ]
+    assert len(response.rows) == 3
+    assert 'day' not in query.filters
+
+    with pytest.raises(ValueError):
+        fan_out_hybrid(query, executor, time_boundary=20200101)
+
+
+def test_fan_out_implicit_limit_truncation():
+    executor, _ = fake_executor()
+    query = Table(table_name='flights', columns={'airport': str, 'price': int}) \
+        .select('airport').select('SUM(price)').select('COUNT(*)').select('MIN(price)') \
+        .group_by('airport') \
+        .set_cardinalities({'airport': 2})
+    # Each table returns 2 groups, the limit sized from the cardinalities
+    with pytest.raises(GroupByTruncatedError):
+        fan_out(query, ['flights_OFFLINE', 'flights_REALTIME'], executor)
+
+    # Explicit limits are intentional
+    assert len(fan_out(query.limit(2), ['flights_OFFLINE', 'flights_REALTIME'], executor).rows) == 2
+
+
+def test_sort_nulls():
+    global ROWS
+    executor, _ = fake_executor()
+    rows = ROWS
+    try:
+        ROWS = {'a': [['SFO', None, 1, 1], ['JFK', 5, 1, 1]], 'b': [['LAX', 7, 1, 1]]}
+        response = fan_out(get_query().limit(3), ['a', 'b'], executor)
+        assert [row[0] for row in response.rows] == ['SFO', 'LAX', 'JFK']
+        response = fan_out(get_query().limit(3).order_by('SUM(price)', order=Order.asc), ['a', 'b'], executor)
+        assert [row[0] for row in response.rows] == ['JFK', 'LAX', 'SFO']
+    finally:
+        ROWS = rows
+
+
+def test_time_buckets_are_group_keys():
+    day = DateField('ms', int, '1:MILLISECONDS:EPOCH', '1:MILLISECONDS') \
+        .get_convert_clause('1:DAYS:SIMPLE_DATE_FORMAT:yyyy-MM-dd', granularity='1:DAYS')
+    query = Table(table_name='flights', columns={'ms': int, 'price': int}) \
+        .select(day).select('SUM(price)').group_by(day).limit(10)
+    check_mergeable(query)
+
+    day_column = day.lower().replace(' ', '')
+    rows = merge_rows([day_column, 'sum(price)'],
+                      [[['2020-01-01', 10], ['2020-01-02', 5]], [['2020-01-01', 4]]])
+    assert rows == [['2020-01-01', 14], ['2020-01-02', 5]]
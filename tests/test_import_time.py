@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+BUILD_QUERY = '''
+import sys
+from sommelier.query_builder.metrics_table import MetricsTable
+query = MetricsTable(
+    table_name='flights',
+    dimension_columns={'airport': str},
+    metrics_columns={'price': int},
+    datetime_columns={},
+).select_columns(['airport', 'SUM(price)']).filter_column_by_value('airport', 'SFO').group_by('airport').limit(5)
+query.get_fingerprint()
+print('pypika' in sys.modules, 'sommelier.query_builder.functions' in sys.modules)
+query.get_sql_query()
+print('pypika' in sys.modules)
+'''
+
+# Modules only imported when a query is compiled, its cost estimated or shaped for a star-tree
+LAZY_MODULES = (
+    'pypika',
+    'sommelier.query_builder.cost',
+    'sommelier.query_builder.fields',
+    'sommelier.query_builder.functions',
+    'sommelier.query_builder.star_tree',
+)
+
+IMPORTED_MODULES = '''
+import sys
+import sommelier
+from sommelier.query_builder.metrics_table import MetricsTable
+MetricsTable(
+    table_name='flights',
+    dimension_columns={'airport': str, 'model': str},
+    metrics_columns={'price': int},
+    datetime_columns={},
+).select_columns(['airport', 'SUM(price)']).filter_column_by_value('model', '^B7', 'regex').group_by('airport')
+print(' '.join(sorted(sys.modules)))
+'''
+
+
+def run_in_fresh_interpreter(code: str) -> str:
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    return subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                          env=environment).stdout
+
+
+def test_pypika_is_imported_on_first_compile():
+    before_compile, after_compile = run_in_fresh_interpreter(BUILD_QUERY).splitlines()
+    assert before_compile == 'False False'
+    assert after_compile == 'True'
+
+
+def test_lazy_modules_are_not_imported_to_build_queries():
+    modules = run_in_fresh_interpreter(IMPORTED_MODULES).split()
+    assert 'sommelier.query_builder.metrics_table' in modules
+    assert [module for module in modules if module.split('.')[0] == 'pypika'] == []
+    assert [module for module in modules if module.startswith(LAZY_MODULES[1:])] == []
@@ -0,0 +1,191 @@
+import pytest
+from pypika import Order
+
+from sommelier.broker import BrokerError, execute_query
+from sommelier.local_engine import LocalEngine, LocalTable
+from sommelier.query_builder.date_types import DateField
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.spill import ColumnarSpillWriter
+
+COLUMNS = ['airport', 'flight_number', 'model', 'price', 'ms']
+DAY = 86400000
+ROWS = [
+    ['SFO', 'UA100', 'B777', 300, 1577836800000],
+    ['SFO', 'UA101', 'A320', 100, 1577836800000 + 3600000],
+    ['JFK', 'AA200', 'B777', 500, 1577836800000 + DAY],
+    ['JFK', 'UA102', 'A320', 200, 1577836800000 + DAY],
+    ['LAX', 'DL300', 'B737', 50, 1577836800000 + 2 * DAY],
+]
+
+
+def get_query():
+    return MetricsTable(
+        table_name='flights',
+        dimension_columns={'airport': str, 'flight_number': str, 'model': str},
+        metrics_columns={'price': int},
+        datetime_columns={'ms': DateField('ms', int, '1:MILLISECONDS:EPOCH', '1:MILLISECONDS')})
+
+
+def get_engine():
+    return LocalEngine([LocalTable.from_rows('flights', COLUMNS, ROWS)])
+
+
+def test_selection():
+    engine = get_engine()
+    query = get_query().select('flight_number').select('price') \
+        .filter_column_by_value('airport', ['SFO', 'JFK'], operator='in') \
+        .filter_column_by_value('price', 100, operator='>') \
+        .order_by('price', order=Order.desc) \
+        .limit(2)
+    response = execute_query(query, engine)
+
+    assert response.column_names == ['flight_number', 'price']
+    assert response.column_types == ['STRING', 'LONG']
+    assert response.rows == [['AA200', 500], ['UA100', 300]]
+    assert response.stats.num_docs_scanned == 3
+    assert response.stats.total_docs == 5
+
+    # Like Pinot, at most 10 rows without a limit
+    response = execute_query(get_query().select_all_columns(), engine)
+    assert len(response) == 5
+    assert response.column_names == COLUMNS
+
+
+def test_filters():
+    engine = get_engine()
+
+    def flight_numbers(query):
+        return sorted(row[0] for row in execute_query(query.select('flight_number').limit(100), engine).rows)
+
+    assert flight_numbers(get_query().filter_column_by_value('flight_number', '^UA10', operator='regex')) == \
+        ['UA100', 'UA101', 'UA102']
+    assert flight_numbers(get_query().filter_column_by_value('flight_number', '0[12]', operator='regex')) == \
+        ['UA101', 'UA102']
+    assert flight_numbers(get_query().filter_column_by_value('model', ['B777', 'A320'], operator='notin')) == \
+        ['DL300']
+    assert flight_numbers(get_query().filter_column_by_value('price', [100, 300], operator='between')
+                          .filter_column_by_value('airport', 'LAX', operator='!=')) == ['UA100', 'UA101', 'UA102']
+
+    query = get_query()
+    table = query.get_pypika_table()
+    query.add_custom_filter((table.airport == 'LAX') | ((table.airport == 'JFK') & (table.model == 'A320')))
+    assert flight_numbers(query) == ['DL300', 'UA102']
+
+
+def test_aggregations():
+    engine = get_engine()
+    query = get_query().select('airport').select('SUM(price)').select('COUNT(*)').select('DISTINCTCOUNT(model)') \
+        .select('PERCENTILE50(price)') \
+        .group_by('airport') \
+        .top_n(2, 'SUM(price)')
+    response = execute_query(query, engine)
+
+    assert response.column_names == ['count(*)', 'distinctcount(model)', 'percentile50(price)', 'sum(price)', 'airport']
+    assert response.column_types == ['LONG', 'INT', 'DOUBLE', 'DOUBLE', 'STRING']
+    assert response.rows == [[2, 2, 200, 700.0, 'JFK'], [2, 2, 100, 400.0, 'SFO']]
+
+    response = execute_query(get_query().select('MIN(price)').select('MAX(price)').select('AVG(price)'), engine)
+    assert response.rows == [[230.0, 500.0, 50.0]]
+
+
+def test_datetimeconvert():
+    engine = get_engine()
+    day = "DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', '1:DAYS:SIMPLE_DATE_FORMAT:yyyy-MM-dd', '1:DAYS')"
+    query = get_query().select(day).select('COUNT(*)').group_by(day).order_by(day).limit(10)
+
+    assert execute_query(query, engine).rows == [[2, '2020-01-01'], [2, '2020-01-02'], [1, '2020-01-03']]
+
+    hours = engine("SELECT DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', '1:HOURS:EPOCH', '1:HOURS') AS hour, COUNT(*) "
+                   "FROM flights GROUP BY DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', '1:HOURS:EPOCH', '1:HOURS') "
+                   "ORDER BY hour LIMIT 2")
+    assert hours['resultTable']['dataSchema']['columnNames'] == ['hour', 'count(*)']
+    assert hours['resultTable']['rows'] == [[438288, 1], [438289, 1]]
+
+
+def test_spilled_table(tmp_path):
+    writer = ColumnarSpillWriter(COLUMNS, [str, str, str, int, int], directory=str(tmp_path))
+    writer.extend(ROWS)
+    with writer.finish() as spilled:
+        engine = LocalEngine([LocalTable.from_spill('flights', spilled)])
+        response = execute_query(get_query().select('SUM(price)').filter_column_by_value('model', 'B777'), engine)
+        assert response.rows == [[800.0]]
+
+
+def test_errors():
+    engine = get_engine()
+    with pytest.raises(BrokerError, match='does not exist'):
+        execute_query(get_query().select('price'), LocalEngine())
+    with pytest.raises(BrokerError, match='position'):
+        execute_query(get_query().select('price').filter_column_by_value('price', 1), lambda sql: engine(sql + ' #'))
+    with pytest.raises(BrokerError, match='GROUP BY'):
+        execute_query(get_query().select('model').select('COUNT(*)').group_by('airport').limit(10), engine)
+
+
+def test_nulls():
+    rows = ROWS + [['LAX', 'DL301', None, None, 1577836800000 + 2 * DAY]]
+    engine = LocalEngine([LocalTable.from_rows('flights', COLUMNS, rows)])
+
+    def flight_numbers(where):
+        response = engine(f'SELECT flight_number FROM flights WHERE {where} LIMIT 100')
+        return sorted(row[0] for row in response['resultTable']['rows'])
+
+    # A comparison with a null is neither true nor false
+    assert flight_numbers('price > 100') == ['AA200', 'UA100', 'UA102']
+    assert flight_numbers('NOT price > 100') == ['DL300', 'UA101']
+    assert flight_numbers("NOT (model = 'B777' OR price < 100)") == ['UA101', 'UA102']
+    assert flight_numbers("model NOT IN ('B777', 'A320')") == ['DL300']
+    assert flight_numbers('price NOT BETWEEN 100 AND 300') == ['AA200', 'DL300']
+    assert flight_numbers("price = NULL") == []
+
+    response = engine('SELECT airport, COUNT(*), COUNT(price), SUM(price), MIN(price) FROM flights '
+                      "WHERE airport = 'LAX' GROUP BY airport LIMIT 10")
+    assert response['resultTable']['rows'] == [['LAX', 2, 1, 50.0, 50.0]]
+
+    response = engine('SELECT flight_number, price FROM flights ORDER BY price LIMIT 2, 10')
+    assert [row[0] for row in response['resultTable']['rows']] == ['UA102', 'UA100', 'AA200', 'DL301']
+    response = engine('SELECT flight_number, price FROM flights ORDER BY price DESC LIMIT 2')
+    assert response['resultTable']['rows'] == [['DL301', None], ['AA200', 500]]
+
+
+def test_json_functions():
+    documents = [
+        '{"airport": {"code": "SFO"}, "gates": [1, 2], "delayed": true}',
+        '{"airport": {"code": "JFK"}, "gates": [3]}',
+        '{"airport": {"code": "SFO"}, "gates": [], "delayed": false}',
+        None,
+    ]
+    engine = LocalEngine([LocalTable('flights', {'flight_number': ['UA100', 'AA200', 'UA101', 'DL300'],
+                                                 'info': documents})])
+
+    def flight_numbers(where):
+        response = engine(f'SELECT flight_number FROM flights WHERE {where} LIMIT 100')
+        assert not response['exceptions'], response['exceptions']
+        return sorted(row[0] for row in response['resultTable']['rows'])
+
+    assert flight_numbers("JSON_MATCH(info, '\"$.airport.code\"=''SFO''')") == ['UA100', 'UA101']
+    assert flight_numbers("JSON_MATCH(info, '\"$.airport.code\" NOT IN (''SFO'')')") == ['AA200']
+    assert flight_numbers("JSON_MATCH(info, '\"$.delayed\"=''true''')") == ['UA100']
+    assert flight_numbers("JSON_MATCH(info, '\"$.delayed\"!=''true''')") == ['UA101']
+    assert flight_numbers("JSON_MATCH(info, '\"$.gates[0]\" IN (1,3)')") == ['AA200', 'UA100']
+    assert flight_numbers("NOT JSON_MATCH(info, '\"$.airport.code\"=''SFO''')") == ['AA200']
+    assert flight_numbers("JSON_EXTRACT_SCALAR(info, '$.airport.code', 'STRING') = 'JFK'") == ['AA200']
+    assert flight_numbers("JSON_EXTRACT_SCALAR(info, '$.gates[0]', 'LONG', 0) < 2") == ['DL300', 'UA100', 'UA101']
+
+    response = engine("SELECT JSON_EXTRACT_SCALAR(info, '$.airport.code', 'STRING'), COUNT(*) FROM flights "
+                      "GROUP BY JSON_EXTRACT_SCALAR(info, '$.airport.code', 'STRING') "
+                      "ORDER BY JSON_EXTRACT_SCALAR(info, '$.airport.code', 'STRING') LIMIT 10")
+    assert response['resultTable']['rows'] == [['JFK', 1], ['SFO', 2], [None, 1]]
+
+    # Like Pinot, a missing path without a default value is an error
+    response = engine("SELECT flight_number FROM flights WHERE JSON_EXTRACT_SCALAR(info, '$.delayed', 'BOOLEAN') "
+                      "= TRUE")
+    assert 'Illegal JSON path' in response['exceptions'][0]['message']
+
+    for where, message in [
+        ("TEXT_MATCH(info, 'SFO')", 'TEXT_MATCH is unsupported'),
+        ("JSON_MATCH(info, '\"$.gates[*]\"=1')", 'Unsupported JSON path'),
+        ("JSON_MATCH(info, '\"$.gates[0]\">1')", 'Unsupported JSON_MATCH expression'),
+        ("JSON_EXTRACT_SCALAR(info, '$.gates', 'MAP') = 1", 'Unsupported JSON_EXTRACT_SCALAR result type'),
+    ]:
+        response = engine(f'SELECT flight_number FROM flights WHERE {where}')
+        assert message in response['exceptions'][0]['message']
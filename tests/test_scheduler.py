@@ -0,0 +1,110 @@
+from threading import Event
+
+import pytest
+
+from sommelier.execution_stats import ExecutionStats, ExecutionStatsRecorder
+from sommelier.query_builder.table import Table
+from sommelier.scheduler import (ON_DEADLINE_DOWNGRADE, PRIORITY_BATCH, PRIORITY_INTERACTIVE, DeadlineExceededError,
+                                 QueryScheduler, TokenBucket)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def get_query(column='airport'):
+    return Table(table_name='fake_table', columns={'airport': str, 'model': str}).select(column)
+
+
+def blocking_executor():
+    sent = []
+    release = Event()
+
+    def executor(sql):
+        sent.append(sql)
+        release.wait(5)
+        return {'resultTable': {'dataSchema': {'columnNames': ['airport']}, 'rows': [['SFO']]}, 'timeUsedMs': 3}
+
+    return executor, sent, release
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0
+
+
+def test_priorities():
+    executor, sent, release = blocking_executor()
+    with QueryScheduler(executor, workers=1) as scheduler:
+        first = scheduler.submit(get_query('model'))
+        while not sent:
+            pass
+        batch = scheduler.submit(get_query('COUNT(*)'), priority=PRIORITY_BATCH)
+        interactive = scheduler.submit(get_query(), priority=PRIORITY_INTERACTIVE)
+        release.set()
+
+        for future in (first, batch, interactive):
+            result = future.result(5)
+            assert len(result.response) == 1
+            assert result.queue_wait_seconds >= 0
+            assert result.execution_seconds >= 0
+
+    assert sent == ['SELECT model FROM fake_table', 'SELECT airport FROM fake_table',
+                    'SELECT COUNT(*) FROM fake_table']
+
+
+def test_rate_limited_tenant_does_not_block_others():
+    executor, sent, release = blocking_executor()
+    release.set()
+    clock = FakeClock()
+    rate_limits = {'reports': TokenBucket(rate=1, burst=1, clock=clock)}
+
+    with QueryScheduler(executor, rate_limits=rate_limits, workers=2) as scheduler:
+        scheduler.submit(get_query('model'), tenant='reports').result(5)
+        limited = scheduler.submit(get_query('COUNT(*)'), tenant='reports')
+        other = scheduler.submit(get_query(), tenant='dashboards')
+
+        assert other.result(5).response.rows == [['SFO']]
+        assert not limited.done()
+
+        clock.now += 1
+        assert limited.result(5)
+
+    assert sent[-1] == 'SELECT COUNT(*) FROM fake_table'
+
+
+def test_deadlines():
+    executor, sent, release = blocking_executor()
+    clock = FakeClock()
+    recorder = ExecutionStatsRecorder()
+    slow_query = get_query('DISTINCTCOUNT(model)')
+    recorder.record(slow_query, ExecutionStats({'timeUsedMs': 5000}))
+
+    with QueryScheduler(executor, workers=1, recorder=recorder, clock=clock) as scheduler:
+        scheduler.submit(get_query())
+        while not sent:
+            pass
+        expired = scheduler.submit(get_query('model'), timeout=1)
+        dropped = scheduler.submit(get_query('DISTINCTCOUNT(model)'), timeout=3)
+        downgraded = scheduler.submit(get_query('DISTINCTCOUNT(model)'), timeout=3, on_deadline=ON_DEADLINE_DOWNGRADE)
+        clock.now += 2
+        release.set()
+
+        with pytest.raises(DeadlineExceededError):
+            expired.result(5)
+        with pytest.raises(DeadlineExceededError, match='expected to take 5.000s'):
+            dropped.result(5)
+        assert downgraded.result(5).downgraded
+
+    assert sent == ['SELECT airport FROM fake_table', 'SELECT DISTINCTCOUNTHLL(model) FROM fake_table']
@@ -1,4 +1,5 @@
-from sommelier.schema_parser import get_table_information_from_schema
+from sommelier.schema_parser import (get_json_columns, get_multi_value_columns, get_table_information_from_schema,
+                                     get_table_statistics)
 
 test_schema = {
     'schemaName': 'flights',
@@ -53,3 +54,30 @@ def test_get_table_information_from_schema():
 
     assert metrics['price'] == float
     assert dimensions['flightNumber'] == int
+
+
+def test_get_multi_value_and_json_columns():
+    schema = dict(test_schema, dimensionFieldSpecs=[*test_schema['dimensionFieldSpecs'],
+                                                    {'name': 'details', 'dataType': 'JSON'}])
+    assert get_multi_value_columns(schema) == {'tags'}
+    assert get_json_columns(schema) == {'details'}
+    assert get_table_information_from_schema(schema)[0]['details'] == str
+
+
+def test_get_table_statistics():
+    statistics = get_table_statistics({
+        'totalDocs': 1000,
+        'rowsPerDay': 10,
+        'columns': {'flightNumber': {'cardinality': 300, 'indexes': ['inverted']}}
+    }, {
+        'tableIndexConfig': {'sortedColumn': ['flightNumber'], 'rangeIndexColumns': ['price']},
+        'fieldConfigList': [{'name': 'tags', 'encodingType': 'RAW', 'indexType': 'TEXT'}]
+    })
+
+    assert statistics.total_docs == 1000
+    assert statistics.rows_per_day == 10
+    assert statistics.get_column('flightNumber').cardinality == 300
+    assert statistics.get_column('flightNumber').indexes == {'inverted', 'sorted'}
+    assert statistics.get_column('price').indexes == {'range'}
+    assert statistics.get_column('tags').indexes == {'text'}
+    assert statistics.get_column('missing').cardinality is None
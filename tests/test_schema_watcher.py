@@ -0,0 +1,147 @@
+import copy
+
+from sommelier.fan_out import get_sql_template
+from sommelier.query_builder.metrics_table import MetricsTable
+from sommelier.query_builder.query_cache import ColumnDependentCache, get_cached_sql, get_query_columns
+from sommelier.query_builder.spec import get_cache_key
+from sommelier.query_builder.table_definition import MetricsTableDefinition
+from sommelier.schema_watcher import SchemaWatcher, diff_schema
+
+test_schema = {
+    'schemaName': 'flights',
+    'dimensionFieldSpecs': [
+        {'name': 'airport', 'dataType': 'STRING'},
+        {'name': 'model', 'dataType': 'STRING'},
+        {'name': 'gate', 'dataType': 'INT'},
+    ],
+    'metricFieldSpecs': [{'name': 'price', 'dataType': 'DOUBLE'}],
+    'dateTimeFieldSpecs': [
+        {'name': 'ms', 'dataType': 'LONG', 'format': '1:MILLISECONDS:EPOCH', 'granularity': '1:HOURS'},
+    ]
+}
+
+
+def get_evolved_schema():
+    schema = copy.deepcopy(test_schema)
+    schema['dimensionFieldSpecs'] = [
+        {'name': 'airport', 'dataType': 'STRING'},
+        {'name': 'gate', 'dataType': 'STRING'},
+    ]
+    schema['metricFieldSpecs'].append({'name': 'distance', 'dataType': 'LONG'})
+    return schema
+
+
+def test_diff_schema():
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    assert not diff_schema(definition, test_schema)
+
+    diff = diff_schema(definition, get_evolved_schema())
+    assert diff.added == {'distance'}
+    assert diff.removed == {'model'}
+    assert diff.changed == {'gate'}
+    assert diff.affected == {'model', 'gate'}
+
+
+def test_query_columns():
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    query = MetricsTable.from_definition(definition).select('SUM(price)').group_by('airport') \
+        .filter_column_by_value('gate', 3)
+    assert get_query_columns(query) == {'price', 'airport', 'gate'}
+    assert get_query_columns(MetricsTable.from_definition(definition).select_all_columns()) == {'*'}
+
+
+def test_schema_watcher_updates_the_definition_and_invalidates_caches():
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    schemas = [test_schema]
+    sql_cache = ColumnDependentCache()
+    template_cache = ColumnDependentCache()
+    watcher = SchemaWatcher(definition, lambda: schemas[-1], caches=[sql_cache, template_cache])
+    diffs = []
+    watcher.add_listener(diffs.append)
+
+    def get_query():
+        return MetricsTable.from_definition(definition)
+
+    by_airport = get_query().select('SUM(price)').group_by('airport')
+    by_model = get_query().select('SUM(price)').group_by('model')
+    by_gate = get_query().select('COUNT(*)').filter_column_by_value('gate', 3)
+    everything = get_query().select_all_dimensions().select_all_metrics()
+    for query in (by_airport, by_model, by_gate, everything):
+        get_cached_sql(query, sql_cache)
+    template = get_sql_template(by_airport, template_cache)
+    get_sql_template(by_model, template_cache)
+    coerce_gate = definition.get_coercer('gate')
+    coerce_airport = definition.get_coercer('airport')
+
+    assert not watcher.refresh()
+    assert len(sql_cache) == 4
+
+    schemas.append(get_evolved_schema())
+    diff = watcher.refresh()
+    assert diffs == [diff]
+
+    # Only the entries of the unchanged columns stay warm, and the lookups of their queries hit them
+    assert len(sql_cache) == 1
+    assert ('sql', get_cache_key(by_airport)) in sql_cache
+    assert get_cached_sql(by_airport, sql_cache) == 'SELECT SUM(price) FROM flights GROUP BY airport'
+    assert len(sql_cache) == 1
+    assert ('template', get_cache_key(by_airport)) in template_cache
+    assert get_sql_template(by_airport, template_cache) is template
+    assert len(template_cache) == 1
+
+    # Existing queries see the new columns
+    assert 'distance' in by_airport.metrics
+    assert 'model' not in by_airport.columns
+    assert definition.get_coercer('airport') is coerce_airport
+    assert definition.get_coercer('gate') is not coerce_gate
+    assert get_query().filter_column_by_value('gate', 3).filters['gate'][0].value == '3'
+
+
+def test_added_columns_keep_the_cache_keys():
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    schema = copy.deepcopy(test_schema)
+    schema['metricFieldSpecs'].append({'name': 'distance', 'dataType': 'LONG'})
+    sql_cache = ColumnDependentCache()
+    watcher = SchemaWatcher(definition, lambda: schema, caches=[sql_cache])
+
+    by_airport = MetricsTable.from_definition(definition).select('SUM(price)').group_by('airport')
+    everything = MetricsTable.from_definition(definition).select_all_columns()
+    key = get_cache_key(by_airport)
+    sql = get_cached_sql(by_airport, sql_cache)
+    get_cached_sql(everything, sql_cache)
+
+    assert watcher.refresh().added == {'distance'}
+    # Only the "SELECT *" entry depends on the added column
+    assert get_cache_key(by_airport) == key
+    assert list(sql_cache._entries) == [('sql', key)]
+    assert get_cached_sql(by_airport, sql_cache) is sql
+    assert len(sql_cache) == 1
+
+
+def test_updated_definitions_leave_the_constructor_cache():
+    dimensions = {'airport': str, 'model': str, 'gate': int}
+    metrics = {'price': float}
+    query = MetricsTable('flights_cached', dimensions, metrics, {})
+    watcher = SchemaWatcher(query.definition, get_evolved_schema)
+
+    assert watcher.refresh().removed == {'model'}
+    assert 'model' not in query.columns
+
+    # The constructor builds a definition matching its own column dicts again
+    rebuilt = MetricsTable('flights_cached', dimensions, metrics, {})
+    assert rebuilt.definition is not query.definition
+    rebuilt.select('COUNT(*)').filter_column_by_value('model', 'B777')
+    assert rebuilt.get_sql_query() == "SELECT COUNT(*) FROM flights_cached WHERE model='B777'"
+    assert MetricsTable('flights_cached', dimensions, metrics, {}).definition is rebuilt.definition
+
+
+def test_schema_watcher_thread():
+    definition = MetricsTableDefinition.from_schema('flights', test_schema)
+    errors = []
+    with SchemaWatcher(definition, get_evolved_schema, poll_seconds=0.01, on_error=errors.append) as watcher:
+        for _ in range(500):
+            if 'distance' in definition.metrics:
+                break
+            watcher._stopped.wait(0.01)
+    assert 'distance' in definition.metrics
+    assert errors == []
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from sommelier.broker import BrokerResponse
+from sommelier.spill import ColumnarSpillWriter, DictionaryColumn, RawColumn, spill_responses
+
+
+def get_page(rows):
+    return BrokerResponse('SELECT ...', {
+        'resultTable': {
+            'dataSchema': {'columnNames': ['airport', 'price', 'sum(distance)', 'cancelled', 'tags'],
+                           'columnDataTypes': ['STRING', 'LONG', 'DOUBLE', 'BOOLEAN', 'STRING']},
+            'rows': rows
+        }
+    })
+
+
+def test_spill_responses():
+    pages = [
+        get_page([['SFO', 10, 1.5, False, ['a']], ['JFK', 20, 2.5, True, ['a', 'b']]]),
+        get_page([['SFO', 30, 3.5, False, []]]),
+    ]
+    first_page = pages[0]
+
+    with spill_responses(iter(pages), {'airport': str, 'price': int}, buffer_rows=2) as result:
+        assert first_page.rows == []
+        assert len(result) == 3
+
+        prices = result.column('price')
+        assert isinstance(prices, memoryview)
+        assert prices.format == 'q'
+        assert list(prices) == [10, 20, 30]
+        assert result.column('sum(distance)').tolist() == [1.5, 2.5, 3.5]
+
+        airports = result.column('airport')
+        assert isinstance(airports, DictionaryColumn)
+        assert airports.dictionary == ['SFO', 'JFK']
+        assert list(airports.codes) == [0, 1, 0]
+        assert airports[2] == 'SFO'
+
+        assert list(result.iter_rows()) == [('SFO', 10, 1.5, False, ('a',)),
+                                            ('JFK', 20, 2.5, True, ('a', 'b')),
+                                            ('SFO', 30, 3.5, False, ())]
+        directory = result.directory
+        assert os.path.exists(directory)
+
+    assert not os.path.exists(directory)
+    with pytest.raises(ValueError):
+        prices[0]
+
+
+def test_writer(tmp_path):
+    writer = ColumnarSpillWriter(['id', 'score'], [int, float], directory=str(tmp_path))
+    writer.extend([index, index / 2] for index in range(100000))
+    result = writer.finish()
+
+    assert len(result) == 100000
+    assert os.path.getsize(tmp_path / '0.col') == 800000
+    assert sum(result.column('id')) == sum(range(100000))
+    assert result.column(1)[99999] == 49999.5
+    result.close()
+    assert os.path.exists(tmp_path / '0.col')
+
+    with spill_responses([], {}) as empty:
+        assert len(empty) == 0
+        assert list(empty.iter_rows()) == []
+
+    with pytest.raises(ValueError):
+        ColumnarSpillWriter(['id'], [int, str])
+
+
+def test_spill_nulls_and_big_decimals():
+    page = BrokerResponse('SELECT ...', {
+        'resultTable': {
+            'dataSchema': {'columnNames': ['price', 'cancelled', 'amount', 'airport'],
+                           'columnDataTypes': ['LONG', 'BOOLEAN', 'BIG_DECIMAL', 'STRING']},
+            'rows': [[None if index % 3 == 0 else index, None if index == 9 else index % 2 == 0,
+                      f'{index}.1234567890123456789', None if index == 5 else 'SFO'] for index in range(20)]
+        }
+    })
+
+    with spill_responses([page], {'price': int, 'amount': float}, buffer_rows=3) as result:
+        prices = list(result.column('price'))
+        assert prices == [None if index % 3 == 0 else index for index in range(20)]
+        assert result.column('price')[-1] == 19
+        assert result.column('cancelled')[9] is None
+        assert result.column('cancelled')[10] is True
+        assert result.column('amount')[1] == '1.1234567890123456789'
+        assert result.column('airport')[5] is None
+        assert len(list(result.iter_rows())) == 20
+
+
+def test_spill_high_cardinality_strings(tmp_path):
+    writer = ColumnarSpillWriter(['id', 'tags'], [str, str], directory=str(tmp_path), buffer_rows=7,
+                                 max_dictionary_size=10)
+    writer.extend([f'id_{index}', ['a', str(index % 2)]] for index in range(100))
+    result = writer.finish()
+
+    ids = result.column('id')
+    assert isinstance(ids, RawColumn)
+    assert list(ids) == [f'id_{index}' for index in range(100)]
+    assert ids[0] == 'id_0'
+    assert ids[-1] == 'id_99'
+
+    # Low cardinality columns stay dictionary encoded
+    tags = result.column('tags')
+    assert isinstance(tags, DictionaryColumn)
+    assert tags.dictionary == [('a', '0'), ('a', '1')]
+    assert list(result.iter_rows())[3] == ('id_3', ('a', '1'))
+    result.close()
@@ -0,0 +1,36 @@
+import pytest
+
+from sommelier.sql_parser import SqlSyntaxError, parse_sql
+
+
+def test_parse_sql():
+    statement = parse_sql("SELECT COUNT(*),DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', '1:DAYS:EPOCH', '1:DAYS') AS day "
+                          "FROM flights WHERE (airport='O''Hare' OR price>=1.5) AND model NOT IN ('A','B') "
+                          "AND regexp_like(flight_number, 'UA.*1') GROUP BY day ORDER BY COUNT(*) DESC LIMIT 5")
+
+    assert statement.table_name == 'flights'
+    assert [item.expression.text for item in statement.select] == [
+        'COUNT(*)', "DATETIMECONVERT(ms, '1:MILLISECONDS:EPOCH', '1:DAYS:EPOCH', '1:DAYS')"]
+    assert statement.select[1].alias == 'day'
+    assert statement.select[1].expression.columns() == ['ms']
+
+    where = statement.where
+    assert where.kind == 'and'
+    left, regex = where.children
+    assert regex.kind == 'function' and regex.operator == 'REGEXP_LIKE'
+    in_list = left.children[1]
+    assert in_list.kind == 'in' and in_list.negated and in_list.value == ('A', 'B')
+    equals, greater = left.children[0].children
+    assert (equals.operator, equals.value) == ('=', "O'Hare")
+    assert (greater.operator, greater.value) == ('>=', 1.5)
+
+    assert [expression.text for expression in statement.group_by] == ['day']
+    assert [(expression.text, descending) for expression, descending in statement.order_by] == [('COUNT(*)', True)]
+    assert statement.limit == 5
+
+
+def test_syntax_errors():
+    for sql in ('SELECT FROM flights', 'SELECT a FROM flights WHERE', 'SELECT a FROM flights LIMIT x',
+                'SELECT a FROM flights WHERE a # 1', 'SELECT a FROM flights HAVING a>1'):
+        with pytest.raises(SqlSyntaxError):
+            parse_sql(sql)